@@ -0,0 +1,3 @@
+"""
+Benchmarks that run the scripts against a local mock of the T3 API.
+"""
@@ -0,0 +1,64 @@
+"""
+Compare decode time and memory per record for each installed JSON decoder.
+
+Pages of packages like the mock server's are decoded into plain dicts with
+every installed decoder, and into compact ``t3.records.Package`` records::
+
+    python -m benchmarks.bench_decoding --records 100000 --payload-bytes 256
+"""
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+from benchmarks.mock_server import MockConfig, MockState, paginate
+from t3 import decoding
+from t3.records import Package
+
+
+def measure(decode, body, pages):
+    """
+    :return: Seconds to decode ``pages`` copies of ``body``, and bytes kept alive by one decoded page.
+    """
+    decode(body)  # Warm up, e.g. building msgspec decoders
+    gc.collect()
+    start = time.perf_counter()
+    for _ in range(pages):
+        decode(body)
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    page = decode(body)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del page
+    return elapsed, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON decoding of package pages.")
+    parser.add_argument("--records", type=int, default=100000, help="total packages to decode")
+    parser.add_argument("--page-size", type=int, default=500, help="packages per page")
+    parser.add_argument("--payload-bytes", type=int, default=256, help="filler bytes per package")
+    args = parser.parse_args()
+
+    state = MockState(MockConfig(packages=args.page_size, payload_bytes=args.payload_bytes))
+    page = paginate(lambda index: state.package(0, index), args.page_size, {"pageSize": args.page_size})
+    body = json.dumps(page).encode()
+    pages = max(1, args.records // args.page_size)
+
+    candidates = [(f"{name} dicts", decoding.DECODERS[name]) for name in sorted(decoding.DECODERS)]
+    candidates.append(("Package records", lambda data: decoding.decode(data, Package)))
+
+    print(f"{pages} pages of {args.page_size} packages, {len(body) / 1024:.0f} KiB per page")
+    print(f"{'decoder':>24}  {'records/s':>10}  {'bytes/record':>12}")
+    for label, decode in candidates:
+        elapsed, retained = measure(decode, body, pages)
+        print(f"{label:>24}  {pages * args.page_size / elapsed:>10.0f}  {retained / args.page_size:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
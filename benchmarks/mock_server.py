@@ -0,0 +1,429 @@
+"""
+A local stand-in for the T3 API, for benchmarking the scripts without touching Metrc.
+
+Records are generated on the fly from their index, so the server uses the
+same small amount of memory whether it serves a hundred packages or millions.
+Run it on its own and point the scripts at it with ``T3_API_BASE_URL``::
+
+    python -m benchmarks.mock_server --port 8000 --packages 100000 --latency 0.05
+    T3_API_BASE_URL=http://127.0.0.1:8000 python load_all_active_packages.py
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_PAGE_SIZE = 100  # Records per page when the request doesn't give a pageSize
+MAX_PAGE_SIZE = 500  # Largest pageSize the server honors
+LAST_MODIFIED = "2024-01-01T00:00:00+00:00"  # lastModified value of every generated record
+MANIFEST_BASE = 1000000000  # Manifest numbers are this plus the license and transfer index
+
+
+class MockConfig:
+    """
+    The shape of the data the mock server serves and how it behaves.
+    """
+
+    def __init__(
+        self,
+        licenses=1,
+        packages=1000,
+        transfers=100,
+        deliveries=2,
+        packages_per_delivery=5,
+        distinct_packages=0,
+        payload_bytes=256,
+        pdf_bytes=50 * 1024,
+        latency=0.0,
+        latency_jitter=0.0,
+        throttle_rate=0.0,
+        retry_after=1,
+        compress=False,
+    ):
+        """
+        :param licenses: Number of licenses.
+        :param packages: Number of active packages per license.
+        :param transfers: Number of active outgoing transfers per license.
+        :param deliveries: Number of deliveries per transfer.
+        :param packages_per_delivery: Number of packages per delivery, each with one lab result document.
+        :param distinct_packages: Number of package IDs that deliveries cycle through, or 0 for a new package on every line.
+        :param payload_bytes: Size of the filler text in each package and transfer record.
+        :param pdf_bytes: Size of each manifest and lab result PDF.
+        :param latency: Seconds to wait before answering each request.
+        :param latency_jitter: Up to this many extra seconds, chosen at random, to wait per request.
+        :param throttle_rate: Fraction of requests to answer with a 429.
+        :param retry_after: ``Retry-After`` seconds sent with each 429.
+        :param compress: Whether to gzip JSON responses when the client accepts it.
+        """
+        self.licenses = licenses
+        self.packages = packages
+        self.transfers = transfers
+        self.deliveries = deliveries
+        self.packages_per_delivery = packages_per_delivery
+        self.distinct_packages = distinct_packages
+        self.payload_bytes = payload_bytes
+        self.pdf_bytes = pdf_bytes
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.compress = compress
+
+
+def make_access_token(lifetime=3600):
+    """
+    Build an unsigned JWT-shaped token that expires after ``lifetime`` seconds.
+    """
+
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+    return ".".join([encode({"alg": "none"}), encode({"exp": int(time.time()) + lifetime}), "mock"])
+
+
+def make_pdf(size):
+    """
+    Build a minimal PDF padded out to ``size`` bytes.
+    """
+    head = b"%PDF-1.4\n"
+    tail = b"\n%%EOF\n"
+    return head + b"%" * max(0, size - len(head) - len(tail)) + tail
+
+
+def license_number(index):
+    return f"LIC-{index + 1:05d}"
+
+
+def license_index(number):
+    try:
+        return int(number.split("-")[1]) - 1
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class MockState:
+    """
+    Generates the records the mock server serves, and counts the requests it answers.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.pdf = make_pdf(config.pdf_bytes)
+        self.filler = "x" * config.payload_bytes
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def count(self, throttled=False):
+        with self._lock:
+            self.requests += 1
+            if throttled:
+                self.throttled += 1
+
+    def license(self, index):
+        return {
+            "id": index + 1,
+            "licenseNumber": license_number(index),
+            "licenseName": f"Mock License {index + 1}",
+            "hostname": "ca.metrc.com",
+        }
+
+    def package(self, license, index):
+        package_id = license * self.config.packages + index + 1
+        return {
+            "id": package_id,
+            "label": f"1A4000000000000{package_id:09d}",
+            "packageType": "Product",
+            "quantity": float(index % 100),
+            "unitOfMeasureName": "Each",
+            "lastModified": LAST_MODIFIED,
+            "item": {"id": index % 500, "name": f"Item {index % 500}", "productCategoryName": "Flower"},
+            "notes": self.filler,
+        }
+
+    def transfer(self, license, index):
+        return {
+            "id": license * self.config.transfers + index + 1,
+            "manifestNumber": str(MANIFEST_BASE + license * self.config.transfers + index),
+            "shipperFacilityLicenseNumber": license_number(license),
+            "deliveryCount": self.config.deliveries,
+            "lastModified": LAST_MODIFIED,
+            "notes": self.filler,
+        }
+
+    def deliveries(self, manifest_number):
+        transfer = int(manifest_number) - MANIFEST_BASE
+        return [
+            {"id": transfer * self.config.deliveries + index + 1, "manifestNumber": manifest_number}
+            for index in range(self.config.deliveries)
+        ]
+
+    def delivery_packages(self, delivery_id):
+        first = (delivery_id - 1) * self.config.packages_per_delivery
+        package_ids = range(first, first + self.config.packages_per_delivery)
+        if self.config.distinct_packages:
+            package_ids = [package_id % self.config.distinct_packages for package_id in package_ids]
+        return [
+            {"packageId": package_id + 1, "packageLabel": f"1A4000000000000{package_id + 1:09d}"}
+            for package_id in package_ids
+        ]
+
+    def lab_results(self, package_id):
+        return [{"id": package_id, "packageId": package_id, "labTestResultDocumentFileId": package_id}]
+
+
+def paginate(make_record, total, query, filters=()):
+    """
+    Build one page of generated records, honoring ``page``, ``pageSize`` and ``lastModified`` range filters.
+    """
+    page = max(1, int(query.get("page", 1)))
+    page_size = min(MAX_PAGE_SIZE, max(1, int(query.get("pageSize", DEFAULT_PAGE_SIZE))))
+
+    for filter_value in filters:
+        field, value = filter_value.split(":", 1)
+        if (field == "lastModified__gte" and value > LAST_MODIFIED) or (
+            field == "lastModified__lte" and value < LAST_MODIFIED
+        ):
+            total = 0
+
+    start = (page - 1) * page_size
+    data = [make_record(index) for index in range(start, min(total, start + page_size))]
+    return {"data": data, "total": total, "page": page, "pageSize": page_size}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep connections alive like the real API
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        headers = {}
+        if self.state.config.compress and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=1)
+            headers["Content-Encoding"] = "gzip"
+        self.send_body(status, body, "application/json", headers)
+
+    def send_pdf(self):
+        pdf = self.state.pdf
+        etag = f'"pdf-{len(pdf)}"'
+        range_header = self.headers.get("Range", "")
+        if_range = self.headers.get("If-Range")
+        if range_header.startswith("bytes=") and if_range in (None, etag):
+            offset = int(range_header[len("bytes=") :].split("-")[0])
+            if offset >= len(pdf):
+                self.send_body(416, b"", "application/pdf", {"Content-Range": f"bytes */{len(pdf)}"})
+                return
+            headers = {"Content-Range": f"bytes {offset}-{len(pdf) - 1}/{len(pdf)}", "ETag": etag}
+            self.send_body(206, pdf[offset:], "application/pdf", headers)
+            return
+        self.send_body(200, pdf, "application/pdf", {"ETag": etag})
+
+    def simulate_network(self):
+        """
+        Wait out the configured latency, and return True if this request should be throttled.
+        """
+        config = self.state.config
+        if config.latency or config.latency_jitter:
+            time.sleep(config.latency + random.uniform(0, config.latency_jitter))
+
+        throttled = random.random() < config.throttle_rate
+        self.state.count(throttled)
+        if throttled:
+            self.send_json({"message": "Too many requests"}, status=429)
+        return throttled
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.simulate_network():
+            return
+        if urlsplit(self.path).path != "/v2/auth/credentials":
+            self.send_json({"message": "Not found"}, status=404)
+            return
+        if not body.get("hostname") or not body.get("username") or not body.get("password"):
+            self.send_json({"message": "Missing credentials"}, status=400)
+            return
+        self.send_json({"accessToken": make_access_token()})
+
+    def do_GET(self):
+        if self.simulate_network():
+            return
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self.send_json({"message": "Unauthorized"}, status=401)
+            return
+
+        url = urlsplit(self.path)
+        parsed = parse_qs(url.query)
+        query = {key: values[0] for key, values in parsed.items()}
+        filters = parsed.get("filter", [])
+        state = self.state
+        config = state.config
+        license = license_index(query.get("licenseNumber"))
+
+        if url.path == "/v2/licenses":
+            self.send_json([state.license(index) for index in range(config.licenses)])
+        elif url.path in ("/v2/packages/active", "/v2/transfers/outgoing/active") and (
+            license is None or not 0 <= license < config.licenses
+        ):
+            self.send_json({"message": "Unknown license"}, status=403)
+        elif url.path == "/v2/packages/active":
+            self.send_json(paginate(lambda index: state.package(license, index), config.packages, query, filters))
+        elif url.path == "/v2/transfers/outgoing/active":
+            manifest_filters = [value for value in filters if value.startswith("manifestNumber__contains:")]
+            if manifest_filters:
+                index = int(manifest_filters[0].split(":", 1)[1]) - MANIFEST_BASE - license * config.transfers
+                data = [state.transfer(license, index)] if 0 <= index < config.transfers else []
+                self.send_json({"data": data, "total": len(data), "page": 1, "pageSize": DEFAULT_PAGE_SIZE})
+            else:
+                self.send_json(
+                    paginate(lambda index: state.transfer(license, index), config.transfers, query, filters)
+                )
+        elif url.path == "/v2/transfers/deliveries":
+            self.send_json({"data": state.deliveries(query["manifestNumber"])})
+        elif url.path == "/v2/transfers/packages":
+            self.send_json({"data": state.delivery_packages(int(query["deliveryId"]))})
+        elif url.path == "/v2/packages/labresults":
+            self.send_json({"data": state.lab_results(int(query["packageId"]))})
+        elif url.path in ("/v2/transfers/manifest", "/v2/packages/labresults/document"):
+            self.send_pdf()
+        else:
+            self.send_json({"message": "Not found"}, status=404)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config, host="127.0.0.1", port=0):
+        """
+        :param config: The MockConfig to serve.
+        :param host: The address to listen on.
+        :param port: The port to listen on, or 0 to pick a free one.
+        """
+        super().__init__((host, port), MockHandler)
+        self.state = MockState(config)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Serve requests on a background thread.
+
+        :return: The server, for chaining.
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections is routine, not worth a traceback
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def add_config_arguments(parser):
+    """
+    Add a command line option for each MockConfig setting.
+    """
+    defaults = MockConfig()
+    parser.add_argument("--licenses", type=int, default=defaults.licenses, help="number of licenses")
+    parser.add_argument("--packages", type=int, default=defaults.packages, help="active packages per license")
+    parser.add_argument("--transfers", type=int, default=defaults.transfers, help="outgoing transfers per license")
+    parser.add_argument("--deliveries", type=int, default=defaults.deliveries, help="deliveries per transfer")
+    parser.add_argument(
+        "--packages-per-delivery", type=int, default=defaults.packages_per_delivery, help="packages per delivery"
+    )
+    parser.add_argument(
+        "--distinct-packages",
+        type=int,
+        default=defaults.distinct_packages,
+        help="package IDs that deliveries cycle through, so packages repeat across transfers (default: all distinct)",
+    )
+    parser.add_argument(
+        "--payload-bytes", type=int, default=defaults.payload_bytes, help="filler bytes per package and transfer"
+    )
+    parser.add_argument("--pdf-bytes", type=int, default=defaults.pdf_bytes, help="size of each PDF")
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="seconds to wait per request")
+    parser.add_argument(
+        "--latency-jitter", type=float, default=defaults.latency_jitter, help="up to this many extra seconds per request"
+    )
+    parser.add_argument(
+        "--throttle-rate", type=float, default=defaults.throttle_rate, help="fraction of requests to answer with 429"
+    )
+    parser.add_argument("--retry-after", type=int, default=defaults.retry_after, help="Retry-After seconds for 429s")
+    parser.add_argument("--compress", action="store_true", help="gzip JSON responses")
+
+
+def config_from_args(args, **overrides):
+    """
+    Build a MockConfig from parsed command line options.
+    """
+    settings = {
+        "licenses": args.licenses,
+        "packages": args.packages,
+        "transfers": args.transfers,
+        "deliveries": args.deliveries,
+        "packages_per_delivery": args.packages_per_delivery,
+        "distinct_packages": args.distinct_packages,
+        "payload_bytes": args.payload_bytes,
+        "pdf_bytes": args.pdf_bytes,
+        "latency": args.latency,
+        "latency_jitter": args.latency_jitter,
+        "throttle_rate": args.throttle_rate,
+        "retry_after": args.retry_after,
+        "compress": args.compress,
+    }
+    settings.update(overrides)
+    return MockConfig(**settings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local mock of the T3 API.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockServer(config_from_args(args), args.host, args.port)
+    print(f"Mock T3 API listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Time the export and download flows against the local mock T3 API.
+
+Each scenario starts a mock server shaped for it, then runs the real script
+functions in a fresh child process so its wall time and peak memory are
+measured on their own. For example::
+
+    python -m benchmarks.run_benchmarks --packages 100000 --pdfs 5000 --latency 0.05
+
+The ``packages-default-rate`` scenario runs the package export with the
+client's shipped rate limiter, so its pacing is measured too. The others let
+the client go up to ``--max-rate``.
+
+Peak RSS is read with the ``resource`` module, so this only runs on Unix.
+"""
+
+import argparse
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.mock_server import MANIFEST_BASE, MockServer, add_config_arguments, config_from_args, license_number
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("packages", "packages-default-rate", "packages-parallel", "manifests", "coas", "lab-results")
+DEFAULT_RATE_SCENARIOS = ("packages-default-rate",)  # Scenarios paced by the shipped rate limiter, ignoring --max-rate
+MAX_RATE = 1000.0  # Requests per second the client may reach, so the mock API rather than pacing is measured
+
+
+def mock_config(scenario, args):
+    """
+    Shape the mock data so a scenario exports ``--packages`` packages or downloads ``--pdfs`` PDFs.
+    """
+    if scenario in ("packages", "packages-default-rate", "packages-parallel"):
+        return config_from_args(args, licenses=1)
+    if scenario == "lab-results":
+        return config_from_args(args, licenses=1)
+    if scenario == "manifests":
+        return config_from_args(args, transfers=math.ceil(args.pdfs / args.licenses))
+    return config_from_args(
+        args, licenses=1, transfers=1, packages_per_delivery=math.ceil(args.pdfs / args.deliveries)
+    )
+
+
+def count_files(directory, suffix=".pdf"):
+    count = 0
+    for _, _, files in os.walk(directory):
+        count += sum(1 for name in files if name.endswith(suffix))
+    return count
+
+
+def run_scenario(scenario, max_rate):
+    """
+    Run one scenario in this process against the server in ``T3_API_BASE_URL``.
+
+    :return: The number of records written or PDFs downloaded.
+    """
+    from t3.auth import get_token_manager
+    from t3.client import T3Client, set_client
+    from t3.metrics import get_metrics
+    from t3.rate_limit import AdaptiveRateLimiter
+
+    if scenario in DEFAULT_RATE_SCENARIOS:
+        max_rate = None
+    rate_limiter = AdaptiveRateLimiter(rate=max_rate, max_rate=max_rate) if max_rate else None
+    set_client(T3Client(rate_limiter=rate_limiter, metrics=get_metrics()))
+    access_token = get_token_manager("ca.metrc.com", "benchmark", lambda: "password")
+
+    if scenario in ("packages", "packages-default-rate"):
+        import load_all_active_packages
+        from t3.csv_writer import write_pages_to_csv
+
+        pages = load_all_active_packages.iter_package_pages(access_token, license_number(0))
+        return write_pages_to_csv(pages, os.path.join("output", "packages.csv"))
+
+    if scenario == "packages-parallel":
+        import load_all_active_packages
+
+        output_file = os.path.join("output", "packages.csv")
+        return load_all_active_packages.export_packages_in_parallel(
+            access_token, license_number(0), output_file, os.cpu_count()
+        )
+
+    if scenario == "lab-results":
+        import write_one_license_transfer_lab_results_to_csv as lab_results
+        from t3.sinks import open_sink
+
+        sink = open_sink("csv", os.path.join("output", "transfer_lab_results.csv"), table="transfer_lab_results")
+        written, _ = lab_results.export_transfer_lab_results(access_token, license_number(0), sink)
+        return written
+
+    if scenario == "manifests":
+        import download_all_outgoing_manifests as manifests
+
+        license_numbers = [license["licenseNumber"] for license in manifests.get_licenses(access_token)]
+        manifests.download_all_manifests(access_token, license_numbers)
+        return count_files(os.path.join(manifests.OUTPUT_DIR, "manifests"))
+
+    import download_all_transfer_coa_pdfs as coas
+
+    os.makedirs(coas.OUTPUT_DIR, exist_ok=True)
+    destinations = coas.get_transfer_destinations(access_token, license_number(0), str(MANIFEST_BASE))
+    coas.download_destination_coa_pdfs(access_token, license_number(0), destinations)
+    return count_files(coas.OUTPUT_DIR)
+
+
+def run_child(args):
+    """
+    Run a scenario and write its measurements to ``--result-file``.
+    """
+    from t3.metrics import get_metrics
+
+    start = time.perf_counter()
+    items = run_scenario(args.run_scenario, args.max_rate)
+    wall_time = time.perf_counter() - start
+
+    summary = get_metrics().summary()
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    result = {
+        "wall_seconds": wall_time,
+        "items": items,
+        "requests": summary["requests"],
+        "requests_per_second": summary["requests"] / wall_time,
+        "retries": sum(endpoint["retries"] for endpoint in summary["endpoints"].values()),
+        "errors": sum(endpoint["errors"] for endpoint in summary["endpoints"].values()),
+        "bytes": summary["bytes"],
+        "peak_rss_bytes": peak_rss,
+        "write_seconds": summary["phase_seconds"].get("write", 0.0),
+        "endpoints": summary["endpoints"],
+    }
+    with open(args.result_file, "w") as file:
+        json.dump(result, file)
+
+
+def benchmark(scenario, args):
+    """
+    Start a mock server for a scenario, run the scenario in a child process and collect its results.
+    """
+    config = mock_config(scenario, args)
+    expected = {
+        "packages": config.packages,
+        "packages-default-rate": config.packages,
+        "packages-parallel": config.packages,
+        "manifests": config.licenses * config.transfers,
+        "coas": config.deliveries * config.packages_per_delivery,
+        "lab-results": config.transfers * config.deliveries * config.packages_per_delivery,
+    }[scenario]
+
+    server = MockServer(config).start()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            result_file = os.path.join(workdir, "result.json")
+            env = dict(
+                os.environ,
+                T3_API_BASE_URL=server.base_url,
+                HOME=workdir,  # Keep tokens and cached responses away from the real ones
+                PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])),
+            )
+            command = [
+                sys.executable,
+                "-m",
+                "benchmarks.run_benchmarks",
+                "--run-scenario",
+                scenario,
+                "--result-file",
+                result_file,
+                "--max-rate",
+                str(args.max_rate),
+            ]
+            # The scripts print a line per item, which would only slow the run down
+            subprocess.run(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, check=True)
+            with open(result_file) as file:
+                result = json.load(file)
+    finally:
+        server.stop()
+
+    result["scenario"] = scenario
+    result["expected_items"] = expected
+    result["server_requests"] = server.state.requests
+    result["server_throttled"] = server.state.throttled
+    return result
+
+
+def print_report(results):
+    columns = ("scenario", "items", "wall s", "requests", "req/s", "retries", "MiB in", "peak RSS MiB", "write s")
+    rows = [
+        (
+            result["scenario"],
+            f"{result['items']}/{result['expected_items']}",
+            f"{result['wall_seconds']:.2f}",
+            str(result["requests"]),
+            f"{result['requests_per_second']:.1f}",
+            str(result["retries"]),
+            f"{result['bytes'] / 2**20:.1f}",
+            f"{result['peak_rss_bytes'] / 2**20:.1f}",
+            f"{result['write_seconds']:.2f}",
+        )
+        for result in results
+    ]
+    widths = [max(len(column), *(len(row[index]) for row in rows)) for index, column in enumerate(columns)]
+    for row in (columns, *rows):
+        print("  ".join(value.rjust(width) for value, width in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scripts against a local mock T3 API.")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario", help=f"scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--pdfs", type=int, default=5000, help="PDFs to download in the manifests and coas scenarios")
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=MAX_RATE,
+        help="client rate limit in requests per second, or 0 for the scripts' adaptive default",
+    )
+    parser.add_argument("--output", help="also write the full results to this JSON file")
+    parser.add_argument("--run-scenario", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    add_config_arguments(parser)
+    parser.set_defaults(packages=100000, licenses=5, deliveries=50)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        run_child(args)
+        return
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = []
+    for scenario in args.scenarios or SCENARIOS:
+        print(f"Running {scenario}...", flush=True)
+        results.append(benchmark(scenario, args))
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
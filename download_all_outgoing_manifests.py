@@ -1,34 +1,48 @@
+import argparse
 import csv
 import getpass
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import requests
 
+from t3.auth import get_token_manager
+from t3.checkpoint import CheckpointJournal
+from t3.client import get_client
+from t3.concurrency import CappedQueue, Progress, TaskGroup
+from t3.downloads import download_to_file
+from t3.pagination import get_all_records
+from t3.records import License
+
 # Constants
-BASE_URL = "https://api.trackandtrace.tools"
 USERNAME = "YOUR_USERNAME"  # Replace with your actual username
 HOSTNAME = "ca.metrc.com"  # Update this to your specific Metrc hostname
 OUTPUT_DIR = "output"  # Directory to store the output files
+CHECKPOINT_DIR = os.path.join(OUTPUT_DIR, ".checkpoints")  # Progress journals used by --resume
+MAX_WORKERS = 16  # Maximum number of concurrent requests across all licenses
+MAX_WORKERS_PER_LICENSE = 4  # Maximum number of concurrent manifest downloads per license
+TRANSFERS_ENDPOINT = "/v2/transfers/outgoing/active"
 
-def get_access_token(hostname, username, password, otp=None):
+def get_access_token(hostname, username):
     """
-    Obtain an access token for API authentication.
+    Create a token manager that provides access tokens for API authentication.
+
+    Tokens are cached between runs and refreshed before they expire, so the
+    password (and OTP if required) is only prompted for when a new token is needed.
 
     :param hostname: The hostname of the Metrc instance.
     :param username: The username for authentication.
-    :param password: The password for authentication.
-    :param otp: One-Time Password, if required.
-    :return: Access token as a string.
+    :return: A TokenManager, which can be used anywhere an access token is expected.
     """
-    url = f"{BASE_URL}/v2/auth/credentials"
-    data = {"hostname": hostname, "username": username, "password": password}
-    if otp:
-        data["otp"] = otp
+    def prompt_password():
+        return getpass.getpass(prompt=f"Password for {hostname}/{username}: ")
+
+    def prompt_otp():
+        return getpass.getpass(prompt="OTP: ")
 
-    response = requests.post(url, json=data)
-    response.raise_for_status()
-    return response.json()["accessToken"]
+    otp_provider = prompt_otp if hostname == "mi.metrc.com" else None  # Check if OTP is required
+    return get_token_manager(hostname, username, prompt_password, otp_provider)
 
 
 def get_licenses(access_token):
@@ -38,33 +52,21 @@ def get_licenses(access_token):
     :param access_token: The access token for authentication.
     :return: A list of license data.
     """
-    url = f"{BASE_URL}/v2/licenses"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return get_client().get_json("/v2/licenses", access_token, record_type=License)
 
 
 def get_outgoing_transfers(access_token, license_number):
     """
-    Retrieve a list of outgoing transfers for a specific license.
+    Retrieve every outgoing transfer for a specific license.
+
+    All pages are loaded, several at a time, the same way as packages.
 
     :param access_token: The access token for authentication.
     :param license_number: The license number to query.
-    :return: A list of outgoing transfers.
+    :return: A list of outgoing transfers, and the total number of transfers the API reported, or None if it didn't.
     """
-    url = f"{BASE_URL}/v2/transfers/outgoing/active"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
     params = {"licenseNumber": license_number}
-    response = requests.get(url, headers=headers, params=params)
-    response.raise_for_status()
-    return response.json()["data"]
+    return get_all_records(TRANSFERS_ENDPOINT, access_token, params)
 
 
 def download_manifest_pdf(access_token, license_number, manifest_number):
@@ -74,48 +76,95 @@ def download_manifest_pdf(access_token, license_number, manifest_number):
     :param access_token: The access token for authentication.
     :param license_number: The license number.
     :param manifest_number: The manifest number of the transfer.
+    :return: The file path the PDF was written to.
     """
-    url = f"{BASE_URL}/v2/transfers/manifest"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
-    params = {"licenseNumber": license_number, "manifestNumber": manifest_number}
-    response = requests.get(url, headers=headers, params=params)
-    response.raise_for_status()
-
     license_dir = os.path.join(OUTPUT_DIR, "manifests", license_number)
     os.makedirs(license_dir, exist_ok=True)
 
     pdf_path = os.path.join(license_dir, f"{manifest_number}.pdf")
-    with open(pdf_path, "wb") as file:
-        file.write(response.content)
-    print(f"Downloaded manifest PDF: {pdf_path}")
+    params = {"licenseNumber": license_number, "manifestNumber": manifest_number}
+    download_to_file("/v2/transfers/manifest", access_token, pdf_path, params=params)
+    return pdf_path
+
+def download_all_manifests(
+    access_token,
+    license_numbers,
+    max_workers=MAX_WORKERS,
+    max_workers_per_license=MAX_WORKERS_PER_LICENSE,
+    journal=None,
+):
+    """
+    Download the manifest PDFs for every outgoing transfer of several licenses.
+
+    Licenses are processed concurrently. Each license's manifests go into its
+    own work queue, which keeps at most ``max_workers_per_license`` downloads
+    running for that license, while ``max_workers`` caps the downloads running
+    across all licenses. A progress line is printed as each manifest finishes.
+    Manifests recorded in the journal are skipped, and each new download is
+    recorded once it is complete.
 
+    :param access_token: The access token for authentication.
+    :param license_numbers: The license numbers to download manifests for.
+    :param max_workers: Maximum number of concurrent requests overall.
+    :param max_workers_per_license: Maximum number of concurrent downloads per license.
+    :param journal: A CheckpointJournal of completed manifests, if resuming is wanted.
+    """
+    tasks = TaskGroup()
+    progress = Progress("manifests")
+
+    def download(license_number, manifest_number):
+        key = f"{license_number}/{manifest_number}"
+        if journal is not None and journal.is_done("manifest", key):
+            progress.done(f"Skipped already downloaded manifest: {key}")
+            return
+
+        pdf_path = download_manifest_pdf(access_token, license_number, manifest_number)
+        if journal is not None:
+            journal.mark_done("manifest", key)
+        progress.done(f"Downloaded manifest PDF: {pdf_path}")
+
+    def queue_license(license_number):
+        outgoing_transfers, total = get_outgoing_transfers(access_token, license_number)
+        progress.add(len(outgoing_transfers))
+        print(f"Queued {len(outgoing_transfers)} manifests for {license_number}")
+        if total is not None and len(outgoing_transfers) != total:
+            # Transfers created or closed while paging can shift records between pages
+            print(f"Warning: the API reported {total} outgoing transfers for {license_number}, but {len(outgoing_transfers)} were loaded")
+
+        license_queue = CappedQueue(tasks, executor, max_workers_per_license)
+        for transfer in outgoing_transfers:
+            license_queue.put(download, license_number, transfer["manifestNumber"])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for license_number in license_numbers:
+            tasks.submit(executor, queue_license, license_number)
+        tasks.wait()
 
 
 def main():
     """
     Main function to run the script.
     """
+    parser = argparse.ArgumentParser(description="Download the manifest PDFs for every outgoing transfer.")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the manifests an interrupted run already downloaded",
+    )
+    args = parser.parse_args()
+
     # Ensure the output directory exists
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    password = getpass.getpass(prompt=f"Password for {HOSTNAME}/{USERNAME}: ")
-    otp = None
-    if HOSTNAME == "mi.metrc.com":  # Check if OTP is required
-        otp = getpass.getpass(prompt="OTP: ")
     try:
-        access_token = get_access_token(HOSTNAME, USERNAME, password, otp)
+        access_token = get_access_token(HOSTNAME, USERNAME)
         licenses = get_licenses(access_token)
 
         # Download manifest PDFs for each license's outgoing transfers
-        for license in licenses:
-            license_number = license["licenseNumber"]
-            outgoing_transfers = get_outgoing_transfers(access_token, license_number)
-            for transfer in outgoing_transfers:
-                manifest_number = transfer["manifestNumber"]
-                download_manifest_pdf(access_token, license_number, manifest_number)
+        license_numbers = [license["licenseNumber"] for license in licenses]
+        journal = CheckpointJournal(os.path.join(CHECKPOINT_DIR, "manifests.jsonl"), resume=args.resume)
+        download_all_manifests(access_token, license_numbers, journal=journal)
+        journal.close(completed=True)
 
     except requests.exceptions.HTTPError as e:
         print(f"HTTP error occurred: {e}")
@@ -1,113 +1,164 @@
+import argparse
 import getpass
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import requests
 
+from t3.auth import get_token_manager
+from t3.checkpoint import CheckpointJournal
+from t3.client import get_client
+from t3.concurrency import TaskGroup
+from t3.document_cache import DocumentCache
+from t3.downloads import download_to_file
+from t3.query import Query
+from t3.records import License
+
 # Constants
-BASE_URL = "https://api.trackandtrace.tools"
 USERNAME = "YOUR_USERNAME"  # Replace with your actual username
 HOSTNAME = "ca.metrc.com"  # Update this to your specific Metrc hostname
 OUTPUT_DIR = "output"  # Directory to store the output files
 COA_FILE_TEMPLATE = os.path.join(
     OUTPUT_DIR, "coa_{id}.pdf"
 )  # Template for the COA file name
+CHECKPOINT_DIR = os.path.join(OUTPUT_DIR, ".checkpoints")  # Progress journals used by --resume
+COA_CACHE_DIR = os.path.join(OUTPUT_DIR, "coa_cache")  # Shared cache of previously downloaded COAs
+COA_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # Evict least recently used COAs past 2 GiB
+MAX_DISCOVERY_WORKERS = 8  # Maximum number of concurrent package and lab result lookups
+MAX_DOWNLOAD_WORKERS = 4  # Maximum number of concurrent COA PDF downloads
+
 
+def get_access_token(hostname, username):
+    def prompt_password():
+        return getpass.getpass(prompt=f"Password for {hostname}/{username}: ")
 
-def get_access_token(hostname, username, password, otp=None):
-    url = f"{BASE_URL}/v2/auth/credentials"
-    data = {"hostname": hostname, "username": username, "password": password}
-    if otp:
-        data["otp"] = otp
+    def prompt_otp():
+        return getpass.getpass(prompt="OTP: ")
 
-    response = requests.post(url, json=data)
-    response.raise_for_status()
-    return response.json()["accessToken"]
+    otp_provider = prompt_otp if hostname == "mi.metrc.com" else None  # Check if OTP is required
+    return get_token_manager(hostname, username, prompt_password, otp_provider)
 
 
 def get_licenses(access_token):
-    url = f"{BASE_URL}/v2/licenses"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return get_client().get_json("/v2/licenses", access_token, record_type=License)
 
 
 def get_outgoing_transfer(access_token, license_number, manifest_number):
-    url = f"{BASE_URL}/v2/transfers/outgoing/active?licenseNumber={license_number}&filter=manifestNumber__contains:{manifest_number}"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    transfers = response.json()["data"]
+    params = Query().contains("manifestNumber", manifest_number).params({"licenseNumber": license_number})
+    transfers = get_client().get_json("/v2/transfers/outgoing/active", access_token, params=params)["data"]
     if not transfers:
         raise ValueError(f"No transfer found with manifest number {manifest_number}")
     return transfers[0]
 
 
 def get_transfer_destinations(access_token, license_number, manifest_number):
-    url = f"{BASE_URL}/v2/transfers/deliveries?licenseNumber={license_number}&manifestNumber={manifest_number}"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()["data"]
+    params = {"licenseNumber": license_number, "manifestNumber": manifest_number}
+    return get_client().get_json("/v2/transfers/deliveries", access_token, params=params)["data"]
 
 
 def get_destination_packages(access_token, license_number, delivery_id):
-    url = f"{BASE_URL}/v2/transfers/packages?licenseNumber={license_number}&deliveryId={delivery_id}"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()["data"]
+    params = {"licenseNumber": license_number, "deliveryId": delivery_id}
+    return get_client().get_json("/v2/transfers/packages", access_token, params=params)["data"]
 
 
 def get_package_lab_results(access_token, license_number, package_id):
-    url = f"{BASE_URL}/v2/packages/labresults?licenseNumber={license_number}&packageId={package_id}"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()["data"]
+    params = {"licenseNumber": license_number, "packageId": package_id}
+    return get_client().get_json("/v2/packages/labresults", access_token, params=params)["data"]
 
 
 def download_lab_result_pdf(
-    access_token, license_number, lab_result_document_file_id, package_id
+    access_token, license_number, lab_result_document_file_id, package_id, document_cache=None
 ):
-    url = f"{BASE_URL}/v2/packages/labresults/document?licenseNumber={license_number}&labTestResultDocumentFileId={lab_result_document_file_id}&packageId={package_id}"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(url, headers=headers, stream=True)
-    response.raise_for_status()
     file_path = COA_FILE_TEMPLATE.format(id=lab_result_document_file_id)
-    with open(file_path, "wb") as f:
-        f.write(response.content)
+    if document_cache is not None and document_cache.fetch(lab_result_document_file_id, file_path):
+        print(f"Linked cached COA PDF to {file_path}")
+        return
+
+    params = {
+        "licenseNumber": license_number,
+        "labTestResultDocumentFileId": lab_result_document_file_id,
+        "packageId": package_id,
+    }
+    download_to_file("/v2/packages/labresults/document", access_token, file_path, params=params)
     print(f"Downloaded COA PDF to {file_path}")
 
+    if document_cache is not None:
+        document_cache.add(lab_result_document_file_id, file_path)
+
+
+def download_destination_coa_pdfs(
+    access_token,
+    license_number,
+    destinations,
+    max_discovery_workers=MAX_DISCOVERY_WORKERS,
+    max_download_workers=MAX_DOWNLOAD_WORKERS,
+    document_cache=None,
+    journal=None,
+):
+    # Each level of destinations -> packages -> lab results fans out as soon as
+    # its parent lookup returns, and PDF downloads run on their own pool so they
+    # start while discovery is still in progress
+    tasks = TaskGroup()
+    queued_document_ids = set()
+    queued_document_ids_lock = threading.Lock()
+
+    def download(package_id, lab_result_document_id):
+        download_lab_result_pdf(
+            access_token,
+            license_number,
+            lab_result_document_id,
+            package_id,
+            document_cache,
+        )
+        if journal is not None:
+            journal.mark_done("coa", lab_result_document_id)
+
+    def queue_download(package_id, lab_result_document_id):
+        # The same document is often attached to many packages, but it is
+        # saved under its document ID, so only download it once
+        with queued_document_ids_lock:
+            if lab_result_document_id in queued_document_ids:
+                return
+            queued_document_ids.add(lab_result_document_id)
+        if journal is not None and journal.is_done("coa", lab_result_document_id):
+            return
+        tasks.submit(downloads, download, package_id, lab_result_document_id)
+
+    def load_lab_results(package_id):
+        lab_results = get_package_lab_results(access_token, license_number, package_id)
+        for lab_result in lab_results:
+            lab_result_document_id = lab_result.get("labTestResultDocumentFileId")
+            if lab_result_document_id:
+                queue_download(package_id, lab_result_document_id)
+
+    def load_packages(delivery_id):
+        packages = get_destination_packages(access_token, license_number, delivery_id)
+        for package in packages:
+            tasks.submit(discovery, load_lab_results, package["packageId"])
+
+    with ThreadPoolExecutor(max_workers=max_discovery_workers) as discovery, ThreadPoolExecutor(
+        max_workers=max_download_workers
+    ) as downloads:
+        for destination in destinations:
+            tasks.submit(discovery, load_packages, destination["id"])
+        tasks.wait()
+
 
 def main():
+    parser = argparse.ArgumentParser(description="Download all COA PDFs from a single outgoing transfer.")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the COAs an interrupted run already downloaded",
+    )
+    args = parser.parse_args()
+
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    password = getpass.getpass(prompt=f"Password for {HOSTNAME}/{USERNAME}: ")
-    otp = None
-    if HOSTNAME == "mi.metrc.com":
-        otp = getpass.getpass(prompt="OTP: ")
     try:
-        access_token = get_access_token(HOSTNAME, USERNAME, password, otp)
+        access_token = get_access_token(HOSTNAME, USERNAME)
         licenses = get_licenses(access_token)
 
         # Display licenses and ask the user to select one
@@ -132,37 +183,19 @@ def main():
             access_token, selected_license_number, manifest_number
         )
 
-        # Set to store unique lab result document IDs
-        lab_result_document_ids = set()
-
-        # Iterate through destinations and packages to find lab results
-        for destination in destinations:
-            delivery_id = destination["id"]
-            packages = get_destination_packages(
-                access_token, selected_license_number, delivery_id
-            )
-            for package in packages:
-                package_id = package["packageId"]
-                lab_results = get_package_lab_results(
-                    access_token, selected_license_number, package_id
-                )
-                for lab_result in lab_results:
-                    lab_result_document_id = lab_result.get(
-                        "labTestResultDocumentFileId"
-                    )
-                    if lab_result_document_id:
-                        lab_result_document_ids.add(
-                            (package_id, lab_result_document_id)
-                        )
-
-        # Download each lab result document
-        for package_id, lab_result_document_id in lab_result_document_ids:
-            download_lab_result_pdf(
-                access_token,
-                selected_license_number,
-                lab_result_document_id,
-                package_id,
-            )
+        document_cache = DocumentCache(COA_CACHE_DIR, COA_CACHE_MAX_BYTES)
+        journal = CheckpointJournal(
+            os.path.join(CHECKPOINT_DIR, f"coas_{selected_license_number}_{manifest_number}.jsonl"),
+            resume=args.resume,
+        )
+        download_destination_coa_pdfs(
+            access_token,
+            selected_license_number,
+            destinations,
+            document_cache=document_cache,
+            journal=journal,
+        )
+        journal.close(completed=True)
 
     except requests.exceptions.HTTPError as e:
         print(f"HTTP error occurred: {e}")
@@ -2,38 +2,45 @@
 #
 # To run this script from the command line, use:
 # python license_data_csv.py
+#
+# To write a SQLite database or Parquet dataset instead of a CSV, use:
+# python license_data_csv.py --format sqlite
 
-import csv
+import argparse
 import getpass
 import requests
 import os  # Import os for directory operations
 from datetime import datetime  # Import datetime for date stamping
 
+from t3.auth import get_token_manager
+from t3.client import get_client
+from t3.sinks import SINK_EXTENSIONS, open_sink, write_pages
+
 # Constants
-BASE_URL = "https://api.trackandtrace.tools"
 USERNAME = "YOUR_USERNAME"  # Replace with your actual username
 HOSTNAME = "ca.metrc.com"  # Update this to your specific Metrc hostname
 OUTPUT_DIR = "output"  # Directory to store the output files
 OUTPUT_CSV_TEMPLATE = os.path.join(OUTPUT_DIR, "licenses_{}.csv")  # Template for the output file name
 
-def get_access_token(hostname, username, password, otp=None):
+def get_access_token(hostname, username):
     """
-    Obtain an access token for API authentication.
-    
+    Create a token manager that provides access tokens for API authentication.
+
+    Tokens are cached between runs and refreshed before they expire, so the
+    password (and OTP if required) is only prompted for when a new token is needed.
+
     :param hostname: The hostname of the Metrc instance.
     :param username: The username for authentication.
-    :param password: The password for authentication.
-    :param otp: One-Time Password, if required.
-    :return: Access token as a string.
+    :return: A TokenManager, which can be used anywhere an access token is expected.
     """
-    url = f"{BASE_URL}/v2/auth/credentials"
-    data = {"hostname": hostname, "username": username, "password": password}
-    if otp:
-        data["otp"] = otp
+    def prompt_password():
+        return getpass.getpass(prompt=f"Password for {hostname}/{username}: ")
+
+    def prompt_otp():
+        return getpass.getpass(prompt="OTP: ")
 
-    response = requests.post(url, json=data)
-    response.raise_for_status()  # Raise an error for bad responses
-    return response.json()["accessToken"]
+    otp_provider = prompt_otp if hostname == "mi.metrc.com" else None  # Check if OTP is required
+    return get_token_manager(hostname, username, prompt_password, otp_provider)
 
 def get_licenses(access_token):
     """
@@ -42,37 +49,22 @@ def get_licenses(access_token):
     :param access_token: The access token for authentication.
     :return: A list of license data.
     """
-    url = f"{BASE_URL}/v2/licenses"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()
-
-def write_licenses_to_csv(licenses, output_file):
-    """
-    Write the licenses data to a CSV file.
-    
-    :param licenses: List of licenses to write.
-    :param output_file: File path for the output CSV.
-    """
-    if not licenses:
-        print("No licenses found.")
-        return
-
-    keys = licenses[0].keys()  # Use the first license's keys for the CSV headers
-    with open(output_file, "w", newline="") as output:
-        dict_writer = csv.DictWriter(output, fieldnames=keys)
-        dict_writer.writeheader()
-        dict_writer.writerows(licenses)
+    return get_client().get_json("/v2/licenses", access_token)
 
 def main():
     """
     Main function to run the script.
     Prompts the user for password (and OTP if required), retrieves licenses, and writes them to a CSV file.
     """
+    parser = argparse.ArgumentParser(description="Load all active licenses and write them to a CSV file or another output format.")
+    parser.add_argument(
+        "--format",
+        choices=sorted(SINK_EXTENSIONS),
+        default="csv",
+        help="output format (default: csv)",
+    )
+    args = parser.parse_args()
+
     # Ensure the output directory exists
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     
@@ -80,16 +72,15 @@ def main():
     date_stamp = datetime.now().strftime("%Y%m%d")
     # Generate the output file name with the date stamp
     output_file = OUTPUT_CSV_TEMPLATE.format(date_stamp)
+    sink = open_sink(args.format, output_file, table="licenses")
     
-    password = getpass.getpass(prompt=f"Password for {HOSTNAME}/{USERNAME}: ")
-    otp = None
-    if HOSTNAME == "mi.metrc.com":  # Check if OTP is required
-        otp = getpass.getpass(prompt="OTP: ")
     try:
-        access_token = get_access_token(HOSTNAME, USERNAME, password, otp)
+        access_token = get_access_token(HOSTNAME, USERNAME)
         licenses = get_licenses(access_token)
-        write_licenses_to_csv(licenses, output_file)
-        print(f"Licenses have been written to {output_file}")
+        if write_pages([licenses], sink):
+            print(f"Licenses have been written to {sink.path}")
+        else:
+            print("No licenses found.")
 
     except requests.exceptions.HTTPError as e:
         print(f"HTTP error occurred: {e}")
@@ -2,115 +2,322 @@
 #
 # To run this script from the command line, use:
 # python load_all_active_packages.py
+#
+# To only fetch packages that changed since the last sync, use:
+# python load_all_active_packages.py --sync
+#
+# To write a SQLite database or Parquet dataset instead of a CSV, use:
+# python load_all_active_packages.py --format sqlite
+#
+# To pick up a CSV export where an interrupted run left off, use:
+# python load_all_active_packages.py --resume
+#
+# To decode, flatten and write a large CSV export on 8 processes, use:
+# python load_all_active_packages.py --processes 8
 
-import csv
+import argparse
 import getpass
 import os  # Import os for directory management
+from contextlib import ExitStack
 from datetime import datetime  # Import datetime for date stamping
 
 import requests
 
+from t3.auth import get_token_manager
+from t3.checkpoint import CheckpointJournal
+from t3.csv_writer import CsvWriter
+from t3.metrics import get_metrics
+from t3.pagination import iter_page_bodies, iter_pages
+from t3.parallel_csv import ParallelCsvWriter
+from t3.query import Query, project_pages
+from t3.records import Package
+from t3.sinks import SINK_EXTENSIONS, open_sink, write_pages
+from t3.sync import SyncStore, sync_records
+
 # Constants
-BASE_URL = "https://api.trackandtrace.tools"
 USERNAME = "YOUR_USERNAME"  # Replace with your actual username
 HOSTNAME = "ca.metrc.com"  # Update this to your specific Metrc hostname
 LICENSE_NUMBER = "LIC-00001"  # Replace with the actual license number
 OUTPUT_DIR = "output"  # Directory for output files
 OUTPUT_CSV_TEMPLATE = os.path.join(OUTPUT_DIR, "packages_{}.csv")  # Template for the output file name
+CHECKPOINT_DIR = os.path.join(OUTPUT_DIR, ".checkpoints")  # Progress journals used by --resume
+SYNC_DATABASE = os.path.join(OUTPUT_DIR, "sync.sqlite3")  # Local snapshot used by --sync
+PACKAGES_ENDPOINT = "/v2/packages/active"
+MAX_WORKERS = 8  # Maximum number of pages to load concurrently
 
 
-def get_access_token(hostname, username, password, otp=None):
+def get_access_token(hostname, username):
     """
-    Obtain an access token for API authentication.
+    Create a token manager that provides access tokens for API authentication.
+
+    Tokens are cached between runs and refreshed before they expire, so the
+    password (and OTP if required) is only prompted for when a new token is needed.
 
     :param hostname: The hostname of the Metrc instance.
     :param username: The username for authentication.
-    :param password: The password for authentication.
-    :param otp: One-Time Password, if required.
-    :return: Access token as a string.
+    :return: A TokenManager, which can be used anywhere an access token is expected.
     """
-    url = f"{BASE_URL}/v2/auth/credentials"
-    data = {"hostname": hostname, "username": username, "password": password}
-    if otp:
-        data["otp"] = otp
+    def prompt_password():
+        return getpass.getpass(prompt=f"Password for {hostname}/{username}: ")
+
+    def prompt_otp():
+        return getpass.getpass(prompt="OTP: ")
 
-    response = requests.post(url, json=data)
-    response.raise_for_status()  # Raise an error for bad responses
-    return response.json()["accessToken"]
+    otp_provider = prompt_otp if hostname == "mi.metrc.com" else None  # Check if OTP is required
+    return get_token_manager(hostname, username, prompt_password, otp_provider)
 
 
-def get_packages(access_token, license_number, page_size=500):
+def iter_package_pages(
+    access_token,
+    license_number,
+    page_size=500,
+    max_workers=MAX_WORKERS,
+    start_page=1,
+    query=None,
+    fields=None,
+    record_type=None,
+):
+    """
+    Yield each page of active packages for a given license number, in page order.
+
+    The first page is loaded on its own to learn the total page count, then the
+    remaining pages are loaded concurrently. Only a small window of pages is in
+    flight at once, so memory use stays flat no matter how large the license is.
+
+    :param access_token: The access token for authentication.
+    :param license_number: The license number for which to fetch packages.
+    :param page_size: Number of records per page (default is 500).
+    :param max_workers: Maximum number of pages to load at the same time.
+    :param start_page: The 1-based page to start from, used when resuming.
+    :param query: A Query to filter and sort the packages with on the server.
+    :param fields: Package fields to keep, such as ``label`` or ``item.name``, or None to keep every field.
+    :param record_type: A record type such as ``t3.records.Package`` to decode packages into, or None for dicts.
+    :return: A generator of lists of package data, one list per page.
+    """
+    params = {"licenseNumber": license_number}
+    return iter_pages(
+        PACKAGES_ENDPOINT,
+        access_token,
+        params,
+        page_size,
+        max_workers,
+        start_page=start_page,
+        query=query,
+        fields=fields,
+        record_type=record_type,
+    )
+
+
+def get_packages(access_token, license_number, page_size=500, max_workers=MAX_WORKERS, query=None, fields=None):
     """
     Retrieve all active packages from the API for a given license number.
 
     :param access_token: The access token for authentication.
     :param license_number: The license number for which to fetch packages.
     :param page_size: Number of records per page (default is 500).
+    :param max_workers: Maximum number of pages to load at the same time.
+    :param query: A Query to filter and sort the packages with on the server.
+    :param fields: Package fields to keep, or None to keep every field.
     :return: A list of all packages data.
     """
-    page = 1
     all_packages = []
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
+    for packages in iter_package_pages(access_token, license_number, page_size, max_workers, query=query, fields=fields):
+        all_packages.extend(packages)
+    return all_packages
+
 
-    while True:
-        url = f"{BASE_URL}/v2/packages/active?licenseNumber={license_number}&page={page}&pageSize={page_size}"
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
+def export_packages_to_csv(
+    access_token, license_number, output_file, journal, query=None, fields=None, record_type=None
+):
+    """
+    Stream all active packages into a CSV file, checkpointing after every page.
 
-        packages = response.json().get("data", [])
-        if not packages:
-            break
+    After each page is flushed to disk, the page number and the state of the
+    partial CSV are recorded in the journal. If the journal was reloaded from
+    an interrupted run, the partial CSV is continued from the last recorded
+    page instead of starting over, or left as it is if that run had already
+    moved it into place.
 
-        all_packages.extend(packages)
-        page += 1
+    :param access_token: The access token for authentication.
+    :param license_number: The license number for which to fetch packages.
+    :param output_file: File path for the output CSV.
+    :param journal: The CheckpointJournal to record progress in.
+    :param query: A Query to filter and sort the packages with on the server.
+    :param fields: Package fields to keep, or None to keep every field.
+    :param record_type: A record type to decode packages into, or None for dicts.
+    :return: The number of packages written.
+    """
+    progress = journal.get("pages", license_number)
+    start_page = progress["page"] + 1 if progress else 1
+    if progress:
+        print(f"Resuming from page {start_page}")
 
-    return all_packages
+    metrics = get_metrics()
+    writer = CsvWriter(output_file, progress["csv"] if progress else None)
+    if writer.finished:
+        print("The interrupted export had already been written")
+        return writer.rows_written
+
+    with ExitStack() as stack:
+        stack.enter_context(writer)
+        pages = iter_package_pages(
+            access_token, license_number, start_page=start_page, query=query, fields=fields, record_type=record_type
+        )
+        for page, packages in enumerate(pages, start_page):
+            with metrics.timer("write"):
+                writer.write_page(packages)
+            state = writer.state()
+            if state:
+                journal.mark_done("pages", license_number, page=page, csv=state)
+        stack.pop_all()  # Every page was written, so close the writer below rather than on exit
+    with metrics.timer("write"):
+        return writer.close()
 
 
-def write_packages_to_csv(packages, output_file):
+def export_packages_in_parallel(access_token, license_number, output_file, processes, query=None, fields=None):
     """
-    Write the package data to a CSV file.
+    Write all active packages to a CSV file, decoding and flattening pages in worker processes.
 
-    :param packages: List of packages to write.
+    Pages are fetched concurrently as raw response bodies and handed to a
+    ParallelCsvWriter, so JSON decoding, flattening and CSV serialization
+    are spread over several cores. Nested objects, such as a package's
+    ``item``, are written as dotted columns like ``item.name``.
+
+    :param access_token: The access token for authentication.
+    :param license_number: The license number for which to fetch packages.
     :param output_file: File path for the output CSV.
+    :param processes: Number of worker processes.
+    :param query: A Query to filter and sort the packages with on the server.
+    :param fields: Package fields to keep, or None to keep every field.
+    :return: The number of packages written.
     """
-    if not packages:
-        print("No packages found.")
-        return
+    params = {"licenseNumber": license_number}
+    bodies = iter_page_bodies(PACKAGES_ENDPOINT, access_token, params, max_workers=MAX_WORKERS, query=query)
+    return write_pages(bodies, ParallelCsvWriter(output_file, processes, fields))
+
 
-    # Create the output directory if it doesn't exist
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+def sync_packages(access_token, license_number, store, full=False):
+    """
+    Update the local package snapshot with packages changed since the last sync.
 
-    keys = packages[0].keys()  # Use the first package's keys for the CSV headers
-    with open(output_file, "w", newline="") as output:
-        dict_writer = csv.DictWriter(output, fieldnames=keys)
-        dict_writer.writeheader()
-        dict_writer.writerows(packages)
+    :param access_token: The access token for authentication.
+    :param license_number: The license number for which to sync packages.
+    :param store: The SyncStore holding the local snapshot.
+    :param full: Whether to refetch every package and rebuild the snapshot.
+    :return: The number of packages fetched from the API.
+    """
+    return sync_records(store, PACKAGES_ENDPOINT, access_token, license_number, full=full, max_workers=MAX_WORKERS)
 
 
 def main():
     """
     Main function to run the script.
-    Prompts the user for password (and OTP if required), retrieves packages, and writes them to a CSV file.
+    Prompts the user for password (and OTP if required), retrieves packages, and streams them into a CSV file.
     """
+    parser = argparse.ArgumentParser(description="Load all active packages and write them to a CSV file or another output format.")
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="only fetch packages changed since the last --sync run and export the merged local snapshot",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="with --sync, refetch every package and rebuild the local snapshot",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the CSV export left behind by an interrupted run",
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(SINK_EXTENSIONS),
+        default="csv",
+        help="output format (default: csv)",
+    )
+    parser.add_argument(
+        "--fields",
+        type=lambda value: value.split(","),
+        help="comma-separated package fields to export, such as label,packageType,item.name (default: all)",
+    )
+    parser.add_argument(
+        "--modified-since",
+        type=datetime.fromisoformat,
+        help="only export packages modified at or after this ISO date or time",
+    )
+    parser.add_argument(
+        "--modified-until",
+        type=datetime.fromisoformat,
+        help="only export packages modified at or before this ISO date or time",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="decode packages into compact records with only the most used fields, to save memory and CPU",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="decode, flatten and write the CSV on this many worker processes; nested fields become columns like item.name",
+    )
+    args = parser.parse_args()
+    if args.processes is not None and (args.processes < 1 or args.sync or args.resume or args.compact or args.format != "csv"):
+        parser.error("--processes takes a positive number and only applies to CSV exports without --sync, --resume or --compact")
+    if args.resume and (args.sync or args.format != "csv"):
+        parser.error("--resume only applies to CSV exports without --sync")
+    if args.sync and (args.modified_since or args.modified_until):
+        parser.error("--modified-since and --modified-until don't apply to --sync")
+    if args.sync and args.compact:
+        parser.error("--compact doesn't apply to --sync")
+    query = Query().between("lastModified", args.modified_since, args.modified_until)
+    record_type = Package if args.compact else None
+
     # Get the current date and format it as YYYYMMDD
     date_stamp = datetime.now().strftime("%Y%m%d")
     # Generate the output file name with the date stamp
     output_file = OUTPUT_CSV_TEMPLATE.format(date_stamp)
+    sink = open_sink(args.format, output_file, table="packages")
+    output_path = sink.path
 
-    password = getpass.getpass(prompt=f"Password for {HOSTNAME}/{USERNAME}: ")
-    otp = None
-    if HOSTNAME == "mi.metrc.com":  # Check if OTP is required
-        otp = getpass.getpass(prompt="OTP: ")
     try:
-        access_token = get_access_token(HOSTNAME, USERNAME, password, otp)
+        access_token = get_access_token(HOSTNAME, USERNAME)
+
+        if args.sync:
+            with SyncStore(SYNC_DATABASE) as store:
+                fetched = sync_packages(access_token, LICENSE_NUMBER, store, full=args.full)
+                print(f"Synced {fetched} changed packages")
+                pages = store.iter_record_pages(LICENSE_NUMBER, PACKAGES_ENDPOINT)
+                written = write_pages(project_pages(pages, args.fields), sink)
+        elif args.processes:
+            written = export_packages_in_parallel(
+                access_token, LICENSE_NUMBER, output_path, args.processes, query=query, fields=args.fields
+            )
+        elif args.format == "csv":
+            journal = CheckpointJournal(
+                os.path.join(CHECKPOINT_DIR, f"packages_{LICENSE_NUMBER}.jsonl"), resume=args.resume
+            )
+            # A resumed export continues the file it started, even on a later day
+            job = journal.get("job", "output")
+            if job:
+                output_path = job["path"]
+            else:
+                journal.mark_done("job", "output", path=output_path)
 
-        packages = get_packages(access_token, LICENSE_NUMBER)
-        write_packages_to_csv(packages, output_file)
-        print(f"Packages have been written to {output_file}")
+            written = export_packages_to_csv(
+                access_token, LICENSE_NUMBER, output_path, journal, query=query, fields=args.fields, record_type=record_type
+            )
+            journal.close(completed=True)
+        else:
+            pages = iter_package_pages(
+                access_token, LICENSE_NUMBER, query=query, fields=args.fields, record_type=record_type
+            )
+            written = write_pages(pages, sink)
+
+        if written:
+            print(f"Packages have been written to {output_path}")
+        else:
+            print("No packages found.")
 
     except requests.exceptions.HTTPError as e:
         print(f"HTTP error occurred: {e}")
@@ -120,4 +327,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
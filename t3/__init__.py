@@ -0,0 +1,3 @@
+"""
+Shared helpers used by the example scripts in this repository.
+"""
@@ -0,0 +1,511 @@
+"""
+An asyncio client for the T3 API, mirroring the functions in the example scripts.
+
+Requires the optional ``httpx`` package. For example::
+
+    async with AsyncT3Client() as client:
+        access_token = await client.get_access_token(hostname, username, password)
+        async for packages in client.iter_package_pages(access_token, license_number):
+            ...
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+
+from t3.client import (
+    BASE_URL,
+    MAX_RETRY_TIME,
+    POOL_MAXSIZE,
+    REQUEST_TIMEOUT,
+    RETRY_STATUSES,
+    THROTTLE_STATUSES,
+)
+from t3.decoding import decode
+from t3.downloads import CHUNK_SIZE, discard_partial, response_offset, resume_request, save_validator
+from t3.pagination import MAX_WORKERS, PAGE_SIZE, get_page_count
+from t3.query import Query, compile_fields, project
+from t3.rate_limit import AdaptiveRateLimiter, backoff_delay, parse_retry_after
+
+
+def _sync_file(file):
+    file.flush()
+    os.fsync(file.fileno())
+
+
+class AsyncT3Client:
+    """
+    An asyncio client for the T3 API built on ``httpx.AsyncClient``.
+
+    It behaves like T3Client: connections are pooled and kept alive, requests
+    are paced by an AdaptiveRateLimiter, GETs are retried on connection errors
+    and 429/5xx responses, and a TokenManager can be passed in place of an
+    access token. A TokenManager is only called from a worker thread when it
+    actually has to authenticate, so the event loop isn't blocked. Responses
+    are not cached. If a Metrics instance is given, requests are recorded in
+    it the same way T3Client records them.
+
+    Use it as an async context manager, or call ``aclose()`` when done.
+    """
+
+    def __init__(self, base_url=BASE_URL, max_connections=POOL_MAXSIZE, rate_limiter=None, max_retry_time=MAX_RETRY_TIME, metrics=None):
+        """
+        :param base_url: The base URL of the T3 API.
+        :param max_connections: Maximum number of open connections.
+        :param rate_limiter: The AdaptiveRateLimiter to pace requests with, or None for a new one.
+        :param max_retry_time: Give up retrying a request after this many seconds in total.
+        :param metrics: The Metrics to record requests in, or None to disable instrumentation.
+        """
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError("The async client requires httpx. Install it with: pip install httpx")
+
+        self._httpx = httpx
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.max_retry_time = max_retry_time
+        self.metrics = metrics
+        connect_timeout, read_timeout = REQUEST_TIMEOUT
+        self.client = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            headers={"Accept": "application/json", "Content-Type": "application/json"},
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def _acquire(self):
+        while True:
+            wait = self.rate_limiter.reserve()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    async def request(self, method, path, retry_statuses=RETRY_STATUSES, retry_connection_errors=True, stream=False, **kwargs):
+        """
+        Send a request to the API, pacing and retrying it as needed.
+
+        :param method: The HTTP method, such as ``GET``.
+        :param path: The API path, such as ``/v2/licenses``.
+        :param retry_statuses: Response status codes that should be retried.
+        :param retry_connection_errors: Whether to retry connection errors and timeouts.
+        :param stream: Whether to leave the response body unread. The caller must then ``aclose()`` the response.
+        :param kwargs: Extra arguments for ``httpx.AsyncClient.build_request``.
+        :return: The ``httpx.Response`` object.
+        :raises httpx.HTTPStatusError: If the final response is an error.
+        """
+        deadline = time.monotonic() + self.max_retry_time
+        attempt = 0
+
+        while True:
+            await self._acquire()
+            start = time.perf_counter()
+            try:
+                response = await self.client.send(self.client.build_request(method, path, **kwargs), stream=stream)
+            except self._httpx.TransportError as e:
+                self._record(path, type(e).__name__, start)
+                delay = backoff_delay(attempt)
+                if not retry_connection_errors or time.monotonic() + delay > deadline:
+                    self._record_error(path)
+                    raise
+            else:
+                self._record(path, response.status_code, start, None if stream else response)
+                if response.status_code not in retry_statuses:
+                    if response.status_code not in THROTTLE_STATUSES:
+                        self.rate_limiter.on_success()
+                    if response.is_error:
+                        self._record_error(path)
+                        await response.aclose()
+                        response.raise_for_status()
+                    return response
+
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if response.status_code in THROTTLE_STATUSES:
+                    self.rate_limiter.on_throttle(retry_after)
+
+                delay = retry_after if retry_after is not None else backoff_delay(attempt)
+                await response.aclose()
+                if time.monotonic() + delay > deadline:
+                    self._record_error(path)
+                    response.raise_for_status()
+
+            if self.metrics:
+                self.metrics.record_retry(path)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _record(self, path, status, start, response=None):
+        if not self.metrics:
+            return
+        latency = time.perf_counter() - start
+        # Streamed bodies haven't been read yet, so their bytes are recorded by the reader
+        size = len(response.content) if response is not None else 0
+        self.metrics.record_request(path, status, latency, size)
+
+    def _record_error(self, path):
+        if self.metrics:
+            self.metrics.record_error(path)
+
+    async def get(self, path, access_token=None, params=None, headers=None, stream=False):
+        """
+        Send a GET request to the API.
+
+        If ``access_token`` is a TokenManager and the API rejects its token
+        with a 401, the token is refreshed and the request is retried once.
+
+        :param path: The API path, such as ``/v2/licenses``.
+        :param access_token: The access token, or a TokenManager, for authentication, if required.
+        :param params: Query string parameters.
+        :param headers: Extra headers for this request only.
+        :param stream: Whether to leave the response body unread. The caller must then ``aclose()`` the response.
+        :return: The ``httpx.Response`` object.
+        """
+        token_manager = access_token if hasattr(access_token, "get_token") else None
+
+        for attempt in range(2):
+            token = access_token
+            if token_manager:
+                token = token_manager.cached_token() or await asyncio.to_thread(token_manager.get_token)
+
+            request_headers = dict(headers or {})
+            if token:
+                request_headers["Authorization"] = f"Bearer {token}"
+
+            try:
+                return await self.request("GET", path, params=params, headers=request_headers, stream=stream)
+            except self._httpx.HTTPStatusError as e:
+                if token_manager is None or attempt or e.response.status_code != 401:
+                    raise
+                token_manager.invalidate(token)
+
+    async def get_json(self, path, access_token=None, params=None, record_type=None):
+        """
+        Send a GET request to the API and decode the JSON response.
+
+        :param path: The API path, such as ``/v2/licenses``.
+        :param access_token: The access token, or a TokenManager, for authentication, if required.
+        :param params: Query string parameters.
+        :param record_type: A record type from ``t3.records`` to decode records into, or None for plain dicts.
+        :return: The decoded JSON response.
+        """
+        response = await self.get(path, access_token, params=params)
+        return decode(response.content, record_type)
+
+    async def get_access_token(self, hostname, username, password, otp=None):
+        """
+        Obtain an access token for API authentication.
+
+        :param hostname: The hostname of the Metrc instance.
+        :param username: The username for authentication.
+        :param password: The password for authentication.
+        :param otp: One-Time Password, if required.
+        :return: Access token as a string.
+        """
+        data = {"hostname": hostname, "username": username, "password": password}
+        if otp:
+            data["otp"] = otp
+
+        response = await self.request(
+            "POST", "/v2/auth/credentials", retry_statuses=(429,), retry_connection_errors=False, json=data
+        )
+        return response.json()["accessToken"]
+
+    async def get_licenses(self, access_token):
+        """
+        Retrieve a list of licenses from the API.
+
+        :param access_token: The access token for authentication.
+        :return: A list of license data.
+        """
+        return await self.get_json("/v2/licenses", access_token)
+
+    async def get_page(self, path, access_token, page, page_size=PAGE_SIZE, params=None, record_type=None):
+        """
+        Retrieve a single page from a paginated API endpoint.
+
+        :param path: The API path, such as ``/v2/packages/active``.
+        :param access_token: The access token for authentication.
+        :param page: The 1-based page number to fetch.
+        :param page_size: Number of records per page.
+        :param params: Additional query string parameters, such as ``licenseNumber``.
+        :param record_type: A record type from ``t3.records`` to decode records into, or None for plain dicts.
+        :return: The decoded JSON response for the page.
+        """
+        page_params = dict(params or {}, page=page, pageSize=page_size)
+        return await self.get_json(path, access_token, params=page_params, record_type=record_type)
+
+    async def iter_pages(
+        self,
+        path,
+        access_token,
+        params=None,
+        page_size=PAGE_SIZE,
+        max_concurrency=MAX_WORKERS,
+        start_page=1,
+        query=None,
+        fields=None,
+        record_type=None,
+        on_total=None,
+    ):
+        """
+        Asynchronously yield each page of records from a paginated API endpoint, in page order.
+
+        Works like ``t3.pagination.iter_pages``: the first page gives the page
+        count, then up to ``max_concurrency`` later pages are fetched at once.
+
+        :param path: The API path, such as ``/v2/packages/active``.
+        :param access_token: The access token for authentication.
+        :param params: Additional query string parameters, such as ``licenseNumber``.
+        :param page_size: Number of records per page.
+        :param max_concurrency: Maximum number of pages to load at the same time.
+        :param start_page: The 1-based page to start from.
+        :param query: A Query to filter and sort the records with.
+        :param fields: Field names to keep in each record, or None to keep every field.
+        :param record_type: A record type from ``t3.records`` to decode records into, or None for plain dicts.
+        :param on_total: Called with the total number of records the API reports, or None if it doesn't, once the first page is loaded.
+        :return: An async generator of lists of records, one list per page.
+        """
+        if query is not None:
+            params = query.params(params)
+        tree = compile_fields(fields) if fields else None
+
+        def page_records(response_data):
+            records = response_data.get("data", [])
+            if tree is not None:
+                records = [project(record, tree) for record in records]
+            return records
+
+        first_page = await self.get_page(path, access_token, start_page, page_size, params, record_type)
+        if on_total is not None:
+            on_total(first_page.get("total"))
+        records = page_records(first_page)
+        if not records:
+            return
+        yield records
+
+        page_count = get_page_count(first_page, page_size)
+        if page_count is None:
+            page = start_page + 1
+            while True:
+                records = page_records(await self.get_page(path, access_token, page, page_size, params, record_type))
+                if not records:
+                    break
+                yield records
+                page += 1
+            return
+
+        pending = deque()
+        next_page = start_page + 1
+        try:
+            while next_page <= page_count or pending:
+                while next_page <= page_count and len(pending) < max_concurrency:
+                    pending.append(
+                        asyncio.ensure_future(
+                            self.get_page(path, access_token, next_page, page_size, params, record_type)
+                        )
+                    )
+                    next_page += 1
+                yield page_records(await pending.popleft())
+        finally:
+            # Don't leave requests running if the caller stops iterating early,
+            # and wait for them to finish cancelling so none outlives the iterator
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def iter_package_pages(
+        self, access_token, license_number, page_size=PAGE_SIZE, max_concurrency=MAX_WORKERS, query=None, fields=None
+    ):
+        """
+        Asynchronously yield each page of active packages for a license, in page order.
+
+        :param access_token: The access token for authentication.
+        :param license_number: The license number for which to fetch packages.
+        :param page_size: Number of records per page.
+        :param max_concurrency: Maximum number of pages to load at the same time.
+        :param query: A Query to filter and sort the packages with on the server.
+        :param fields: Package fields to keep, or None to keep every field.
+        :return: An async generator of lists of package data.
+        """
+        params = {"licenseNumber": license_number}
+        return self.iter_pages(
+            "/v2/packages/active", access_token, params, page_size, max_concurrency, query=query, fields=fields
+        )
+
+    def iter_outgoing_transfer_pages(
+        self, access_token, license_number, page_size=PAGE_SIZE, max_concurrency=MAX_WORKERS, query=None, fields=None
+    ):
+        """
+        Asynchronously yield each page of active outgoing transfers for a license, in page order.
+
+        :param access_token: The access token for authentication.
+        :param license_number: The license number to query.
+        :param page_size: Number of records per page.
+        :param max_concurrency: Maximum number of pages to load at the same time.
+        :param query: A Query to filter and sort the transfers with on the server.
+        :param fields: Transfer fields to keep, or None to keep every field.
+        :return: An async generator of lists of transfer data.
+        """
+        params = {"licenseNumber": license_number}
+        return self.iter_pages(
+            "/v2/transfers/outgoing/active", access_token, params, page_size, max_concurrency, query=query, fields=fields
+        )
+
+    async def get_outgoing_transfers(self, access_token, license_number):
+        """
+        Retrieve every active outgoing transfer for a license.
+
+        :param access_token: The access token for authentication.
+        :param license_number: The license number to query.
+        :return: A list of outgoing transfers.
+        """
+        transfers = []
+        async for page in self.iter_outgoing_transfer_pages(access_token, license_number):
+            transfers.extend(page)
+        return transfers
+
+    async def get_outgoing_transfer(self, access_token, license_number, manifest_number):
+        """
+        Retrieve the outgoing transfer with a manifest number.
+
+        :param access_token: The access token for authentication.
+        :param license_number: The license number to query.
+        :param manifest_number: The manifest number of the transfer.
+        :return: The transfer data.
+        """
+        params = Query().contains("manifestNumber", manifest_number).params({"licenseNumber": license_number})
+        transfers = (await self.get_json("/v2/transfers/outgoing/active", access_token, params=params))["data"]
+        if not transfers:
+            raise ValueError(f"No transfer found with manifest number {manifest_number}")
+        return transfers[0]
+
+    async def get_transfer_destinations(self, access_token, license_number, manifest_number):
+        """
+        Retrieve the deliveries for a transfer.
+
+        :param access_token: The access token for authentication.
+        :param license_number: The license number to query.
+        :param manifest_number: The manifest number of the transfer.
+        :return: A list of deliveries.
+        """
+        params = {"licenseNumber": license_number, "manifestNumber": manifest_number}
+        return (await self.get_json("/v2/transfers/deliveries", access_token, params=params))["data"]
+
+    async def get_destination_packages(self, access_token, license_number, delivery_id):
+        """
+        Retrieve the packages in a transfer delivery.
+
+        :param access_token: The access token for authentication.
+        :param license_number: The license number to query.
+        :param delivery_id: The ID of the delivery.
+        :return: A list of packages.
+        """
+        params = {"licenseNumber": license_number, "deliveryId": delivery_id}
+        return (await self.get_json("/v2/transfers/packages", access_token, params=params))["data"]
+
+    async def get_package_lab_results(self, access_token, license_number, package_id):
+        """
+        Retrieve the lab results for a package.
+
+        :param access_token: The access token for authentication.
+        :param license_number: The license number to query.
+        :param package_id: The ID of the package.
+        :return: A list of lab results.
+        """
+        params = {"licenseNumber": license_number, "packageId": package_id}
+        return (await self.get_json("/v2/packages/labresults", access_token, params=params))["data"]
+
+    async def download_to_file(self, path, access_token, destination, params=None, chunk_size=CHUNK_SIZE):
+        """
+        Download a file from the API to disk without buffering it in memory.
+
+        Works like ``t3.downloads.download_to_file``, including resuming a
+        leftover ``.part`` file with an ``If-Range`` range request. File
+        operations run in a worker thread, so a slow disk doesn't stall the
+        event loop.
+
+        :param path: The API path, such as ``/v2/transfers/manifest``.
+        :param access_token: The access token for authentication.
+        :param destination: The file path to write the download to.
+        :param params: Query string parameters.
+        :param chunk_size: Number of bytes to read and write at a time.
+        :return: The destination file path.
+        """
+        partial_path = f"{destination}.part"
+        offset, headers = await asyncio.to_thread(resume_request, partial_path)
+
+        try:
+            response = await self.get(path, access_token, params=params, headers=headers, stream=True)
+        except self._httpx.HTTPStatusError as e:
+            if offset and e.response.status_code == 416:
+                await asyncio.to_thread(discard_partial, partial_path)
+                return await self.download_to_file(path, access_token, destination, params, chunk_size)
+            raise
+
+        try:
+            offset = response_offset(response.status_code, response.headers, offset)
+            if offset is not None:
+                if not offset:
+                    await asyncio.to_thread(save_validator, partial_path, response.headers)
+                size = 0
+                file = await asyncio.to_thread(open, partial_path, "ab" if offset else "wb")
+                try:
+                    async for chunk in response.aiter_bytes(chunk_size):
+                        await asyncio.to_thread(file.write, chunk)
+                        size += len(chunk)
+                    await asyncio.to_thread(_sync_file, file)
+                finally:
+                    await asyncio.to_thread(file.close)
+        finally:
+            await response.aclose()
+
+        if offset is None:
+            # The range doesn't line up with the partial file, so start over
+            await asyncio.to_thread(discard_partial, partial_path)
+            return await self.download_to_file(path, access_token, destination, params, chunk_size)
+
+        if self.metrics:
+            self.metrics.record_bytes(path, size)
+        await asyncio.to_thread(os.replace, partial_path, destination)
+        await asyncio.to_thread(discard_partial, partial_path)
+        return destination
+
+    async def download_manifest_pdf(self, access_token, license_number, manifest_number, destination):
+        """
+        Download the manifest PDF for a transfer.
+
+        :param access_token: The access token for authentication.
+        :param license_number: The license number.
+        :param manifest_number: The manifest number of the transfer.
+        :param destination: The file path to write the PDF to.
+        :return: The destination file path.
+        """
+        params = {"licenseNumber": license_number, "manifestNumber": manifest_number}
+        return await self.download_to_file("/v2/transfers/manifest", access_token, destination, params=params)
+
+    async def download_lab_result_pdf(self, access_token, license_number, lab_result_document_file_id, package_id, destination):
+        """
+        Download a lab result (COA) PDF.
+
+        :param access_token: The access token for authentication.
+        :param license_number: The license number.
+        :param lab_result_document_file_id: The document file ID of the lab result.
+        :param package_id: The ID of the package the lab result belongs to.
+        :param destination: The file path to write the PDF to.
+        :return: The destination file path.
+        """
+        params = {
+            "licenseNumber": license_number,
+            "labTestResultDocumentFileId": lab_result_document_file_id,
+            "packageId": package_id,
+        }
+        return await self.download_to_file("/v2/packages/labresults/document", access_token, destination, params=params)
@@ -0,0 +1,169 @@
+import base64
+import json
+import os
+import threading
+import time
+
+from t3.client import get_client
+
+TOKEN_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".t3", "tokens.json")  # Tokens shared between runs
+REFRESH_MARGIN = 300  # Refresh tokens this many seconds before they expire
+DEFAULT_TOKEN_LIFETIME = 3600  # Assumed lifetime, in seconds, of tokens that don't say when they expire
+
+# Token managers for different accounts share the cache file, so writes to it
+# from this process are serialized to avoid losing each other's tokens
+_cache_file_lock = threading.Lock()
+
+
+def token_expiry(access_token):
+    """
+    Read the expiry time from a JWT access token.
+
+    :param access_token: The access token.
+    :return: The expiry as a Unix timestamp, or None if the token doesn't carry one.
+    """
+    try:
+        payload = access_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)  # Restore the base64 padding JWTs strip off
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenManager:
+    """
+    Provides a valid access token for one Metrc hostname and username.
+
+    The token is authenticated on first use and cached in memory and in
+    ``cache_file``, so later runs can reuse it without authenticating again.
+    It is refreshed by re-authenticating shortly before it expires. The password
+    and OTP are only asked for when a new token is actually needed.
+
+    A token manager can be passed anywhere an access token is expected. The
+    client calls ``get_token()`` for each request, and after a 401 response it
+    calls ``invalidate()`` and retries the request once with a fresh token.
+    Authentication is guarded by a lock, so concurrent workers sharing one
+    manager trigger a single authentication rather than one each.
+    """
+
+    def __init__(self, hostname, username, password_provider, otp_provider=None, cache_file=TOKEN_CACHE_FILE, client=None):
+        """
+        :param hostname: The hostname of the Metrc instance.
+        :param username: The username for authentication.
+        :param password_provider: A callable returning the password. It is called at most once.
+        :param otp_provider: A callable returning a One-Time Password, if required. It is called for every authentication.
+        :param cache_file: File to cache tokens in between runs, or None to only cache in memory.
+        :param client: The T3Client to authenticate with, defaulting to the shared client.
+        """
+        self.hostname = hostname
+        self.username = username
+        self.cache_key = f"{hostname}/{username}"
+        self._password_provider = password_provider
+        self._otp_provider = otp_provider
+        self._password = None
+        self._cache_file = cache_file
+        self._client = client
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._load_cached_token()
+
+    def _load_cached_token(self):
+        if not self._cache_file:
+            return
+        try:
+            with open(self._cache_file) as file:
+                cached = json.load(file).get(self.cache_key)
+        except (FileNotFoundError, ValueError):
+            return
+        if cached:
+            self._token = cached["accessToken"]
+            self._expires_at = cached["expiresAt"]
+
+    def _save_cached_token(self):
+        if not self._cache_file:
+            return
+
+        os.makedirs(os.path.dirname(self._cache_file), exist_ok=True)
+        with _cache_file_lock:
+            try:
+                with open(self._cache_file) as file:
+                    tokens = json.load(file)
+            except (FileNotFoundError, ValueError):
+                tokens = {}
+            tokens[self.cache_key] = {"accessToken": self._token, "expiresAt": self._expires_at}
+
+            # Access tokens are credentials, so keep the file private to this user
+            temp_path = f"{self._cache_file}.{os.getpid()}.tmp"
+            with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as file:
+                json.dump(tokens, file)
+            os.replace(temp_path, self._cache_file)
+
+    def _authenticate(self):
+        if self._password is None:
+            self._password = self._password_provider()
+
+        data = {"hostname": self.hostname, "username": self.username, "password": self._password}
+        if self._otp_provider:
+            data["otp"] = self._otp_provider()
+
+        response = (self._client or get_client()).post("/v2/auth/credentials", json=data)
+        self._token = response.json()["accessToken"]
+        self._expires_at = token_expiry(self._token) or time.time() + DEFAULT_TOKEN_LIFETIME
+        self._save_cached_token()
+
+    def get_token(self):
+        """
+        Return a valid access token, authenticating if needed.
+
+        :return: Access token as a string.
+        """
+        with self._lock:
+            if self._token is None or time.time() > self._expires_at - REFRESH_MARGIN:
+                self._authenticate()
+            return self._token
+
+    def cached_token(self):
+        """
+        Return the current access token if it doesn't need refreshing yet, without authenticating.
+
+        :return: Access token as a string, or None if ``get_token()`` would have to authenticate.
+        """
+        with self._lock:
+            if self._token is None or time.time() > self._expires_at - REFRESH_MARGIN:
+                return None
+            return self._token
+
+    def invalidate(self, access_token):
+        """
+        Mark an access token as rejected, so the next ``get_token()`` authenticates again.
+
+        Only the token that was rejected is dropped. If another worker has
+        already replaced it, the newer token is kept.
+
+        :param access_token: The access token the API rejected.
+        """
+        with self._lock:
+            if self._token == access_token:
+                self._token = None
+
+
+_token_managers = {}
+_token_managers_lock = threading.Lock()
+
+
+def get_token_manager(hostname, username, password_provider, otp_provider=None):
+    """
+    Return the shared token manager for a hostname and username, creating it on first use.
+
+    :param hostname: The hostname of the Metrc instance.
+    :param username: The username for authentication.
+    :param password_provider: A callable returning the password.
+    :param otp_provider: A callable returning a One-Time Password, if required.
+    :return: A TokenManager instance.
+    """
+    key = (hostname, username)
+    with _token_managers_lock:
+        if key not in _token_managers:
+            _token_managers[key] = TokenManager(hostname, username, password_provider, otp_provider)
+        return _token_managers[key]
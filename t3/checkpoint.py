@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+
+
+class CheckpointJournal:
+    """
+    A durable record of the work a long-running job has completed.
+
+    Each completed unit of work, such as a page, manifest or COA document, is
+    appended to a JSON-lines file and fsynced before the job moves on, so the
+    journal survives crashes. A job started with ``resume=True`` reloads the
+    journal and can skip everything already recorded. Otherwise the journal is
+    cleared and the job starts from scratch.
+
+    A journal is safe to share between threads in one process.
+    """
+
+    def __init__(self, path, resume=False):
+        """
+        :param path: File path of the journal.
+        :param resume: Whether to keep and reload an existing journal.
+        """
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+
+        journal_dir = os.path.dirname(path)
+        if journal_dir:
+            os.makedirs(journal_dir, exist_ok=True)
+
+        if resume:
+            self._load()
+        elif os.path.exists(path):
+            os.remove(path)
+
+        self._file = open(path, "a")
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as file:
+                valid_length = 0
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # A torn final line from a crash mid-write
+                    if not line.endswith(b"\n"):
+                        break  # A complete entry whose newline never made it to disk
+                    self._entries[(entry["kind"], entry["key"])] = entry.get("data", {})
+                    valid_length += len(line)
+        except FileNotFoundError:
+            return
+
+        # Cut off the torn line, or the next entry would be appended onto it and lost
+        os.truncate(self.path, valid_length)
+
+    def is_done(self, kind, key):
+        """
+        :param kind: The kind of work, such as ``manifest``.
+        :param key: The identifier of the unit of work.
+        :return: True if the unit of work was recorded as done.
+        """
+        with self._lock:
+            return (kind, str(key)) in self._entries
+
+    def get(self, kind, key):
+        """
+        :param kind: The kind of work, such as ``page``.
+        :param key: The identifier of the unit of work.
+        :return: The data recorded with the unit of work, or None if it isn't done.
+        """
+        with self._lock:
+            return self._entries.get((kind, str(key)))
+
+    def mark_done(self, kind, key, **data):
+        """
+        Durably record a unit of work as done.
+
+        :param kind: The kind of work, such as ``manifest``.
+        :param key: The identifier of the unit of work.
+        :param data: Extra JSON-serializable data needed to resume after this unit.
+        """
+        key = str(key)
+        line = json.dumps({"kind": kind, "key": key, "data": data})
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._entries[(kind, key)] = data
+
+    def close(self, completed=False):
+        """
+        Close the journal.
+
+        :param completed: Whether the job finished, in which case the journal is deleted.
+        """
+        self._file.close()
+        if completed:
+            os.remove(self.path)
@@ -0,0 +1,278 @@
+import hashlib
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from t3.decoding import decode
+from t3.metrics import get_metrics
+from t3.rate_limit import AdaptiveRateLimiter, backoff_delay, parse_retry_after
+from t3.response_cache import ResponseCache
+
+BASE_URL = os.environ.get("T3_API_BASE_URL", "https://api.trackandtrace.tools")  # Override to use a mock server
+POOL_CONNECTIONS = 4  # Number of distinct hosts to keep connection pools for
+POOL_MAXSIZE = 32  # Maximum number of open connections kept per host
+REQUEST_TIMEOUT = (10, 120)  # Seconds to wait for a connection, and between bytes of a response
+MAX_RETRY_TIME = 300  # Give up retrying a request after this many seconds in total
+THROTTLE_STATUSES = (429, 503)  # Responses that mean the API wants us to slow down
+RETRY_STATUSES = (429, 500, 502, 503, 504)  # Responses worth retrying for idempotent requests
+
+
+class T3Client:
+    """
+    A pooled HTTP client for the T3 API.
+
+    Every request goes through one ``requests.Session``, so TCP and TLS
+    connections to the API are kept alive and reused instead of being opened
+    for each call. A single client is safe to share between threads.
+
+    Requests are paced by an adaptive rate limiter shared by every thread
+    using the client. GET requests are retried on connection errors and on
+    429/5xx responses, using the ``Retry-After`` header when the API sends one
+    and jittered exponential backoff otherwise, for up to ``max_retry_time``
+    seconds in total. POST requests are only retried on 429, since the API
+    rejects those before doing any work.
+
+    If a ResponseCache is given, ``get_json`` serves responses for the
+    endpoints it has TTLs for from the cache.
+
+    If a Metrics instance is given, every attempt is recorded with its
+    endpoint, status, latency and response size, along with retries and
+    requests that finally failed.
+    """
+
+    def __init__(
+        self,
+        base_url=BASE_URL,
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        rate_limiter=None,
+        max_retry_time=MAX_RETRY_TIME,
+        response_cache=None,
+        metrics=None,
+    ):
+        """
+        :param base_url: The base URL of the T3 API.
+        :param pool_connections: Number of distinct hosts to keep connection pools for.
+        :param pool_maxsize: Maximum number of open connections kept per host.
+        :param rate_limiter: The AdaptiveRateLimiter to pace requests with, or None for a new one.
+        :param max_retry_time: Give up retrying a request after this many seconds in total.
+        :param response_cache: The ResponseCache to serve reference endpoints from, or None to disable caching.
+        :param metrics: The Metrics to record requests in, or None to disable instrumentation.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.max_retry_time = max_retry_time
+        self.response_cache = response_cache
+        self.metrics = metrics
+        self.session = requests.Session()
+
+        # Block when the pool is exhausted rather than opening throwaway
+        # connections that are discarded after a single request
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=True,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # Headers shared by every request are built once on the session
+        self.session.headers.update(
+            {
+                "Accept": "application/json",
+                "Accept-Encoding": "gzip, deflate",
+                "Connection": "keep-alive",
+                "Content-Type": "application/json",
+            }
+        )
+        self._auth_headers = {}
+
+    def auth_headers(self, access_token):
+        """
+        Return the authorization headers for an access token, building them once.
+
+        :param access_token: The access token for authentication.
+        :return: A dict of headers.
+        """
+        headers = self._auth_headers.get(access_token)
+        if headers is None:
+            headers = {"Authorization": f"Bearer {access_token}"}
+            self._auth_headers[access_token] = headers
+        return headers
+
+    def request(self, method, path, retry_statuses=RETRY_STATUSES, retry_connection_errors=True, **kwargs):
+        """
+        Send a request to the API, pacing and retrying it as needed.
+
+        :param method: The HTTP method, such as ``GET``.
+        :param path: The API path, such as ``/v2/licenses``.
+        :param retry_statuses: Response status codes that should be retried.
+        :param retry_connection_errors: Whether to retry connection errors and timeouts.
+        :param kwargs: Extra arguments for ``requests.Session.request``.
+        :return: The ``requests.Response`` object.
+        :raises requests.exceptions.HTTPError: If the final response is an error.
+        """
+        url = f"{self.base_url}{path}"
+        kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+        deadline = time.monotonic() + self.max_retry_time
+        attempt = 0
+
+        while True:
+            self.rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._record(path, type(e).__name__, start)
+                delay = backoff_delay(attempt)
+                if not retry_connection_errors or time.monotonic() + delay > deadline:
+                    self._record_error(path)
+                    raise
+            else:
+                self._record(path, response.status_code, start, None if kwargs.get("stream") else response)
+                if response.status_code not in retry_statuses:
+                    if response.status_code not in THROTTLE_STATUSES:
+                        self.rate_limiter.on_success()
+                    if not response.ok:
+                        self._record_error(path)
+                    response.raise_for_status()
+                    return response
+
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if response.status_code in THROTTLE_STATUSES:
+                    self.rate_limiter.on_throttle(retry_after)
+
+                delay = retry_after if retry_after is not None else backoff_delay(attempt)
+                if time.monotonic() + delay > deadline:
+                    self._record_error(path)
+                    response.raise_for_status()
+                response.close()
+
+            if self.metrics:
+                self.metrics.record_retry(path)
+            time.sleep(delay)
+            attempt += 1
+
+    def _record(self, path, status, start, response=None):
+        if not self.metrics:
+            return
+        latency = time.perf_counter() - start
+        # Streamed bodies haven't been read yet, so their bytes are recorded by the reader
+        size = len(response.content) if response is not None else 0
+        self.metrics.record_request(path, status, latency, size)
+
+    def _record_error(self, path):
+        if self.metrics:
+            self.metrics.record_error(path)
+
+    def get(self, path, access_token=None, params=None, stream=False, headers=None):
+        """
+        Send a GET request to the API.
+
+        If ``access_token`` is a TokenManager and the API rejects its token
+        with a 401, the token is refreshed and the request is retried once.
+
+        :param path: The API path, such as ``/v2/licenses``.
+        :param access_token: The access token, or a TokenManager, for authentication, if required.
+        :param params: Query string parameters.
+        :param stream: Whether to stream the response body instead of loading it up front.
+        :param headers: Extra headers for this request only.
+        :return: The ``requests.Response`` object.
+        """
+        token_manager = access_token if hasattr(access_token, "get_token") else None
+
+        for attempt in range(2):
+            token = token_manager.get_token() if token_manager else access_token
+            request_headers = self.auth_headers(token) if token else None
+            if headers:
+                request_headers = {**(request_headers or {}), **headers}
+
+            try:
+                return self.request("GET", path, params=params, headers=request_headers, stream=stream)
+            except requests.exceptions.HTTPError as e:
+                if token_manager is None or attempt or e.response is None or e.response.status_code != 401:
+                    raise
+                token_manager.invalidate(token)
+
+    def _record_cache(self, path, hit, revalidated=False):
+        self.response_cache.record(hit)
+        if self.metrics:
+            self.metrics.record_cache(path, hit, revalidated)
+
+    def get_json(self, path, access_token=None, params=None, record_type=None):
+        """
+        Send a GET request to the API and decode the JSON response.
+
+        :param path: The API path, such as ``/v2/licenses``.
+        :param access_token: The access token, or a TokenManager, for authentication, if required.
+        :param params: Query string parameters.
+        :param record_type: A record type from ``t3.records`` to decode records into, or None for plain dicts.
+        :return: The decoded JSON response.
+        """
+        ttl = self.response_cache.ttl_for(path) if self.response_cache else None
+        if ttl is None:
+            return decode(self.get(path, access_token, params=params).content, record_type)
+
+        # Cached responses belong to the user they were fetched for
+        identity = getattr(access_token, "cache_key", None)
+        if identity is None:
+            identity = hashlib.sha256(str(access_token).encode()).hexdigest()
+        key = ResponseCache.make_key(identity, path, params)
+
+        entry = self.response_cache.get(key)
+        if entry is not None and entry.fresh:
+            self._record_cache(path, hit=True)
+            return decode(entry.body, record_type)
+
+        headers = {"If-None-Match": entry.etag} if entry is not None and entry.etag else None
+        response = self.get(path, access_token, params=params, headers=headers)
+        if response.status_code == 304:
+            self._record_cache(path, hit=True, revalidated=True)
+            self.response_cache.refresh(key, entry, ttl)
+            return decode(entry.body, record_type)
+
+        self._record_cache(path, hit=False)
+        self.response_cache.put(key, response.content, response.headers.get("ETag"), ttl)
+        return decode(response.content, record_type)
+
+    def post(self, path, json=None):
+        """
+        Send a POST request with a JSON body to the API.
+
+        :param path: The API path, such as ``/v2/auth/credentials``.
+        :param json: The JSON-serializable request body.
+        :return: The ``requests.Response`` object.
+        """
+        return self.request("POST", path, retry_statuses=(429,), retry_connection_errors=False, json=json)
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Return the process-wide shared client, creating it on first use.
+
+    :return: A T3Client instance.
+    """
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = T3Client(response_cache=ResponseCache(), metrics=get_metrics())
+    return _default_client
+
+
+def set_client(client):
+    """
+    Replace the process-wide shared client, such as with one tuned for a benchmark.
+
+    :param client: The T3Client to use from now on.
+    """
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
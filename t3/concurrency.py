@@ -0,0 +1,150 @@
+import threading
+from collections import deque
+
+
+class TaskGroup:
+    """
+    Tracks tasks submitted to one or more executors so they can be awaited together.
+
+    Tasks may submit further tasks while they run, which lets a tree of API
+    lookups fan out level by level as soon as each parent resolves. ``wait()``
+    returns once every task, including ones submitted later, has finished.
+    After the first failure no new tasks are started, and ``wait()`` re-raises
+    that failure.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._error = None
+
+    def submit(self, executor, fn, *args, **kwargs):
+        """
+        Submit a task to an executor and track it in this group.
+
+        :param executor: The executor to run the task on.
+        :param fn: The callable to run.
+        :return: The Future for the task, or None if the group has already failed.
+        """
+        with self._condition:
+            if self._error is not None:
+                return None
+            self._pending += 1
+
+        future = executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._task_done)
+        return future
+
+    def _task_done(self, future):
+        with self._condition:
+            if not future.cancelled() and future.exception() is not None and self._error is None:
+                self._error = future.exception()
+            self._pending -= 1
+            if self._pending == 0:
+                self._condition.notify_all()
+
+    def wait(self):
+        """
+        Block until every task in the group has finished.
+
+        :raises Exception: The first exception raised by any task.
+        """
+        with self._condition:
+            while self._pending:
+                self._condition.wait()
+            if self._error is not None:
+                raise self._error
+
+
+class Progress:
+    """
+    Thread-safe progress counter that prints a line as each item finishes.
+    """
+
+    def __init__(self, label):
+        """
+        :param label: What is being counted, such as ``manifests``.
+        """
+        self.label = label
+        self.total = 0
+        self.completed = 0
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        """
+        Add items to the total.
+
+        :param count: Number of items that were queued.
+        """
+        with self._lock:
+            self.total += count
+
+    def done(self, message):
+        """
+        Mark one item as finished and print its progress line.
+
+        :param message: Description of the finished item.
+        """
+        with self._lock:
+            self.completed += 1
+            print(f"[{self.completed}/{self.total} {self.label}] {message}")
+
+
+class CappedQueue:
+    """
+    A queue of tasks that keeps at most ``limit`` of them running at once.
+
+    Tasks are submitted to a shared executor as earlier ones finish. Several
+    queues can share one executor, so the executor's size acts as a global cap
+    while each queue has its own cap, without any worker thread sitting idle
+    waiting for a per-queue slot.
+    """
+
+    def __init__(self, tasks, executor, limit):
+        """
+        :param tasks: The TaskGroup that submitted tasks are tracked in.
+        :param executor: The shared executor to run tasks on.
+        :param limit: Maximum number of this queue's tasks running at once.
+        """
+        self._tasks = tasks
+        self._executor = executor
+        self._limit = limit
+        self._queued = deque()
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def put(self, fn, *args, **kwargs):
+        """
+        Queue a task and start it if the queue is under its limit.
+
+        :param fn: The callable to run.
+        """
+        with self._lock:
+            self._queued.append((fn, args, kwargs))
+        self._start_next()
+
+    def _start_next(self):
+        while True:
+            with self._lock:
+                if not self._queued or self._running >= self._limit:
+                    return
+                fn, args, kwargs = self._queued.popleft()
+                self._running += 1
+
+            future = self._tasks.submit(self._executor, self._run, fn, args, kwargs)
+            if future is None:
+                # The task group has failed, so stop starting work
+                with self._lock:
+                    self._running -= 1
+                    self._queued.clear()
+                return
+
+    def _run(self, fn, args, kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            # Start the next task before this one counts as finished, so the
+            # task group never sees zero pending tasks while work is queued
+            with self._lock:
+                self._running -= 1
+            self._start_next()
@@ -0,0 +1,166 @@
+"""
+Non-interactive credentials for unattended runs.
+
+Credentials are looked up in environment variables first, then in a JSON
+secrets file keyed by ``hostname/username`` or just ``hostname``::
+
+    {
+        "ca.metrc.com": {"username": "jane", "password": "..."},
+        "mi.metrc.com": {"username": "jane", "password": "...", "otpCommand": "oathtool --totp -b SECRET"}
+    }
+
+An ``otpCommand`` is run each time a One-Time Password is needed, and its
+output is used as the OTP. Hostnames in OTP_HOSTNAMES always need an OTP,
+and any other hostname does once its secrets entry has an ``otp`` or
+``otpCommand``. The secrets file holds passwords, so it should only be
+readable by its owner.
+"""
+
+import getpass
+import json
+import os
+import shlex
+import stat
+import subprocess
+import sys
+
+from t3.auth import get_token_manager
+
+SECRETS_FILE = os.path.join(os.path.expanduser("~"), ".t3", "secrets.json")  # Default secrets file
+SECRETS_FILE_ENV = "T3_SECRETS_FILE"  # Overrides the secrets file path
+HOSTNAME_ENV = "T3_HOSTNAME"
+USERNAME_ENV = "T3_USERNAME"
+PASSWORD_ENV = "T3_PASSWORD"
+OTP_ENV = "T3_OTP"
+OTP_COMMAND_ENV = "T3_OTP_COMMAND"
+DEFAULT_HOSTNAME = "ca.metrc.com"
+OTP_HOSTNAMES = ("mi.metrc.com",)  # Hostnames that require a One-Time Password
+
+
+def load_secrets(path=None):
+    """
+    Read a secrets file.
+
+    :param path: The secrets file, defaulting to ``T3_SECRETS_FILE`` or ``~/.t3/secrets.json``.
+    :return: A dict of ``hostname`` or ``hostname/username`` to credential dicts, empty if the default file doesn't exist.
+    :raises ValueError: If the file isn't a JSON object.
+    """
+    explicit = path or os.environ.get(SECRETS_FILE_ENV)
+    path = explicit or SECRETS_FILE
+    try:
+        with open(path) as file:
+            secrets = json.load(file)
+            mode = os.fstat(file.fileno()).st_mode
+    except FileNotFoundError:
+        if explicit:
+            raise
+        return {}
+
+    if not isinstance(secrets, dict):
+        raise ValueError(f"Secrets file {path} must hold a JSON object keyed by hostname")
+    if mode & (stat.S_IRWXG | stat.S_IRWXO):
+        print(f"Warning: secrets file {path} can be read by other users. Run: chmod 600 {path}", file=sys.stderr)
+    return secrets
+
+
+class Credentials:
+    """
+    The username, password and OTP source for one hostname.
+    """
+
+    def __init__(self, hostname, username, password=None, otp=None, otp_command=None, needs_otp=None):
+        """
+        :param needs_otp: Whether authenticating needs an OTP, defaulting to whether the hostname is in OTP_HOSTNAMES.
+        """
+        self.hostname = hostname
+        self.username = username
+        self.password = password
+        self.otp = otp
+        self.otp_command = otp_command
+        self.needs_otp = hostname in OTP_HOSTNAMES if needs_otp is None else needs_otp
+
+
+def resolve_credentials(hostname=None, username=None, secrets=None):
+    """
+    Look up the credentials for a hostname in the environment and the secrets file.
+
+    Explicit arguments win over environment variables, which win over the secrets file.
+
+    :param hostname: The hostname of the Metrc instance, defaulting to ``T3_HOSTNAME`` or ``ca.metrc.com``.
+    :param username: The username, defaulting to ``T3_USERNAME`` or the secrets file entry.
+    :param secrets: A dict from ``load_secrets``, or None to load the default secrets file.
+    :return: A Credentials instance. The password and OTP may be missing.
+    :raises ValueError: If no username can be found.
+    """
+    hostname = hostname or os.environ.get(HOSTNAME_ENV) or DEFAULT_HOSTNAME
+    if secrets is None:
+        secrets = load_secrets()
+
+    username = username or os.environ.get(USERNAME_ENV)
+    entry = secrets.get(f"{hostname}/{username}") if username else None
+    if entry is None:
+        entry = secrets.get(hostname, {})
+        if username and entry.get("username", username) != username:
+            entry = {}  # The secrets belong to a different user
+
+    username = username or entry.get("username")
+    if not username:
+        raise ValueError(f"No username for {hostname}. Pass --username, set {USERNAME_ENV} or add it to the secrets file.")
+
+    return Credentials(
+        hostname,
+        username,
+        password=os.environ.get(PASSWORD_ENV) or entry.get("password"),
+        otp=os.environ.get(OTP_ENV) or entry.get("otp"),
+        otp_command=os.environ.get(OTP_COMMAND_ENV) or entry.get("otpCommand"),
+        needs_otp=hostname in OTP_HOSTNAMES or bool(entry.get("otp") or entry.get("otpCommand")),
+    )
+
+
+def _run_otp_command(command):
+    result = subprocess.run(shlex.split(command), capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+
+def credential_providers(credentials, interactive=False):
+    """
+    Build the password and OTP providers a TokenManager authenticates with.
+
+    :param credentials: A Credentials instance.
+    :param interactive: Whether to prompt for a missing password or OTP instead of failing.
+    :return: The password provider, and the OTP provider or None if the hostname doesn't use OTPs.
+    """
+    label = f"{credentials.hostname}/{credentials.username}"
+
+    def password_provider():
+        if credentials.password:
+            return credentials.password
+        if interactive:
+            return getpass.getpass(prompt=f"Password for {label}: ")
+        raise ValueError(f"No password for {label}. Set {PASSWORD_ENV} or add it to the secrets file.")
+
+    def otp_provider():
+        if credentials.otp_command:
+            return _run_otp_command(credentials.otp_command)
+        if credentials.otp:
+            return credentials.otp
+        if interactive:
+            return getpass.getpass(prompt=f"OTP for {label}: ")
+        raise ValueError(f"No OTP for {label}. Set {OTP_COMMAND_ENV} or add otpCommand to the secrets file.")
+
+    return password_provider, otp_provider if credentials.needs_otp else None
+
+
+def credentials_token_manager(credentials, interactive=False):
+    """
+    Return the shared token manager for a set of credentials.
+
+    The password and OTP are only needed when a new token has to be
+    authenticated, so a cached token still works without them.
+
+    :param credentials: A Credentials instance.
+    :param interactive: Whether to prompt for a missing password or OTP instead of failing.
+    :return: A TokenManager.
+    """
+    password_provider, otp_provider = credential_providers(credentials, interactive)
+    return get_token_manager(credentials.hostname, credentials.username, password_provider, otp_provider)
@@ -0,0 +1,222 @@
+import csv
+import os
+from contextlib import ExitStack
+
+from t3.metrics import get_metrics
+
+
+class ColumnRegistry:
+    """
+    Keeps track of every column seen across a stream of records.
+
+    Columns are kept in the order they were first seen. Because new columns are
+    only ever appended, a row written with an earlier set of columns is always a
+    prefix of the same row written with the final set of columns.
+    """
+
+    def __init__(self, columns=()):
+        """
+        :param columns: Columns that are already known, in order.
+        """
+        self.columns = []
+        self._known = set()
+        self.add(columns)
+
+    def add(self, keys):
+        """
+        Register any keys that haven't been seen before.
+
+        :param keys: An iterable of column names.
+        :return: True if at least one new column was added.
+        """
+        added = False
+        for key in keys:
+            if key not in self._known:
+                self._known.add(key)
+                self.columns.append(key)
+                added = True
+        return added
+
+    def row(self, record):
+        """
+        Build a CSV row for a record using the currently known columns.
+
+        :param record: A dict of values keyed by column name.
+        :return: A list of values, one per known column.
+        """
+        return [record.get(column, "") for column in self.columns]
+
+
+def _rewrite_with_header(spill_file, output_file, columns):
+    """
+    Copy the rows in a spill file into the output file under a new header.
+
+    Rows are streamed one at a time and padded out to the full column count.
+
+    :param spill_file: File path of the spill CSV, including its original header row.
+    :param output_file: File path for the output CSV.
+    :param columns: The complete list of columns.
+    """
+    with open(spill_file, newline="") as spill, open(output_file, "w", newline="") as output:
+        reader = csv.reader(spill)
+        writer = csv.writer(output)
+        next(reader)  # Skip the original header
+        writer.writerow(columns)
+        for row in reader:
+            if len(row) < len(columns):
+                row.extend([""] * (len(columns) - len(row)))
+            writer.writerow(row)
+    os.remove(spill_file)
+
+
+class CsvWriter:
+    """
+    Writes pages of records to a CSV file as they arrive.
+
+    Each page is appended to a spill file (the output path plus ``.part``) and
+    flushed as soon as it is received, so only one page is held in memory at a
+    time and rows reach disk while later pages are still loading.
+
+    The header is built from every record rather than just the first one. If a
+    later record introduces a new key, the spill file is rewritten once on
+    ``close()`` with the full header and earlier rows are padded with empty
+    values. If the columns never change, the spill file is simply renamed into
+    place. The output file is only created once the first record is seen.
+
+    Used as a context manager, the output is only finalized if no exception
+    was raised; otherwise the spill file is left behind as it is. An
+    interrupted write can be continued by passing a ``state()`` snapshot taken
+    after the last page that was known to be complete. If that run had already
+    moved its output into place, so the spill file is gone but the output file
+    exists, the writer starts out ``finished`` and there is nothing to continue.
+    """
+
+    def __init__(self, output_file, resume_state=None):
+        """
+        :param output_file: File path for the output CSV.
+        :param resume_state: A ``state()`` snapshot to continue a partial spill file from.
+        """
+        self.path = output_file
+        self.rows_written = 0
+        self._spill_file = f"{output_file}.part"
+        self._registry = ColumnRegistry()
+        self._header_length = 0
+        self._output = None
+        self._writer = None
+        self.finished = False
+        if resume_state:
+            self._resume(resume_state)
+
+    def _resume(self, state):
+        if not os.path.exists(self._spill_file) and os.path.exists(self.path):
+            # The run was interrupted after close() but before its journal was cleared
+            self.finished = True
+            self.rows_written = state["rows_written"]
+            return
+
+        # Drop anything written after the snapshot, such as a half-written page
+        os.truncate(self._spill_file, state["offset"])
+        self._output = open(self._spill_file, "a", newline="")
+        self._writer = csv.writer(self._output)
+        self._registry.add(state["columns"])
+        self._header_length = state["header_length"]
+        self.rows_written = state["rows_written"]
+
+    def state(self):
+        """
+        Snapshot how far the output has been written, for resuming later.
+
+        The spill file is synced to disk first, so the snapshot can be
+        journaled without getting ahead of the data it describes.
+
+        :return: A JSON-serializable dict, or None if nothing has been written yet.
+        """
+        if self._output is None:
+            return None
+        os.fsync(self._output.fileno())
+        return {
+            "offset": os.fstat(self._output.fileno()).st_size,
+            "columns": list(self._registry.columns),
+            "header_length": self._header_length,
+            "rows_written": self.rows_written,
+        }
+
+    def write_page(self, records):
+        """
+        Append a page of records to the output.
+
+        :param records: A list of dicts.
+        """
+        if not records:
+            return
+        if self.finished:
+            raise ValueError(f"{self.path} has already been written")
+
+        if self._output is None:
+            # Create the output directory if it doesn't exist
+            output_dir = os.path.dirname(self.path)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+
+            self._output = open(self._spill_file, "w", newline="")
+            self._writer = csv.writer(self._output)
+            self._registry.add(records[0].keys())
+            self._header_length = len(self._registry.columns)
+            self._writer.writerow(self._registry.columns)
+
+        for record in records:
+            self._registry.add(record.keys())
+            self._writer.writerow(self._registry.row(record))
+
+        self._output.flush()
+        self.rows_written += len(records)
+
+    def close(self):
+        """
+        Finish writing and move the output into place. Calling it again does nothing.
+
+        :return: The number of rows written.
+        """
+        if self._output is None:
+            return self.rows_written
+
+        self._output.close()
+        self._output = None
+        if len(self._registry.columns) == self._header_length:
+            os.replace(self._spill_file, self.path)
+        else:
+            _rewrite_with_header(self._spill_file, self.path, self._registry.columns)
+        return self.rows_written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._output is not None:
+            self._output.close()
+            self._output = None
+
+
+def write_pages_to_csv(pages, output_file):
+    """
+    Write pages of records to a CSV file as they arrive.
+
+    See CsvWriter for how the header and spill file are handled. Time spent
+    writing is recorded as the ``write`` phase in the shared metrics.
+
+    :param pages: An iterable of pages, where each page is a list of dicts.
+    :param output_file: File path for the output CSV.
+    :return: The number of rows written.
+    """
+    metrics = get_metrics()
+    writer = CsvWriter(output_file)
+    with ExitStack() as stack:
+        stack.enter_context(writer)
+        for records in pages:
+            with metrics.timer("write"):
+                writer.write_page(records)
+        stack.pop_all()  # Every page was written, so close the writer below rather than on exit
+    with metrics.timer("write"):
+        return writer.close()
@@ -0,0 +1,120 @@
+"""
+Pluggable JSON decoding for API responses.
+
+The fastest installed decoder is used: ``orjson`` for plain dicts and lists,
+``msgspec`` for decoding straight into the record types in ``t3.records``,
+and the standard library ``json`` module when neither is installed. Set
+``T3_JSON_DECODER`` to ``orjson``, ``msgspec`` or ``json`` to force one.
+"""
+
+import json
+import os
+import threading
+from typing import List, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+JSON_DECODER_ENV = "T3_JSON_DECODER"  # Forces the decoder for plain dicts and lists
+
+DECODERS = {"json": json.loads}
+if msgspec is not None:
+    DECODERS["msgspec"] = msgspec.json.decode
+if orjson is not None:
+    DECODERS["orjson"] = orjson.loads
+
+
+def pick_decoder(name=None):
+    """
+    :param name: A key of DECODERS, or None to pick the fastest installed decoder.
+    :return: The decoder name.
+    :raises ValueError: If the decoder isn't installed.
+    """
+    if name is None:
+        name = next(candidate for candidate in ("orjson", "msgspec", "json") if candidate in DECODERS)
+    if name not in DECODERS:
+        raise ValueError(f"JSON decoder {name!r} isn't available. Installed decoders: {', '.join(sorted(DECODERS))}")
+    return name
+
+
+decoder_name = pick_decoder(os.environ.get(JSON_DECODER_ENV) or None)
+_record_decoders = {}
+_record_decoders_lock = threading.Lock()
+
+
+def set_decoder(name):
+    """
+    Choose the decoder for plain dicts and lists.
+
+    :param name: ``orjson``, ``msgspec`` or ``json``.
+    """
+    global decoder_name
+    decoder_name = pick_decoder(name)
+
+
+def loads(data):
+    """
+    Decode a JSON document into dicts and lists.
+
+    :param data: The JSON document as bytes or a string.
+    :return: The decoded value.
+    """
+    return DECODERS[decoder_name](data)
+
+
+def _struct_decoders(record_type):
+    # Decoders for a list of records and for a page of them, built once per type
+    decoders = _record_decoders.get(record_type)
+    if decoders is None:
+        with _record_decoders_lock:
+            decoders = _record_decoders.get(record_type)
+            if decoders is None:
+                page_type = msgspec.defstruct(
+                    f"{record_type.__name__}Page",
+                    [
+                        ("data", List[record_type], []),
+                        ("total", Optional[int], None),
+                        ("totalPages", Optional[int], None),
+                    ],
+                    gc=False,
+                )
+                decoders = (msgspec.json.Decoder(List[record_type]), msgspec.json.Decoder(page_type))
+                _record_decoders[record_type] = decoders
+    return decoders
+
+
+def decode(data, record_type=None):
+    """
+    Decode an API response body, optionally into compact records.
+
+    With a record type, a top-level list becomes a list of records, and a page
+    (an object with a ``data`` list) becomes a dict whose ``data`` is a list of
+    records, alongside its ``total`` and ``totalPages``. Fields the record type
+    doesn't have are dropped.
+
+    :param data: The response body as bytes.
+    :param record_type: A record type from ``t3.records``, or None for plain dicts.
+    :return: The decoded value.
+    """
+    if record_type is None:
+        return loads(data)
+
+    if hasattr(record_type, "__struct_fields__"):
+        list_decoder, page_decoder = _struct_decoders(record_type)
+        if data.lstrip()[:1] in (b"[", "["):
+            return list_decoder.decode(data)
+        page = page_decoder.decode(data)
+        return {"data": page.data, "total": page.total, "totalPages": page.totalPages}
+
+    value = loads(data)
+    if isinstance(value, list):
+        return [record_type.from_dict(item) for item in value]
+    value["data"] = [record_type.from_dict(item) for item in value.get("data", [])]
+    return value
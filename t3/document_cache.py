@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024  # Keep up to 2 GiB of cached documents
+HASH_CHUNK_SIZE = 1024 * 1024  # Read files 1 MiB at a time when hashing
+INDEX_TIMEOUT = 30.0  # Seconds to wait for another process to finish updating the index
+
+
+def _hash_file(path):
+    """
+    Compute the SHA-256 hex digest of a file without loading it into memory.
+
+    :param path: The file to hash.
+    :return: The hex digest as a string.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link_or_copy(source, destination):
+    """
+    Place a file at a destination path, hardlinking it if possible.
+
+    The file is linked to a temporary name first and then renamed over the
+    destination, so an existing destination file is replaced rather than
+    written into (which would also change any other links to it).
+
+    :param source: The existing file.
+    :param destination: The path to place it at.
+    """
+    temp_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        # Hardlinks aren't available across filesystems or on some platforms
+        shutil.copyfile(source, temp_path)
+    os.replace(temp_path, destination)
+
+
+class DocumentCache:
+    """
+    An on-disk, content-addressed cache of downloaded documents.
+
+    Documents are keyed by their API document file ID and stored once per
+    unique SHA-256 content hash, so the same lab result PDF attached to many
+    packages or manifests is only downloaded and stored once. Cached files are
+    hardlinked into output locations where possible. When the cache grows past
+    ``max_bytes`` the least recently used documents are evicted.
+
+    The index of documents and stored files is a SQLite database in the cache
+    directory, so several caches or processes using the same directory see
+    each other's documents instead of overwriting each other's index. A cache
+    instance is safe to share between threads in one process.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param cache_dir: Directory to keep cached documents and the index in.
+        :param max_bytes: Maximum total size of cached documents.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._objects_dir = os.path.join(cache_dir, "objects")
+        self._index_path = os.path.join(cache_dir, "index.sqlite3")
+        self._lock = threading.Lock()
+
+        os.makedirs(self._objects_dir, exist_ok=True)
+        self._connection = sqlite3.connect(self._index_path, timeout=INDEX_TIMEOUT, check_same_thread=False)
+        with self._connection:
+            self._connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    document_id TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS objects (
+                    content_hash TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS documents_content_hash_idx ON documents (content_hash);
+                """
+            )
+        self._import_json_index()
+
+    def _import_json_index(self):
+        # Earlier versions kept the index in index.json, so carry its entries over once
+        json_path = os.path.join(self.cache_dir, "index.json")
+        try:
+            with open(json_path) as file:
+                index = json.load(file)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            index = {}
+
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO objects (content_hash, size, last_used) VALUES (?, ?, ?)",
+                (
+                    (content_hash, entry["size"], entry.get("last_used", 0.0))
+                    for content_hash, entry in index.get("objects", {}).items()
+                ),
+            )
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO documents (document_id, content_hash) VALUES (?, ?)",
+                index.get("documents", {}).items(),
+            )
+        try:
+            os.remove(json_path)
+        except FileNotFoundError:
+            pass  # Another process using the cache imported it first
+
+    def _object_path(self, content_hash):
+        return os.path.join(self._objects_dir, content_hash[:2], f"{content_hash}.pdf")
+
+    def fetch(self, document_id, destination):
+        """
+        Place a cached document at a destination path, if it is cached.
+
+        :param document_id: The document file ID.
+        :param destination: The path to place the document at.
+        :return: True if the document was cached and placed, False otherwise.
+        """
+        document_id = str(document_id)
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT content_hash FROM documents WHERE document_id = ?", (document_id,)
+            ).fetchone()
+            if row is None:
+                return False
+
+            content_hash = row[0]
+            object_path = self._object_path(content_hash)
+            if not os.path.exists(object_path):
+                # The cached file went missing, so forget about it
+                self._connection.execute("DELETE FROM documents WHERE content_hash = ?", (content_hash,))
+                self._connection.execute("DELETE FROM objects WHERE content_hash = ?", (content_hash,))
+                return False
+
+            _link_or_copy(object_path, destination)
+            self._connection.execute(
+                "UPDATE objects SET last_used = ? WHERE content_hash = ?", (time.time(), content_hash)
+            )
+            return True
+
+    def add(self, document_id, source):
+        """
+        Add a downloaded document to the cache.
+
+        :param document_id: The document file ID.
+        :param source: The path of the downloaded document.
+        :return: The SHA-256 content hash of the document.
+        """
+        document_id = str(document_id)
+        content_hash = _hash_file(source)
+        object_path = self._object_path(content_hash)
+
+        with self._lock, self._connection:
+            if not os.path.exists(object_path):
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                _link_or_copy(source, object_path)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO objects (content_hash, size, last_used) VALUES (?, ?, ?)",
+                (content_hash, os.path.getsize(object_path), time.time()),
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO documents (document_id, content_hash) VALUES (?, ?)",
+                (document_id, content_hash),
+            )
+            self._evict()
+
+        return content_hash
+
+    def _evict(self):
+        total_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+
+        rows = self._connection.execute("SELECT content_hash, size FROM objects ORDER BY last_used").fetchall()
+        for content_hash, size in rows:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(self._object_path(content_hash))
+            except FileNotFoundError:
+                pass
+            self._connection.execute("DELETE FROM documents WHERE content_hash = ?", (content_hash,))
+            self._connection.execute("DELETE FROM objects WHERE content_hash = ?", (content_hash,))
+            total_bytes -= size
+
+
+_document_caches = {}
+_document_caches_lock = threading.Lock()
+
+
+def get_document_cache(cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Return the shared document cache for a directory, creating it on first use.
+
+    Jobs running side by side in one process should share a cache rather
+    than each opening their own on the same directory.
+
+    :param cache_dir: Directory to keep cached documents and the index in.
+    :param max_bytes: Maximum total size of cached documents, used when the cache is created.
+    :return: A DocumentCache instance.
+    """
+    key = os.path.abspath(cache_dir)
+    with _document_caches_lock:
+        if key not in _document_caches:
+            _document_caches[key] = DocumentCache(cache_dir, max_bytes)
+        return _document_caches[key]
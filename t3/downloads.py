@@ -0,0 +1,145 @@
+import os
+import re
+
+import requests
+
+from t3.client import get_client
+
+CHUNK_SIZE = 64 * 1024  # Write downloads to disk 64 KiB at a time
+VALIDATOR_SUFFIX = ".validator"  # Appended to a partial file's path to store the ETag or Last-Modified it came with
+
+
+def resume_request(partial_path):
+    """
+    Work out how to continue a download from a leftover partial file.
+
+    A partial file is only continued if the ``ETag`` or ``Last-Modified``
+    value of the response it came from was saved next to it, so the range
+    request can carry ``If-Range`` and the server sends the whole file if
+    the document has changed since. Otherwise the download starts over.
+
+    :param partial_path: File path of the partial download.
+    :return: The offset to continue from, and the request headers.
+    """
+    # Ask for the raw bytes so range offsets line up with what is on disk
+    headers = {"Accept-Encoding": "identity"}
+    offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+    if not offset:
+        return 0, headers
+
+    try:
+        with open(partial_path + VALIDATOR_SUFFIX) as file:
+            validator = file.read().strip()
+    except FileNotFoundError:
+        validator = None
+    if not validator:
+        return 0, headers
+
+    headers["Range"] = f"bytes={offset}-"
+    headers["If-Range"] = validator
+    return offset, headers
+
+
+def response_offset(status_code, headers, offset):
+    """
+    Check where a download response's body starts.
+
+    :param status_code: The response's HTTP status code.
+    :param headers: The response headers.
+    :param offset: The offset the range request asked for.
+    :return: ``offset`` for a 206 whose ``Content-Range`` starts there, 0 for a full response, or None for a 206 that starts anywhere else.
+    """
+    if status_code != 206:
+        return 0
+    match = re.match(r"bytes (\d+)-", headers.get("Content-Range", ""))
+    if match and int(match.group(1)) == offset:
+        return offset
+    return None
+
+
+def save_validator(partial_path, headers):
+    """
+    Save the ``ETag`` or ``Last-Modified`` value of a full download response next to its partial file.
+
+    Weak ETags can't be used with ``If-Range``, so ``Last-Modified`` is used instead.
+
+    :param partial_path: File path of the partial download.
+    :param headers: The response headers.
+    """
+    etag = headers.get("ETag")
+    validator = etag if etag and not etag.startswith("W/") else headers.get("Last-Modified")
+    if validator:
+        with open(partial_path + VALIDATOR_SUFFIX, "w") as file:
+            file.write(validator)
+    elif os.path.exists(partial_path + VALIDATOR_SUFFIX):
+        os.remove(partial_path + VALIDATOR_SUFFIX)
+
+
+def discard_partial(partial_path):
+    """
+    Remove a partial download and its saved validator, if they exist.
+
+    :param partial_path: File path of the partial download.
+    """
+    for path in (partial_path, partial_path + VALIDATOR_SUFFIX):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def download_to_file(path, access_token, destination, params=None, chunk_size=CHUNK_SIZE, client=None):
+    """
+    Download a file from the API to disk without buffering it in memory.
+
+    The response is written chunk by chunk to ``<destination>.part``, fsynced,
+    and then atomically renamed to ``destination``, so a partially written file
+    is never left at the final path. If a ``.part`` file is left over from an
+    interrupted download, the download resumes from where it stopped using an
+    HTTP range request with ``If-Range``, so a document that changed in the
+    meantime is downloaded again in full. If the server doesn't honor the
+    range, or answers with a range that doesn't start where the partial file
+    ends, the download starts again from the beginning.
+
+    :param path: The API path, such as ``/v2/transfers/manifest``.
+    :param access_token: The access token for authentication.
+    :param destination: The file path to write the download to.
+    :param params: Query string parameters.
+    :param chunk_size: Number of bytes to read and write at a time.
+    :param client: The T3Client to use, defaulting to the shared client.
+    :return: The destination file path.
+    """
+    client = client or get_client()
+    partial_path = f"{destination}.part"
+    offset, headers = resume_request(partial_path)
+
+    try:
+        response = client.get(path, access_token, params=params, stream=True, headers=headers)
+    except requests.exceptions.HTTPError as e:
+        if offset and e.response is not None and e.response.status_code == 416:
+            # The leftover partial file doesn't match the document any more
+            discard_partial(partial_path)
+            return download_to_file(path, access_token, destination, params, chunk_size, client)
+        raise
+
+    with response:
+        offset = response_offset(response.status_code, response.headers, offset)
+        if offset is not None:
+            if not offset:
+                save_validator(partial_path, response.headers)
+            size = 0
+            with open(partial_path, "ab" if offset else "wb") as file:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    file.write(chunk)
+                    size += len(chunk)
+                file.flush()
+                os.fsync(file.fileno())
+
+    if offset is None:
+        # The range doesn't line up with the partial file, so start over
+        discard_partial(partial_path)
+        return download_to_file(path, access_token, destination, params, chunk_size, client)
+
+    if client.metrics:
+        client.metrics.record_bytes(path, size)
+    os.replace(partial_path, destination)
+    discard_partial(partial_path)
+    return destination
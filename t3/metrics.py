@@ -0,0 +1,333 @@
+import atexit
+import json
+import os
+import random
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_FILE_ENV = "T3_METRICS_FILE"  # Write a JSON summary to this file at exit, or to stderr if set to "-"
+METRICS_PORT_ENV = "T3_METRICS_PORT"  # Serve Prometheus metrics on this port while the script runs
+MAX_SAMPLES = 100_000  # Latency samples kept per endpoint for percentiles
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)  # Histogram bucket bounds, in seconds
+
+
+def percentile(sorted_values, fraction):
+    """
+    :param sorted_values: A sorted list of numbers.
+    :param fraction: The percentile as a fraction, such as 0.95.
+    :return: The nearest-rank percentile, or None if there are no values.
+    """
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class EndpointStats:
+    """
+    Request counts, bytes, latencies and response cache lookups for one API endpoint.
+    """
+
+    __slots__ = (
+        "requests",
+        "statuses",
+        "errors",
+        "retries",
+        "bytes",
+        "total_latency",
+        "bucket_counts",
+        "samples",
+        "cache_hits",
+        "cache_misses",
+        "cache_revalidations",
+    )
+
+    def __init__(self):
+        self.requests = 0
+        self.statuses = {}
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.total_latency = 0.0
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.samples = []
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_revalidations = 0
+
+    def add_latency(self, seconds):
+        self.total_latency += seconds
+        index = bisect_left(LATENCY_BUCKETS, seconds)
+        if index < len(LATENCY_BUCKETS):
+            self.bucket_counts[index] += 1
+
+        # Keep a uniform sample of every latency seen once the cap is reached
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(seconds)
+        else:
+            slot = random.randrange(self.requests)
+            if slot < MAX_SAMPLES:
+                self.samples[slot] = seconds
+
+
+class Metrics:
+    """
+    Collects request-level metrics for the T3 client.
+
+    The client records every HTTP attempt with its endpoint, status, latency
+    and response size, along with retries, requests that finally failed and
+    response cache hits and misses.
+    Other code can time phases of work, such as writing CSV, with ``timer()``,
+    so time spent on output can be compared with time spent on the network.
+
+    ``summary()`` reports per-endpoint p50/p95/p99 latencies, throughput and
+    error counts, and ``prometheus()`` renders the same data in the Prometheus
+    text format. A Metrics instance is safe to share between threads.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self._endpoints = {}
+        self._phases = {}
+        self._lock = threading.Lock()
+
+    def _endpoint(self, endpoint):
+        stats = self._endpoints.get(endpoint)
+        if stats is None:
+            stats = self._endpoints[endpoint] = EndpointStats()
+        return stats
+
+    def record_request(self, endpoint, status, latency, size=0):
+        """
+        Record one HTTP attempt.
+
+        :param endpoint: The API path, such as ``/v2/licenses``.
+        :param status: The response status code, or the exception name if the request failed without a response.
+        :param latency: Seconds from sending the request to receiving the response headers.
+        :param size: Number of response body bytes received.
+        """
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats.requests += 1
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.bytes += size
+            stats.add_latency(latency)
+
+    def record_bytes(self, endpoint, size):
+        """
+        Record response body bytes read after the request was recorded, such as a streamed download.
+
+        :param endpoint: The API path.
+        :param size: Number of bytes received.
+        """
+        with self._lock:
+            self._endpoint(endpoint).bytes += size
+
+    def record_retry(self, endpoint):
+        """
+        :param endpoint: The API path of a request that is about to be retried.
+        """
+        with self._lock:
+            self._endpoint(endpoint).retries += 1
+
+    def record_error(self, endpoint):
+        """
+        :param endpoint: The API path of a request that failed after all retries.
+        """
+        with self._lock:
+            self._endpoint(endpoint).errors += 1
+
+    def record_cache(self, endpoint, hit, revalidated=False):
+        """
+        Record a response cache lookup.
+
+        :param endpoint: The API path.
+        :param hit: Whether the response was served from the cache.
+        :param revalidated: Whether the API had to confirm the cached response was unchanged first.
+        """
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            if hit:
+                stats.cache_hits += 1
+            else:
+                stats.cache_misses += 1
+            if revalidated:
+                stats.cache_revalidations += 1
+
+    def add_time(self, phase, seconds):
+        """
+        Add time spent on a phase of work.
+
+        :param phase: The name of the phase, such as ``write.csv``.
+        :param seconds: The time spent.
+        """
+        with self._lock:
+            self._phases[phase] = self._phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, phase):
+        """
+        Time a block of code as part of a phase of work.
+
+        :param phase: The name of the phase, such as ``write.csv``.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def summary(self):
+        """
+        :return: A JSON-serializable dict summarizing every endpoint and phase.
+        """
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            endpoints = {}
+            for endpoint, stats in sorted(self._endpoints.items()):
+                samples = sorted(stats.samples)
+                endpoints[endpoint] = {
+                    "requests": stats.requests,
+                    "statuses": {str(status): count for status, count in stats.statuses.items()},
+                    "errors": stats.errors,
+                    "retries": stats.retries,
+                    "bytes": stats.bytes,
+                    "requests_per_second": stats.requests / elapsed if elapsed else None,
+                    "latency_mean": stats.total_latency / stats.requests if stats.requests else None,
+                    "latency_p50": percentile(samples, 0.50),
+                    "latency_p95": percentile(samples, 0.95),
+                    "latency_p99": percentile(samples, 0.99),
+                    "cache_hits": stats.cache_hits,
+                    "cache_misses": stats.cache_misses,
+                    "cache_revalidations": stats.cache_revalidations,
+                }
+
+            requests = sum(stats.requests for stats in self._endpoints.values())
+            return {
+                "elapsed_seconds": elapsed,
+                "requests": requests,
+                "requests_per_second": requests / elapsed if elapsed else None,
+                "bytes": sum(stats.bytes for stats in self._endpoints.values()),
+                # Summed over every worker, so this can exceed the elapsed time
+                "request_seconds": sum(stats.total_latency for stats in self._endpoints.values()),
+                "phase_seconds": dict(self._phases),
+                "endpoints": endpoints,
+            }
+
+    def prometheus(self):
+        """
+        :return: The metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+
+            lines = ["# TYPE t3_requests_total counter"]
+            for endpoint, stats in endpoints:
+                for status, count in sorted(stats.statuses.items(), key=str):
+                    lines.append(f't3_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+            for name, field in (
+                ("t3_request_errors_total", "errors"),
+                ("t3_request_retries_total", "retries"),
+                ("t3_response_bytes_total", "bytes"),
+                ("t3_cache_hits_total", "cache_hits"),
+                ("t3_cache_misses_total", "cache_misses"),
+                ("t3_cache_revalidations_total", "cache_revalidations"),
+            ):
+                lines.append(f"# TYPE {name} counter")
+                for endpoint, stats in endpoints:
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {getattr(stats, field)}')
+
+            lines.append("# TYPE t3_request_duration_seconds histogram")
+            for endpoint, stats in endpoints:
+                label = f'endpoint="{endpoint}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, stats.bucket_counts):
+                    cumulative += count
+                    lines.append(f't3_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f't3_request_duration_seconds_bucket{{{label},le="+Inf"}} {stats.requests}')
+                lines.append(f"t3_request_duration_seconds_sum{{{label}}} {stats.total_latency}")
+                lines.append(f"t3_request_duration_seconds_count{{{label}}} {stats.requests}")
+
+            lines.append("# TYPE t3_phase_seconds_total counter")
+            for phase, seconds in sorted(self._phases.items()):
+                lines.append(f't3_phase_seconds_total{{phase="{phase}"}} {seconds}')
+        return "\n".join(lines) + "\n"
+
+    def write_summary(self, output_file):
+        """
+        Write the JSON summary to a file.
+
+        :param output_file: File path for the summary, or ``-`` for stderr.
+        """
+        summary = json.dumps(self.summary(), indent=2)
+        if output_file == "-":
+            print(summary, file=sys.stderr)
+            return
+
+        output_dir = os.path.dirname(output_file)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(output_file, "w") as file:
+            file.write(summary)
+
+    def serve_prometheus(self, port, host="127.0.0.1"):
+        """
+        Serve the metrics at ``/metrics`` on a background thread.
+
+        :param port: The port to listen on.
+        :param host: The address to listen on.
+        :return: The ThreadingHTTPServer, which can be stopped with ``shutdown()``.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+_default_metrics = None
+_default_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """
+    Return the process-wide shared metrics, creating them on first use.
+
+    On creation, a JSON summary is scheduled for exit if ``T3_METRICS_FILE`` is
+    set, and Prometheus metrics are served if ``T3_METRICS_PORT`` is set.
+
+    :return: A Metrics instance.
+    """
+    global _default_metrics
+    if _default_metrics is None:
+        with _default_metrics_lock:
+            if _default_metrics is None:
+                metrics = Metrics()
+                summary_file = os.environ.get(METRICS_FILE_ENV)
+                if summary_file:
+                    atexit.register(metrics.write_summary, summary_file)
+                port = os.environ.get(METRICS_PORT_ENV)
+                if port:
+                    metrics.serve_prometheus(int(port))
+                _default_metrics = metrics
+    return _default_metrics
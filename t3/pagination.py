@@ -0,0 +1,245 @@
+import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from t3.client import get_client
+from t3.decoding import decode
+from t3.query import compile_fields, project
+
+PAGE_SIZE = 500  # Number of records per page
+MAX_WORKERS = 8  # Maximum number of pages to load concurrently
+
+
+def get_page(path, access_token, page, page_size=PAGE_SIZE, params=None, client=None, record_type=None):
+    """
+    Retrieve a single page from a paginated API endpoint.
+
+    :param path: The API path, such as ``/v2/packages/active``.
+    :param access_token: The access token for authentication.
+    :param page: The 1-based page number to fetch.
+    :param page_size: Number of records per page.
+    :param params: Additional query string parameters, such as ``licenseNumber``.
+    :param client: The T3Client to use, defaulting to the shared client.
+    :param record_type: A record type from ``t3.records`` to decode records into, or None for plain dicts.
+    :return: The decoded JSON response for the page.
+    """
+    client = client or get_client()
+    page_params = dict(params or {}, page=page, pageSize=page_size)
+    return client.get_json(path, access_token, params=page_params, record_type=record_type)
+
+
+def get_page_count(response_data, page_size):
+    """
+    Work out how many pages a paginated endpoint has from its first response.
+
+    :param response_data: The decoded JSON response for page 1.
+    :param page_size: Number of records per page that was requested.
+    :return: The total number of pages, or None if the response doesn't say.
+    """
+    if response_data.get("total") is not None:
+        return max(1, math.ceil(response_data["total"] / page_size))
+    if response_data.get("totalPages") is not None:
+        return max(1, response_data["totalPages"])
+    return None
+
+
+def iter_pages(
+    path,
+    access_token,
+    params=None,
+    page_size=PAGE_SIZE,
+    max_workers=MAX_WORKERS,
+    client=None,
+    start_page=1,
+    query=None,
+    fields=None,
+    record_type=None,
+    on_total=None,
+):
+    """
+    Yield each page of records from a paginated API endpoint, in page order.
+
+    The first page is loaded on its own to learn the total page count, then the
+    remaining pages are loaded concurrently. Only a small window of pages is in
+    flight at once, so memory use stays flat no matter how many records there
+    are. If the response doesn't report a total, pages are walked one at a time
+    until an empty page comes back.
+
+    Pages are yielded in order with no gaps, so callers can number them by
+    counting from ``start_page``.
+
+    A Query filters and sorts the records on the server. ``fields`` trims each
+    record to the listed fields as soon as its page is decoded. A record type
+    from ``t3.records`` decodes records into compact objects instead of dicts.
+
+    ``on_total`` receives the total record count the API reports, so callers
+    can check that every record was received.
+
+    :param path: The API path, such as ``/v2/packages/active``.
+    :param access_token: The access token for authentication.
+    :param params: Additional query string parameters, such as ``licenseNumber``.
+    :param page_size: Number of records per page.
+    :param max_workers: Maximum number of pages to load at the same time.
+    :param client: The T3Client to use, defaulting to the shared client.
+    :param start_page: The 1-based page to start from, used when resuming.
+    :param query: A Query to filter and sort the records with.
+    :param fields: Field names to keep in each record, or None to keep every field. See ``t3.query.compile_fields``.
+    :param record_type: A record type from ``t3.records`` to decode records into, or None for plain dicts.
+    :param on_total: Called with the total number of records the API reports, or None if it doesn't, once the first page is loaded.
+    :return: A generator of lists of records, one list per page.
+    """
+    if query is not None:
+        params = query.params(params)
+    tree = compile_fields(fields) if fields else None
+
+    def page_records(response_data):
+        records = response_data.get("data", [])
+        if tree is not None:
+            records = [project(record, tree) for record in records]
+        return records
+
+    first_page = get_page(path, access_token, start_page, page_size, params, client, record_type)
+    if on_total is not None:
+        on_total(first_page.get("total"))
+    records = page_records(first_page)
+    if not records:
+        return
+    yield records
+
+    page_count = get_page_count(first_page, page_size)
+    if page_count is None:
+        page = start_page + 1
+        while True:
+            records = page_records(get_page(path, access_token, page, page_size, params, client, record_type))
+            if not records:
+                break
+            yield records
+            page += 1
+        return
+
+    pages = _fetch_in_order(
+        lambda page: get_page(path, access_token, page, page_size, params, client, record_type),
+        range(start_page + 1, page_count + 1),
+        max_workers,
+    )
+    for response_data in pages:
+        yield page_records(response_data)
+
+
+def get_all_records(path, access_token, params=None, **kwargs):
+    """
+    Load every record from a paginated API endpoint into a list.
+
+    :param path: The API path, such as ``/v2/transfers/outgoing/active``.
+    :param access_token: The access token for authentication.
+    :param params: Additional query string parameters, such as ``licenseNumber``.
+    :param kwargs: Other ``iter_pages`` options, such as ``query``, ``fields`` or ``record_type``.
+    :return: The list of records, and the total number of records the API reported, or None if it didn't.
+    """
+    totals = []
+    records = []
+    for page in iter_pages(path, access_token, params, on_total=totals.append, **kwargs):
+        records.extend(page)
+    return records, totals[0] if totals else None
+
+
+def get_page_body(path, access_token, page, page_size=PAGE_SIZE, params=None, client=None):
+    """
+    Retrieve a single page from a paginated API endpoint without decoding it.
+
+    :param path: The API path, such as ``/v2/packages/active``.
+    :param access_token: The access token for authentication.
+    :param page: The 1-based page number to fetch.
+    :param page_size: Number of records per page.
+    :param params: Additional query string parameters, such as ``licenseNumber``.
+    :param client: The T3Client to use, defaulting to the shared client.
+    :return: The response body as bytes.
+    """
+    client = client or get_client()
+    page_params = dict(params or {}, page=page, pageSize=page_size)
+    return client.get(path, access_token, params=page_params).content
+
+
+def iter_page_bodies(
+    path,
+    access_token,
+    params=None,
+    page_size=PAGE_SIZE,
+    max_workers=MAX_WORKERS,
+    client=None,
+    start_page=1,
+    query=None,
+    on_total=None,
+):
+    """
+    Yield the raw JSON body of each page from a paginated API endpoint, in page order.
+
+    Pages are loaded the same way as ``iter_pages``, but are left undecoded so
+    that decoding can happen elsewhere, such as in a process pool. Only the
+    first page is decoded here, to learn the page count. If the response
+    doesn't report a total, each page is decoded to check whether it is empty.
+
+    :param path: The API path, such as ``/v2/packages/active``.
+    :param access_token: The access token for authentication.
+    :param params: Additional query string parameters, such as ``licenseNumber``.
+    :param page_size: Number of records per page.
+    :param max_workers: Maximum number of pages to load at the same time.
+    :param client: The T3Client to use, defaulting to the shared client.
+    :param start_page: The 1-based page to start from.
+    :param query: A Query to filter and sort the records with.
+    :param on_total: Called with the total number of records the API reports, or None if it doesn't, once the first page is loaded.
+    :return: A generator of response bodies as bytes, one per page.
+    """
+    if query is not None:
+        params = query.params(params)
+
+    first_body = get_page_body(path, access_token, start_page, page_size, params, client)
+    first_page = decode(first_body)
+    if on_total is not None:
+        on_total(first_page.get("total"))
+    if not first_page.get("data"):
+        return
+    yield first_body
+
+    page_count = get_page_count(first_page, page_size)
+    if page_count is None:
+        page = start_page + 1
+        while True:
+            body = get_page_body(path, access_token, page, page_size, params, client)
+            if not decode(body).get("data"):
+                break
+            yield body
+            page += 1
+        return
+
+    yield from _fetch_in_order(
+        lambda page: get_page_body(path, access_token, page, page_size, params, client),
+        range(start_page + 1, page_count + 1),
+        max_workers,
+    )
+
+
+def _fetch_in_order(fetch, pages, max_workers):
+    """
+    Call ``fetch`` for each page number concurrently, yielding the results in page order.
+
+    :param fetch: A function that takes a page number.
+    :param pages: The page numbers to fetch, in order.
+    :param max_workers: Maximum number of pages to load at the same time.
+    :return: A generator of ``fetch`` results.
+    """
+    pages = iter(pages)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        while True:
+            # Keep a bounded number of pages in flight ahead of the consumer
+            while len(pending) < max_workers * 2:
+                page = next(pages, None)
+                if page is None:
+                    break
+                pending.append(executor.submit(fetch, page))
+            if not pending:
+                return
+
+            # Wait on the oldest request so pages are yielded in order
+            yield pending.popleft().result()
@@ -0,0 +1,169 @@
+"""
+CSV export that decodes and flattens pages in a process pool.
+
+Once pages are fetched concurrently, decoding JSON, flattening nested objects
+and serializing rows in a single thread becomes the slowest part of a large
+export. ``ParallelCsvWriter`` hands each page to a worker process, which
+writes it to its own CSV shard, and then concatenates the shards in page
+order, so an export can use every core.
+"""
+
+import csv
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from t3.csv_writer import ColumnRegistry
+from t3.decoding import decode
+from t3.query import compile_fields, project
+from t3.sinks import flatten_record
+
+
+def _write_shard(page, shard_path, fields):
+    """
+    Decode and flatten one page, and write it to a CSV shard. Runs in a worker process.
+
+    :param page: The page's response body as bytes, or a list of record dicts.
+    :param shard_path: File path for the shard CSV.
+    :param fields: A tree from ``compile_fields`` to project records with, or None to keep every field.
+    :return: The shard's columns and its number of rows.
+    """
+    records = decode(page).get("data", []) if isinstance(page, (bytes, bytearray)) else page
+    registry = ColumnRegistry()
+    rows = []
+    for record in records:
+        if fields is not None:
+            record = project(record, fields)
+        row = flatten_record(record)
+        registry.add(row.keys())
+        rows.append(row)
+
+    with open(shard_path, "w", newline="") as shard:
+        writer = csv.writer(shard)
+        writer.writerow(registry.columns)
+        writer.writerows(registry.row(row) for row in rows)
+    return registry.columns, len(rows)
+
+
+def _concatenate_shards(shards, output_file, columns):
+    """
+    Join CSV shards into one output file under a single header.
+
+    Shards that already have the full set of columns are copied as they are.
+    Others have their rows rearranged to match the header and padded with
+    empty values.
+
+    :param shards: ``(path, columns)`` pairs, in the order the rows should appear.
+    :param output_file: File path for the output CSV.
+    :param columns: The complete list of columns.
+    """
+    with open(output_file, "w", newline="") as output:
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        for shard_path, shard_columns in shards:
+            with open(shard_path, newline="") as shard:
+                if shard_columns == columns:
+                    shard.readline()  # Skip the shard's header
+                    shutil.copyfileobj(shard, output)
+                    continue
+
+                positions = {column: index for index, column in enumerate(shard_columns)}
+                indexes = [positions.get(column) for column in columns]
+                reader = csv.reader(shard)
+                next(reader)
+                for row in reader:
+                    writer.writerow(["" if index is None else row[index] for index in indexes])
+
+
+class ParallelCsvWriter:
+    """
+    Writes pages of records to a CSV file using a pool of worker processes.
+
+    Each page is sent to a worker, which decodes it if it is a raw response
+    body, flattens nested objects such as a package's ``item`` into dotted
+    columns like ``item.name``, and writes the rows to a numbered shard in a
+    ``.shards`` directory next to the output. On ``close()`` the shards are
+    concatenated in page order under a header holding every column seen, in
+    the order they were first seen, and the shard directory is removed.
+
+    Only a small window of pages waits on the workers at once, so memory use
+    stays flat. Pages can be response bodies from
+    ``t3.pagination.iter_page_bodies``, which moves JSON decoding into the
+    workers too, or lists of record dicts. This has the same interface as the
+    sinks in ``t3.sinks``.
+    """
+
+    def __init__(self, output_file, processes=None, fields=None):
+        """
+        :param output_file: File path for the output CSV.
+        :param processes: Number of worker processes, defaulting to the number of CPUs.
+        :param fields: Field names to keep in each record, as for ``compile_fields``, or None to keep every field.
+        """
+        self.path = output_file
+        self.processes = processes or os.cpu_count() or 1
+        self.rows_written = 0
+        self._fields = compile_fields(fields) if fields else None
+        self._shard_dir = f"{output_file}.shards"
+        self._registry = ColumnRegistry()
+        self._shards = []
+        self._pending = deque()
+        self._shard_count = 0
+        self._executor = None
+
+    def _collect(self):
+        # Wait on the oldest shard so shards are recorded in page order
+        shard_path, future = self._pending.popleft()
+        columns, rows = future.result()
+        if rows:
+            self._registry.add(columns)
+            self._shards.append((shard_path, columns))
+            self.rows_written += rows
+
+    def write_page(self, page):
+        """
+        Send a page to a worker process to be written.
+
+        :param page: A response body as bytes, or a list of dicts.
+        """
+        if not page:
+            return
+
+        if self._executor is None:
+            os.makedirs(self._shard_dir, exist_ok=True)
+            self._executor = ProcessPoolExecutor(max_workers=self.processes)
+
+        self._shard_count += 1
+        shard_path = os.path.join(self._shard_dir, f"{self._shard_count:06d}.csv")
+        self._pending.append((shard_path, self._executor.submit(_write_shard, page, shard_path, self._fields)))
+        while len(self._pending) > self.processes * 2:
+            self._collect()
+
+    def close(self):
+        """
+        Wait for the workers and join the shards into the output file. Calling it again does nothing.
+
+        :return: The number of rows written.
+        """
+        if self._executor is None:
+            return self.rows_written
+
+        while self._pending:
+            self._collect()
+        self._executor.shutdown()
+        self._executor = None
+        if self._shards:
+            _concatenate_shards(self._shards, self.path, self._registry.columns)
+        shutil.rmtree(self._shard_dir)
+        return self.rows_written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+            shutil.rmtree(self._shard_dir, ignore_errors=True)
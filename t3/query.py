@@ -0,0 +1,155 @@
+from datetime import date, datetime, timezone
+
+
+def format_value(value):
+    """
+    Format a filter value the way the API expects it.
+
+    :param value: A string, number, date or datetime. Naive datetimes are taken to be UTC.
+    :return: The value as a string.
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+class Query:
+    """
+    Builds the ``filter`` and ``sort`` query string parameters for list endpoints.
+
+    Filters use the API's ``field__operator:value`` syntax, as in
+    ``filter=manifestNumber__contains:0001234``, and sorts use ``field:asc`` or
+    ``field:desc``. Each method returns the query, so calls can be chained::
+
+        query = Query().between("lastModified", since, until).sort("lastModified")
+
+    Filtering and sorting happen on the server, so records that don't match are
+    never sent.
+    """
+
+    def __init__(self):
+        self.filters = []
+        self.sorts = []
+
+    def where(self, field, operator, value):
+        """
+        Add a filter.
+
+        :param field: The field to filter on, such as ``manifestNumber``.
+        :param operator: The comparison, such as ``eq``, ``contains``, ``gte`` or ``lte``.
+        :param value: The value to compare against.
+        :return: The query.
+        """
+        self.filters.append(f"{field}__{operator}:{format_value(value)}")
+        return self
+
+    def equals(self, field, value):
+        return self.where(field, "eq", value)
+
+    def contains(self, field, value):
+        return self.where(field, "contains", value)
+
+    def between(self, field, start=None, end=None):
+        """
+        Limit a field, usually a timestamp, to a range. Either end can be left open.
+
+        :param field: The field to filter on, such as ``lastModified``.
+        :param start: The earliest value to include, or None for no lower bound.
+        :param end: The latest value to include, or None for no upper bound.
+        :return: The query.
+        """
+        if start is not None:
+            self.where(field, "gte", start)
+        if end is not None:
+            self.where(field, "lte", end)
+        return self
+
+    def sort(self, field, descending=False):
+        """
+        Add a sort key. Records are sorted by the keys in the order they were added.
+
+        :param field: The field to sort on.
+        :param descending: Whether to sort from highest to lowest.
+        :return: The query.
+        """
+        self.sorts.append(f"{field}:{'desc' if descending else 'asc'}")
+        return self
+
+    def params(self, params=None):
+        """
+        Build the query string parameters, merged with any others for the request.
+
+        :param params: Other query string parameters, such as ``licenseNumber``.
+        :return: A new dict of parameters. Repeated filters and sorts are given as lists.
+        """
+        merged = dict(params or {})
+        for name, values in (("filter", self.filters), ("sort", self.sorts)):
+            if len(values) == 1:
+                merged[name] = values[0]
+            elif values:
+                merged[name] = list(values)
+        return merged
+
+
+def compile_fields(fields):
+    """
+    Turn a list of field names into a tree used by ``project``.
+
+    :param fields: Field names to keep. Dotted names such as ``item.name`` keep one field of a nested object.
+    :return: A dict of field name to None, for fields kept whole, or to a subtree.
+    """
+    tree = {}
+    for field in fields:
+        node = tree
+        parts = field.split(".")
+        for part in parts[:-1]:
+            child = node.get(part, {})
+            if child is None:
+                break  # The whole parent object is already kept
+            node = node.setdefault(part, child)
+        else:
+            node[parts[-1]] = None
+    return tree
+
+
+def project(record, fields):
+    """
+    Keep only some fields of a record.
+
+    :param record: The record dict.
+    :param fields: A tree from ``compile_fields``.
+    :return: A new dict with just the listed fields that the record has.
+    """
+    projected = {}
+    for name, subtree in fields.items():
+        if name not in record:
+            continue
+        value = record[name]
+        if subtree is not None and isinstance(value, dict):
+            value = project(value, subtree)
+        projected[name] = value
+    return projected
+
+
+def project_pages(pages, fields):
+    """
+    Keep only some fields of every record, page by page.
+
+    Each page is trimmed as soon as it is decoded, so the dropped fields are
+    never held in memory alongside later pages or written to any output.
+
+    :param pages: An iterable of pages, where each page is a list of dicts.
+    :param fields: Field names to keep, as for ``compile_fields``, or None to keep every field.
+    :return: A generator of projected pages.
+    """
+    if not fields:
+        yield from pages
+        return
+
+    tree = compile_fields(fields)
+    for records in pages:
+        yield [project(record, tree) for record in records]
@@ -0,0 +1,155 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+INITIAL_RATE = 20.0  # Requests per second to start at
+MIN_RATE = 0.5  # Never slow down below this many requests per second
+MAX_RATE = 50.0  # Never speed up above this many requests per second
+SLOW_START_FACTOR = 1.05  # Multiply the rate by this after each successful request, until the first throttling response
+RATE_INCREASE = 0.5  # Requests per second to add after each successful request, once throttled
+RATE_DECREASE_FACTOR = 0.5  # Multiply the rate by this after a throttling response
+DECREASE_INTERVAL = 1.0  # Seconds during which further throttling responses don't slow down again
+
+BACKOFF_BASE = 0.5  # Seconds to wait before the first retry, before jitter
+BACKOFF_CAP = 30.0  # Longest wait between two retries, in seconds
+
+
+class AdaptiveRateLimiter:
+    """
+    A token bucket rate limiter whose rate adapts to how the API responds.
+
+    Until the API first throttles, every successful request raises the rate by
+    a few percent, so a new limiter reaches full speed within a couple of
+    seconds. After that, every successful request nudges the rate up a little,
+    and a 429 or 503 response cuts it in half (additive increase,
+    multiplicative decrease), so the rate settles just under the API's limit.
+    Throttling responses to requests that were already in flight when the rate
+    was cut don't cut it again. A ``Retry-After`` value pauses
+    every caller until it has passed. One limiter is safe to share between
+    threads, and should be, so that all workers draw from the same budget.
+    """
+
+    def __init__(
+        self,
+        rate=INITIAL_RATE,
+        min_rate=MIN_RATE,
+        max_rate=MAX_RATE,
+        increase=RATE_INCREASE,
+        decrease_factor=RATE_DECREASE_FACTOR,
+        slow_start_factor=SLOW_START_FACTOR,
+        decrease_interval=DECREASE_INTERVAL,
+    ):
+        """
+        :param rate: Requests per second to start at.
+        :param min_rate: Lowest rate to slow down to.
+        :param max_rate: Highest rate to speed up to.
+        :param increase: Requests per second to add after each success, once throttled.
+        :param decrease_factor: Factor to multiply the rate by after throttling.
+        :param slow_start_factor: Factor to multiply the rate by after each success, until the first throttling.
+        :param decrease_interval: Seconds after slowing down during which further throttling doesn't slow down again.
+        """
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.slow_start_factor = slow_start_factor
+        self.decrease_interval = decrease_interval
+        self._slow_start = True
+        self._decreased_at = None
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token if one is available, without blocking.
+
+        :return: 0 if a request may be sent now, otherwise the number of seconds to wait before asking again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            # Allow a burst of up to one second's worth of requests, but always
+            # room for one, or rates below one per second could never send
+            self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """
+        Block until a request is allowed to be sent.
+        """
+        while True:
+            wait = self.reserve()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def on_success(self):
+        """
+        Record a successful request and speed up.
+        """
+        with self._lock:
+            if self._slow_start:
+                self.rate = min(self.max_rate, self.rate * self.slow_start_factor)
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after=None):
+        """
+        Record a throttling response and slow down.
+
+        :param retry_after: Seconds the API asked to wait before retrying, if given.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._slow_start = False
+            if self._decreased_at is None or now - self._decreased_at >= self.decrease_interval:
+                self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+                self._decreased_at = now
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+
+def parse_retry_after(value):
+    """
+    Parse a ``Retry-After`` header into a number of seconds.
+
+    :param value: The header value, either a number of seconds or an HTTP date.
+    :return: The number of seconds to wait, or None if the value is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """
+    Pick how long to wait before a retry, using exponential backoff with full jitter.
+
+    :param attempt: The number of retries already made, starting at 0.
+    :param base: Seconds to wait before the first retry, before jitter.
+    :param cap: Longest wait between two retries, in seconds.
+    :return: The number of seconds to wait.
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
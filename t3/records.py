@@ -0,0 +1,150 @@
+"""
+Compact record types for the API's most common objects.
+
+A record keeps only a fixed set of fields in slots instead of a dict, so it
+takes much less memory than the decoded JSON object, and fields outside the
+set are dropped while decoding. When ``msgspec`` is installed the record
+types are ``msgspec.Struct`` classes and are decoded straight from the
+response bytes. Otherwise they are plain slotted classes built from dicts.
+
+Records also behave like read-only dicts (``keys()``, ``items()``, ``get()``
+and ``record[field]``), so they can be written to any sink unchanged.
+"""
+
+from typing import Any
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+PACKAGE_FIELDS = (
+    "id",
+    "label",
+    "packageType",
+    "item",
+    "quantity",
+    "unitOfMeasureName",
+    "locationName",
+    "sourceHarvestNames",
+    "productionBatchNumber",
+    "labTestingState",
+    "packagedDate",
+    "isOnHold",
+    "archivedDate",
+    "finishedDate",
+    "lastModified",
+)
+TRANSFER_FIELDS = (
+    "id",
+    "manifestNumber",
+    "shipperFacilityLicenseNumber",
+    "shipperFacilityName",
+    "shipmentTypeName",
+    "deliveryCount",
+    "receivedDeliveryCount",
+    "packageCount",
+    "receivedPackageCount",
+    "createdDateTime",
+    "lastModified",
+)
+LICENSE_FIELDS = (
+    "id",
+    "licenseNumber",
+    "licenseName",
+    "hostname",
+)
+
+
+class RecordMapping:
+    """
+    Read-only dict methods for record types, based on their field names.
+    """
+
+    __slots__ = ()
+    _fields = ()  # Named like namedtuple's, so it can't clash with an API field
+
+    def keys(self):
+        return self._fields
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in self._fields]
+
+    def get(self, field, default=None):
+        return getattr(self, field, default) if field in self._fields else default
+
+    def __getitem__(self, field):
+        if field not in self._fields:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __contains__(self, field):
+        return field in self._fields
+
+    def to_dict(self):
+        return dict(self.items())
+
+
+class SlottedRecord(RecordMapping):
+    """
+    Base class for record types when msgspec isn't installed.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for field in self._fields:
+            setattr(self, field, values.get(field))
+
+    def __repr__(self):
+        values = ", ".join(f"{field}={getattr(self, field)!r}" for field in self._fields)
+        return f"{type(self).__name__}({values})"
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls.__new__(cls)
+        for field in cls._fields:
+            setattr(record, field, data.get(field))
+        return record
+
+
+if msgspec is not None:
+
+    class StructRecord(msgspec.Struct, RecordMapping, gc=False):
+        """
+        Base class for record types decoded directly by msgspec.
+
+        Decoded JSON holds no reference cycles, so records can skip garbage
+        collector tracking, which saves memory and GC time.
+        """
+
+        @classmethod
+        def from_dict(cls, data):
+            return msgspec.convert(data, cls)
+
+
+def define_record(name, fields):
+    """
+    Create a compact record type.
+
+    Every field is optional and defaults to None. Nested objects, such as a
+    package's ``item``, are kept as plain dicts.
+
+    :param name: The class name.
+    :param fields: The field names to keep.
+    :return: The new record class.
+    """
+    fields = tuple(fields)
+    if msgspec is not None:
+        return msgspec.defstruct(
+            name,
+            [(field, Any, None) for field in fields],
+            bases=(StructRecord,),
+            namespace={"_fields": fields},
+        )
+    return type(name, (SlottedRecord,), {"__slots__": fields, "_fields": fields})
+
+
+Package = define_record("Package", PACKAGE_FIELDS)
+Transfer = define_record("Transfer", TRANSFER_FIELDS)
+License = define_record("License", LICENSE_FIELDS)
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+RESPONSE_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".t3", "responses.sqlite3")  # Shared between runs
+MAX_MEMORY_ENTRIES = 1024  # Responses kept in memory per process
+MAX_DISK_BYTES = 256 * 1024 * 1024  # Total size of response bodies kept on disk
+
+# Seconds to cache each endpoint's responses for. Endpoints not listed here
+# are never cached. Transfer deliveries and packages are left out because
+# they keep changing until a transfer is received.
+DEFAULT_TTLS = {
+    "/v2/licenses": 60 * 60,
+    "/v2/packages/labresults": 60 * 60,
+}
+
+
+class CacheEntry:
+    """
+    A cached response body with its validator and expiry time.
+    """
+
+    __slots__ = ("body", "etag", "expires_at")
+
+    def __init__(self, body, etag, expires_at):
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+
+    @property
+    def fresh(self):
+        return time.time() < self.expires_at
+
+
+class ResponseCache:
+    """
+    A two-level cache of API responses for slow-changing reference endpoints.
+
+    Responses are kept in an in-memory LRU and in a SQLite database on disk,
+    so separate script runs, such as several scripts chained in a pipeline,
+    reuse each other's data. Entries are keyed by the user the request was
+    made for, the API path and the query parameters. Each endpoint has its
+    own TTL. Expired entries that came with an ``ETag`` are revalidated with
+    ``If-None-Match`` rather than refetched. The disk store is trimmed back to
+    ``max_disk_bytes`` by evicting the least recently used entries.
+
+    A cache instance is safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        cache_file=RESPONSE_CACHE_FILE,
+        ttls=None,
+        max_memory_entries=MAX_MEMORY_ENTRIES,
+        max_disk_bytes=MAX_DISK_BYTES,
+    ):
+        """
+        :param cache_file: File path of the SQLite database, or None to only cache in memory.
+        :param ttls: A dict of API path to TTL in seconds, defaulting to DEFAULT_TTLS.
+        :param max_memory_entries: Maximum number of responses kept in memory.
+        :param max_disk_bytes: Maximum total size of response bodies kept on disk.
+        """
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+
+        if cache_file:
+            cache_dir = os.path.dirname(cache_file)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            # Cached responses hold license and package data, so keep the file private to this user.
+            # SQLite gives its journal files the same permissions as the database.
+            os.close(os.open(cache_file, os.O_WRONLY | os.O_CREAT, 0o600))
+            os.chmod(cache_file, 0o600)
+            self._connection = sqlite3.connect(cache_file, check_same_thread=False)
+            with self._connection:
+                self._connection.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS responses (
+                        key TEXT PRIMARY KEY,
+                        body BLOB NOT NULL,
+                        etag TEXT,
+                        expires_at REAL NOT NULL,
+                        last_used REAL NOT NULL,
+                        size INTEGER NOT NULL
+                    )
+                    """
+                )
+
+    def ttl_for(self, path):
+        """
+        :param path: The API path, such as ``/v2/licenses``.
+        :return: The TTL in seconds for the endpoint, or None if it isn't cached.
+        """
+        return self.ttls.get(path)
+
+    @staticmethod
+    def make_key(identity, path, params):
+        """
+        Build a cache key for a request.
+
+        :param identity: Who the request is made for, such as ``hostname/username``.
+        :param path: The API path.
+        :param params: The query string parameters.
+        :return: The cache key as a string.
+        """
+        raw = json.dumps([identity, path, sorted((params or {}).items())], default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Look up a cached response, fresh or not.
+
+        :param key: The cache key.
+        :return: A CacheEntry, or None if nothing is cached for the key.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+
+            if self._connection is None:
+                return None
+            row = self._connection.execute(
+                "SELECT body, etag, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            entry = CacheEntry(bytes(row[0]), row[1], row[2])
+            self._remember(key, entry)
+            with self._connection:
+                self._connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            return entry
+
+    def put(self, key, body, etag, ttl):
+        """
+        Cache a response.
+
+        :param key: The cache key.
+        :param body: The raw response body.
+        :param etag: The response's ``ETag`` header, if any.
+        :param ttl: Seconds the response stays fresh for.
+        """
+        entry = CacheEntry(body, etag, time.time() + ttl)
+        with self._lock:
+            self._remember(key, entry)
+            if self._connection is None:
+                return
+            with self._connection:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, body, etag, expires_at, last_used, size) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, body, etag, entry.expires_at, time.time(), len(body)),
+                )
+                self._evict()
+
+    def refresh(self, key, entry, ttl):
+        """
+        Extend a cached response's lifetime after the API confirmed it is unchanged.
+
+        :param key: The cache key.
+        :param entry: The CacheEntry that was revalidated.
+        :param ttl: Seconds the response stays fresh for.
+        """
+        entry.expires_at = time.time() + ttl
+        with self._lock:
+            self.revalidations += 1
+            if self._connection is None:
+                return
+            with self._connection:
+                self._connection.execute(
+                    "UPDATE responses SET expires_at = ?, last_used = ? WHERE key = ?",
+                    (entry.expires_at, time.time(), key),
+                )
+
+    def record(self, hit):
+        """
+        Count a cache hit or miss.
+
+        :param hit: Whether the lookup was served from the cache.
+        """
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """
+        :return: A dict of hit, miss and revalidation counts.
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "revalidations": self.revalidations}
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        total_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_bytes <= self.max_disk_bytes:
+            return
+
+        rows = self._connection.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall()
+        for key, size in rows:
+            if total_bytes <= self.max_disk_bytes:
+                break
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._memory.pop(key, None)
+            total_bytes -= size
@@ -0,0 +1,111 @@
+"""
+One authenticated API session per Metrc hostname.
+
+Companies licensed in several states sign in to a different Metrc hostname
+for each one. A SessionRegistry keeps a Session per hostname, each with its
+own T3Client, so every state has its own connection pool and adaptive rate
+limiter and throttling in one state doesn't slow down the others, and its
+own TokenManager with that hostname's credentials and OTP handling.
+"""
+
+import threading
+
+from t3.auth import TokenManager
+from t3.client import T3Client
+from t3.credentials import credential_providers, load_secrets, resolve_credentials
+from t3.metrics import get_metrics
+from t3.pagination import iter_pages
+from t3.records import License
+from t3.response_cache import ResponseCache
+
+
+class Session:
+    """
+    The client and access token for one Metrc hostname.
+    """
+
+    def __init__(self, hostname, username, client, access_token):
+        """
+        :param hostname: The hostname of the Metrc instance.
+        :param username: The username the session is signed in as.
+        :param client: The T3Client used for this hostname.
+        :param access_token: The TokenManager for this hostname and username.
+        """
+        self.hostname = hostname
+        self.username = username
+        self.client = client
+        self.access_token = access_token
+
+    def get_json(self, path, params=None, record_type=None):
+        return self.client.get_json(path, self.access_token, params=params, record_type=record_type)
+
+    def get_licenses(self):
+        return self.get_json("/v2/licenses", record_type=License)
+
+    def iter_pages(self, path, params=None, **kwargs):
+        """
+        Yield each page of records from a paginated endpoint. See ``t3.pagination.iter_pages``.
+        """
+        return iter_pages(path, self.access_token, params, client=self.client, **kwargs)
+
+
+class SessionRegistry:
+    """
+    Creates and holds one Session per hostname, on first use.
+
+    Credentials for each hostname are resolved as in ``t3.credentials``. An
+    OTP provider can also be given per hostname, which takes the place of the
+    credentials' OTP source. The registry is safe to share between threads,
+    and concurrent lookups of a new hostname create a single session.
+    """
+
+    def __init__(self, secrets=None, interactive=False, otp_providers=None, client_factory=None):
+        """
+        :param secrets: A dict from ``t3.credentials.load_secrets``, or None to load the default secrets file.
+        :param interactive: Whether to prompt for a missing password or OTP instead of failing.
+        :param otp_providers: A dict of hostname to a callable returning a One-Time Password.
+        :param client_factory: A callable returning a new T3Client for each hostname, defaulting to one like the shared client.
+        """
+        self.secrets = load_secrets() if secrets is None else secrets
+        self.interactive = interactive
+        self.otp_providers = dict(otp_providers or {})
+        self._client_factory = client_factory
+        self._response_cache = None
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _new_client(self):
+        if self._client_factory is not None:
+            return self._client_factory()
+        # Cached responses are keyed by account, so every hostname can share one cache
+        if self._response_cache is None:
+            self._response_cache = ResponseCache()
+        return T3Client(response_cache=self._response_cache, metrics=get_metrics())
+
+    def session(self, hostname, username=None):
+        """
+        Return the session for a hostname, creating it on first use.
+
+        :param hostname: The hostname of the Metrc instance.
+        :param username: The username, defaulting to the one in the environment or secrets file.
+        :return: A Session.
+        """
+        with self._lock:
+            session = self._sessions.get(hostname)
+            if session is None:
+                credentials = resolve_credentials(hostname, username, self.secrets)
+                password_provider, otp_provider = credential_providers(credentials, self.interactive)
+                otp_provider = self.otp_providers.get(hostname, otp_provider)
+                client = self._new_client()
+                access_token = TokenManager(hostname, credentials.username, password_provider, otp_provider, client=client)
+                session = Session(hostname, credentials.username, client, access_token)
+                self._sessions[hostname] = session
+            return session
+
+    @property
+    def hostnames(self):
+        """
+        The hostnames with sessions so far, in the order they were created.
+        """
+        with self._lock:
+            return list(self._sessions)
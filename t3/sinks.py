@@ -0,0 +1,395 @@
+"""
+Output sinks for writing pages of API records.
+
+Every sink has the same interface: ``write_page(records)`` appends a list of
+record dicts, ``close()`` finishes the output and returns the number of rows
+written, and ``path`` is where the output ends up. Calling ``close()`` again
+once a sink is closed does nothing but return the row count. Sinks are also
+context managers that only finalize their output when no exception was raised.
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+from contextlib import ExitStack
+
+from t3.csv_writer import ColumnRegistry, CsvWriter
+from t3.metrics import get_metrics
+
+INDEXED_COLUMNS = ("label", "packageId", "manifestNumber")  # Columns to index in SQLite output
+SQLITE_BATCH_SIZE = 5000  # Number of rows to insert per SQLite transaction
+PARQUET_BATCH_SIZE = 50000  # Number of rows per Parquet row group
+
+
+def flatten_record(record, prefix=""):
+    """
+    Flatten nested dicts into dotted column names.
+
+    For example ``{"item": {"name": "Flower"}}`` becomes ``{"item.name": "Flower"}``.
+    Lists are stored as JSON strings, since they don't map onto a single column.
+
+    :param record: A record dict, possibly containing nested dicts and lists.
+    :param prefix: Prefix for the flattened keys, used when recursing.
+    :return: A flat dict.
+    """
+    flat = {}
+    for key, value in record.items():
+        column = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_record(value, f"{column}."))
+        elif isinstance(value, list):
+            flat[column] = json.dumps(value)
+        else:
+            flat[column] = value
+    return flat
+
+
+def _quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SqliteSink:
+    """
+    Writes records into a table in a SQLite database.
+
+    Nested fields are flattened into dotted column names, new columns are added
+    as they appear, and rows are inserted in batches. Any of ``label``,
+    ``packageId`` and ``manifestNumber`` that are present are indexed once
+    loading is finished, which is much faster than maintaining the indexes
+    during the bulk insert. An existing table with the same name is replaced.
+    """
+
+    def __init__(self, database_path, table, batch_size=SQLITE_BATCH_SIZE):
+        """
+        :param database_path: File path of the SQLite database.
+        :param table: Name of the table to write to.
+        :param batch_size: Number of rows to insert per transaction.
+        """
+        self.path = database_path
+        self.table = table
+        self.batch_size = batch_size
+        self.rows_written = 0
+        self._registry = ColumnRegistry()
+        self._table_columns = 0
+        self._batch = []
+        self._connection = None
+
+    def _open(self):
+        database_dir = os.path.dirname(self.path)
+        if database_dir:
+            os.makedirs(database_dir, exist_ok=True)
+        self._connection = sqlite3.connect(self.path)
+        with self._connection:
+            self._connection.execute(f"DROP TABLE IF EXISTS {_quote_identifier(self.table)}")
+
+    def _sync_columns(self):
+        new_columns = self._registry.columns[self._table_columns :]
+        if not new_columns:
+            return
+
+        table = _quote_identifier(self.table)
+        with self._connection:
+            if self._table_columns == 0:
+                columns = ", ".join(_quote_identifier(column) for column in new_columns)
+                self._connection.execute(f"CREATE TABLE {table} ({columns})")
+            else:
+                for column in new_columns:
+                    self._connection.execute(f"ALTER TABLE {table} ADD COLUMN {_quote_identifier(column)}")
+        self._table_columns = len(self._registry.columns)
+
+    def _flush(self):
+        if not self._batch:
+            return
+
+        self._sync_columns()
+        columns = self._registry.columns
+        placeholders = ", ".join("?" for _ in columns)
+        column_names = ", ".join(_quote_identifier(column) for column in columns)
+        with self._connection:
+            self._connection.executemany(
+                f"INSERT INTO {_quote_identifier(self.table)} ({column_names}) VALUES ({placeholders})",
+                ([record.get(column) for column in columns] for record in self._batch),
+            )
+        self._batch = []
+
+    def write_page(self, records):
+        """
+        Append a page of records to the table.
+
+        :param records: A list of dicts.
+        """
+        if not records:
+            return
+        if self._connection is None:
+            self._open()
+
+        for record in records:
+            flat = flatten_record(record)
+            self._registry.add(flat.keys())
+            self._batch.append(flat)
+        self.rows_written += len(records)
+
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+
+    def close(self):
+        """
+        Insert any remaining rows, build the indexes and close the database. Calling it again does nothing.
+
+        :return: The number of rows written.
+        """
+        if self._connection is None:
+            return self.rows_written
+
+        self._flush()
+        with self._connection:
+            for column in INDEXED_COLUMNS:
+                if column in self._registry.columns:
+                    index = _quote_identifier(f"{self.table}_{column}_idx")
+                    self._connection.execute(
+                        f"CREATE INDEX IF NOT EXISTS {index} ON {_quote_identifier(self.table)} ({_quote_identifier(column)})"
+                    )
+        self._connection.close()
+        self._connection = None
+        return self.rows_written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class ParquetSink:
+    """
+    Writes records into a Parquet dataset using pyarrow.
+
+    Nested fields are flattened into dotted column names and rows are written
+    in large row groups. The output path is a directory of ``part-NNNNN.parquet``
+    files. A new part is started whenever a batch brings new columns or types
+    that don't fit the current part's schema.
+
+    Parts are written to a staging directory (the output path plus ``.part``).
+    On ``close()`` every part is rewritten to one unified schema if the parts
+    differ, a ``_common_metadata`` file with that schema is added, and the
+    staging directory replaces the output directory, so a rerun never mixes
+    old parts with new ones. Columns holding integers in one part and floats
+    in another become floats, and other conflicting types become text. Tools
+    such as pyarrow.dataset, DuckDB and Spark read the directory as one table.
+
+    Requires the optional ``pyarrow`` package.
+    """
+
+    def __init__(self, output_dir, batch_size=PARQUET_BATCH_SIZE):
+        """
+        :param output_dir: Directory to write the Parquet parts to.
+        :param batch_size: Number of rows per row group.
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow. Install it with: pip install pyarrow")
+
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = output_dir
+        self.batch_size = batch_size
+        self._staging_dir = f"{output_dir}.part"
+        self.rows_written = 0
+        self._registry = ColumnRegistry()
+        self._batch = []
+        self._writer = None
+        self._part = 0
+        self._closed = False
+
+    def _build_table(self):
+        arrays = {}
+        for column in self._registry.columns:
+            values = [record.get(column) for record in self._batch]
+            try:
+                arrays[column] = self._pa.array(values)
+            except (self._pa.ArrowInvalid, self._pa.ArrowTypeError):
+                # The column mixes types within the batch, so store it as text
+                arrays[column] = self._pa.array([None if value is None else str(value) for value in values])
+        return self._pa.table(arrays)
+
+    def _flush(self):
+        if not self._batch:
+            return
+
+        table = self._build_table()
+        if self._writer is not None:
+            try:
+                table = table.cast(self._writer.schema)
+            except (self._pa.ArrowInvalid, self._pa.ArrowNotImplementedError, self._pa.ArrowTypeError, ValueError):
+                # The schema changed, so finish this part and start another
+                self._writer.close()
+                self._writer = None
+
+        if self._writer is None:
+            if self._part == 0:
+                # Drop anything an interrupted run left behind
+                shutil.rmtree(self._staging_dir, ignore_errors=True)
+                os.makedirs(self._staging_dir)
+            part_path = os.path.join(self._staging_dir, f"part-{self._part:05d}.parquet")
+            self._writer = self._pq.ParquetWriter(part_path, table.schema)
+            self._part += 1
+
+        self._writer.write_table(table)
+        self._batch = []
+
+    def _unified_schema(self, schemas):
+        pa = self._pa
+        fields = {}
+        for schema in schemas:
+            for field in schema:
+                current = fields.get(field.name)
+                if current is None or pa.types.is_null(current.type):
+                    fields[field.name] = field
+                elif pa.types.is_null(field.type) or field.type == current.type:
+                    continue
+                elif all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in (field.type, current.type)):
+                    fields[field.name] = pa.field(field.name, pa.float64())
+                else:
+                    fields[field.name] = pa.field(field.name, pa.string())
+        return pa.schema([fields[column] for column in self._registry.columns if column in fields])
+
+    def _conform_part(self, part_path, schema):
+        # Rewrite a part with every column of the unified schema, in order
+        table = self._pq.read_table(part_path)
+        columns = []
+        for field in schema:
+            if field.name not in table.column_names:
+                columns.append(self._pa.nulls(table.num_rows, field.type))
+                continue
+            try:
+                columns.append(table[field.name].cast(field.type))
+            except (self._pa.ArrowInvalid, self._pa.ArrowNotImplementedError, self._pa.ArrowTypeError):
+                # Types without a cast to text, such as lists, are stored as their text form
+                values = table[field.name].to_pylist()
+                columns.append(self._pa.array([None if value is None else str(value) for value in values], field.type))
+
+        temp_path = f"{part_path}.tmp"
+        self._pq.write_table(self._pa.Table.from_arrays(columns, schema=schema), temp_path)
+        os.replace(temp_path, part_path)
+
+    def _finish_dataset(self):
+        parts = sorted(
+            os.path.join(self._staging_dir, name) for name in os.listdir(self._staging_dir) if name.endswith(".parquet")
+        )
+        schemas = [self._pq.read_schema(part) for part in parts]
+        schema = self._unified_schema(schemas)
+        for part, part_schema in zip(parts, schemas):
+            if not part_schema.equals(schema, check_metadata=False):
+                self._conform_part(part, schema)
+        self._pq.write_metadata(schema, os.path.join(self._staging_dir, "_common_metadata"))
+
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.replace(self._staging_dir, self.path)
+
+    def write_page(self, records):
+        """
+        Append a page of records to the dataset.
+
+        :param records: A list of dicts.
+        """
+        for record in records:
+            flat = flatten_record(record)
+            self._registry.add(flat.keys())
+            self._batch.append(flat)
+        self.rows_written += len(records)
+
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+
+    def close(self):
+        """
+        Write any remaining rows, unify the parts' schemas and move the dataset into place.
+
+        Calling it again once the sink is closed does nothing.
+
+        :return: The number of rows written.
+        """
+        if self._closed:
+            return self.rows_written
+        self._closed = True
+
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._finish_dataset()
+        elif not self.rows_written and os.path.isdir(self.path):
+            shutil.rmtree(self.path)  # Nothing was written, so don't leave the last run's parts behind
+        return self.rows_written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+SINK_EXTENSIONS = {
+    "csv": ".csv",
+    "sqlite": ".sqlite3",
+    "parquet": ".parquet",
+}
+
+
+def open_sink(output_format, output_file, table):
+    """
+    Open an output sink for a format.
+
+    The extension of ``output_file`` is replaced to suit the format, so scripts
+    can keep a single ``.csv`` output template.
+
+    :param output_format: One of ``csv``, ``sqlite`` or ``parquet``.
+    :param output_file: File path for the output, such as ``output/packages_20240101.csv``.
+    :param table: Table name used by formats that have tables, such as ``packages``.
+    :return: A sink instance.
+    """
+    if output_format not in SINK_EXTENSIONS:
+        raise ValueError(f"Unknown output format: {output_format}")
+
+    path = os.path.splitext(output_file)[0] + SINK_EXTENSIONS[output_format]
+    if output_format == "sqlite":
+        return SqliteSink(path, table)
+    if output_format == "parquet":
+        return ParquetSink(path)
+    return CsvWriter(path)
+
+
+def write_pages(pages, sink):
+    """
+    Write pages of records to a sink as they arrive, then close it.
+
+    Time spent writing, but not waiting for pages, is recorded as the
+    ``write`` phase in the shared metrics. If writing fails, the sink is
+    left unfinished as its context manager does; otherwise it is closed
+    exactly once.
+
+    :param pages: An iterable of pages, where each page is a list of dicts.
+    :param sink: The sink to write to.
+    :return: The number of rows written.
+    """
+    metrics = get_metrics()
+    with ExitStack() as stack:
+        stack.enter_context(sink)
+        for records in pages:
+            with metrics.timer("write"):
+                sink.write_page(records)
+        stack.pop_all()  # Every page was written, so close the sink below rather than on exit
+    with metrics.timer("write"):
+        return sink.close()
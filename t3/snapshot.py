@@ -0,0 +1,157 @@
+"""
+Export a dataset for every license across several Metrc hostnames at once.
+
+Each hostname's licenses are listed, then every hostname and license is
+exported concurrently into one partitioned dataset::
+
+    output/packages_20240101/
+        hostname=ca.metrc.com/licenseNumber=C11-0000001-LIC/data.parquet
+        hostname=mi.metrc.com/licenseNumber=AU-P-000001/data.parquet
+        _manifest.json
+
+The directory layout is the Hive partitioning scheme, so pyarrow.dataset,
+DuckDB and Spark read the whole directory as one table. Every row also gets
+``hostname`` and ``licenseNumber`` columns, so CSV and SQLite partitions can
+simply be concatenated. ``_manifest.json`` lists each partition with the
+number of rows written and the total the API reported.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from t3.sinks import open_sink, write_pages
+
+DATASETS = {
+    "packages": "/v2/packages/active",
+    "transfers": "/v2/transfers/outgoing/active",
+}
+MAX_WORKERS = 8  # Maximum number of licenses to export at the same time, across all hostnames
+MANIFEST_FILE = "_manifest.json"
+
+
+def partition_path(output_dir, hostname, license_number):
+    """
+    :return: The directory for one hostname and license within a partitioned dataset.
+    """
+    return os.path.join(output_dir, f"hostname={hostname}", f"licenseNumber={license_number}")
+
+
+def add_columns(pages, columns):
+    """
+    Add the same columns to every record, page by page.
+
+    :param pages: An iterable of pages, where each page is a list of records.
+    :param columns: A dict of column name to value.
+    :return: A generator of pages of new dicts.
+    """
+    for records in pages:
+        yield [dict(record.items(), **columns) for record in records]
+
+
+def export_partition(session, dataset, license_number, output_dir, output_format, query=None, fields=None):
+    """
+    Export one license's records into its partition.
+
+    :return: A manifest entry with the partition's path (None if no rows were written), rows written and the total the API reported.
+    :raises RuntimeError: If rows were written but the partition's output doesn't exist.
+    """
+    path = partition_path(output_dir, session.hostname, license_number)
+    os.makedirs(path, exist_ok=True)
+
+    totals = []
+    pages = session.iter_pages(
+        DATASETS[dataset], {"licenseNumber": license_number}, query=query, fields=fields, on_total=totals.append
+    )
+    columns = {"hostname": session.hostname, "licenseNumber": license_number}
+    sink = open_sink(output_format, os.path.join(path, "data.csv"), table=dataset)
+    rows = write_pages(add_columns(pages, columns), sink)
+
+    # Only report output that is really there, so the manifest can be trusted
+    exists = os.path.exists(sink.path)
+    if rows and not exists:
+        raise RuntimeError(f"Wrote {rows} rows but {sink.path} doesn't exist")
+    return {
+        "hostname": session.hostname,
+        "licenseNumber": license_number,
+        "path": os.path.relpath(sink.path, output_dir) if exists else None,
+        "rows": rows,
+        "reportedTotal": totals[0] if totals else None,
+    }
+
+
+def export_snapshot(
+    registry,
+    hostnames,
+    dataset,
+    output_dir,
+    output_format="csv",
+    max_workers=MAX_WORKERS,
+    query=None,
+    fields=None,
+    usernames=None,
+):
+    """
+    Export a dataset for every license of several hostnames into one partitioned output.
+
+    Licenses are listed for all hostnames concurrently, then the licenses of
+    every hostname are exported side by side through a single bounded pool.
+    Each hostname uses its own session from the registry, so signing in and
+    rate limiting happen per state. A license that fails doesn't stop the
+    others; it is recorded in the manifest with its error, as is a hostname
+    that couldn't be signed in to or whose licenses couldn't be listed.
+
+    :param registry: The SessionRegistry to get each hostname's session from.
+    :param hostnames: The Metrc hostnames to export.
+    :param dataset: A key of DATASETS, such as ``packages``.
+    :param output_dir: Directory for the partitioned dataset.
+    :param output_format: One of ``csv``, ``sqlite`` or ``parquet``.
+    :param max_workers: Maximum number of licenses to export at the same time.
+    :param query: A Query to filter and sort the records with on the server.
+    :param fields: Field names to keep in each record, or None to keep every field.
+    :param usernames: A dict of hostname to the username to sign in as, for hostnames whose username isn't the default.
+    :return: The manifest entries, one per license, in hostname and license order. Failed entries have an ``error``.
+    """
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset: {dataset}")
+
+    usernames = usernames or {}
+
+    def list_licenses(hostname):
+        # Sessions are created here so a hostname without usable credentials only fails itself
+        try:
+            session = registry.session(hostname, usernames.get(hostname))
+            return session, session.get_licenses(), None
+        except Exception as e:
+            return None, [], e
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for hostname, (session, licenses, error) in zip(hostnames, executor.map(list_licenses, hostnames)):
+            if error is not None:
+                print(f"Failed to list licenses for {hostname}: {error}")
+                futures.append((hostname, None, None, error))
+            for license in licenses:
+                license_number = license["licenseNumber"]
+                future = executor.submit(
+                    export_partition, session, dataset, license_number, output_dir, output_format, query, fields
+                )
+                futures.append((session.hostname, license_number, future, None))
+
+        for hostname, license_number, future, error in futures:
+            if future is None:
+                manifest.append({"hostname": hostname, "licenseNumber": None, "error": str(error)})
+                continue
+            try:
+                entry = future.result()
+                print(f"Exported {entry['rows']} {dataset} for {hostname}/{license_number}")
+            except Exception as e:
+                entry = {"hostname": hostname, "licenseNumber": license_number, "error": str(e)}
+                print(f"Failed to export {dataset} for {hostname}/{license_number}: {e}")
+            manifest.append(entry)
+
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w") as file:
+        json.dump({"dataset": dataset, "format": output_format, "partitions": manifest}, file, indent=2)
+    return manifest
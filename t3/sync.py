@@ -0,0 +1,293 @@
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+from t3.pagination import MAX_WORKERS, PAGE_SIZE, iter_pages
+from t3.query import Query
+
+WATERMARK_OVERLAP = timedelta(minutes=10)  # Refetch records modified this long before the watermark
+RECONCILE_INTERVAL = timedelta(hours=24)  # How often a delta sync also drops records no longer listed
+
+
+class SyncStore:
+    """
+    A local SQLite snapshot of API records, with a last-modified watermark per
+    license and endpoint.
+
+    The watermark is the newest ``lastModified`` value seen in the previous
+    sync, so later syncs only need to ask the API for records changed since
+    then and merge them into the snapshot. The time each license and endpoint
+    was last reconciled against a full listing of record keys is kept too.
+    """
+
+    def __init__(self, database_path):
+        """
+        :param database_path: File path of the SQLite database.
+        """
+        database_dir = os.path.dirname(database_path)
+        if database_dir:
+            os.makedirs(database_dir, exist_ok=True)
+
+        self.connection = sqlite3.connect(database_path)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS watermarks (
+                license_number TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                watermark TEXT,
+                synced_at TEXT NOT NULL,
+                PRIMARY KEY (license_number, endpoint)
+            );
+            CREATE TABLE IF NOT EXISTS records (
+                license_number TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                record_key TEXT NOT NULL,
+                last_modified TEXT,
+                data TEXT NOT NULL,
+                PRIMARY KEY (license_number, endpoint, record_key)
+            );
+            CREATE TABLE IF NOT EXISTS reconciliations (
+                license_number TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                reconciled_at TEXT NOT NULL,
+                PRIMARY KEY (license_number, endpoint)
+            );
+            """
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_watermark(self, license_number, endpoint):
+        """
+        :param license_number: The license number.
+        :param endpoint: The API path the records came from.
+        :return: The watermark from the last sync, or None if there hasn't been one.
+        """
+        row = self.connection.execute(
+            "SELECT watermark FROM watermarks WHERE license_number = ? AND endpoint = ?",
+            (license_number, endpoint),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, license_number, endpoint, watermark):
+        """
+        :param license_number: The license number.
+        :param endpoint: The API path the records came from.
+        :param watermark: The newest last-modified value that has been synced.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO watermarks (license_number, endpoint, watermark, synced_at) VALUES (?, ?, ?, ?)",
+            (license_number, endpoint, watermark, datetime.now(timezone.utc).isoformat()),
+        )
+
+    def get_reconciled_at(self, license_number, endpoint):
+        """
+        :param license_number: The license number.
+        :param endpoint: The API path the records came from.
+        :return: When the snapshot was last reconciled, as an aware datetime, or None if it never was.
+        """
+        row = self.connection.execute(
+            "SELECT reconciled_at FROM reconciliations WHERE license_number = ? AND endpoint = ?",
+            (license_number, endpoint),
+        ).fetchone()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    def set_reconciled_at(self, license_number, endpoint):
+        """
+        Record that the snapshot was just reconciled.
+
+        :param license_number: The license number.
+        :param endpoint: The API path the records came from.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO reconciliations (license_number, endpoint, reconciled_at) VALUES (?, ?, ?)",
+            (license_number, endpoint, datetime.now(timezone.utc).isoformat()),
+        )
+
+    def remove_missing(self, license_number, endpoint, record_keys):
+        """
+        Remove the snapshot records whose keys aren't in a listing.
+
+        :param license_number: The license number.
+        :param endpoint: The API path the records came from.
+        :param record_keys: Every record key that is still listed, as strings.
+        :return: The number of records removed.
+        """
+        self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS listed_keys (record_key TEXT PRIMARY KEY)")
+        self.connection.execute("DELETE FROM listed_keys")
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO listed_keys (record_key) VALUES (?)", ((key,) for key in record_keys)
+        )
+        cursor = self.connection.execute(
+            "DELETE FROM records WHERE license_number = ? AND endpoint = ?"
+            " AND record_key NOT IN (SELECT record_key FROM listed_keys)",
+            (license_number, endpoint),
+        )
+        return cursor.rowcount
+
+    def clear(self, license_number, endpoint):
+        """
+        Remove every snapshot record for a license and endpoint.
+
+        :param license_number: The license number.
+        :param endpoint: The API path the records came from.
+        """
+        self.connection.execute(
+            "DELETE FROM records WHERE license_number = ? AND endpoint = ?",
+            (license_number, endpoint),
+        )
+
+    def upsert(self, license_number, endpoint, records, key_field, modified_field):
+        """
+        Insert or replace records in the snapshot.
+
+        :param license_number: The license number.
+        :param endpoint: The API path the records came from.
+        :param records: A list of record dicts.
+        :param key_field: The field that uniquely identifies a record.
+        :param modified_field: The field holding the record's last-modified timestamp.
+        """
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO records (license_number, endpoint, record_key, last_modified, data) VALUES (?, ?, ?, ?, ?)",
+            (
+                (
+                    license_number,
+                    endpoint,
+                    str(record[key_field]),
+                    record.get(modified_field),
+                    json.dumps(record),
+                )
+                for record in records
+            ),
+        )
+
+    def iter_record_pages(self, license_number, endpoint, page_size=PAGE_SIZE):
+        """
+        Yield the snapshot records for a license and endpoint, a page at a time.
+
+        :param license_number: The license number.
+        :param endpoint: The API path the records came from.
+        :param page_size: Number of records per page.
+        :return: A generator of lists of record dicts.
+        """
+        cursor = self.connection.execute(
+            "SELECT data FROM records WHERE license_number = ? AND endpoint = ? ORDER BY record_key",
+            (license_number, endpoint),
+        )
+        while True:
+            rows = cursor.fetchmany(page_size)
+            if not rows:
+                break
+            yield [json.loads(row[0]) for row in rows]
+
+
+def overlap_start(watermark, overlap=WATERMARK_OVERLAP):
+    """
+    Move a watermark back by an overlap window.
+
+    Records can be modified while a sync pages through them, which can shift
+    them between pages so they are missed, while newer records still move the
+    watermark past them. Starting the next sync a little before the watermark
+    picks such records up again.
+
+    :param watermark: An ISO timestamp.
+    :param overlap: How far to move it back.
+    :return: The earlier ISO timestamp, or the watermark unchanged if it isn't a timestamp.
+    """
+    try:
+        moment = datetime.fromisoformat(watermark.replace("Z", "+00:00"))
+    except ValueError:
+        return watermark
+    return (moment - overlap).isoformat()
+
+
+def sync_records(
+    store,
+    endpoint,
+    access_token,
+    license_number,
+    key_field="id",
+    modified_field="lastModified",
+    full=False,
+    page_size=PAGE_SIZE,
+    max_workers=MAX_WORKERS,
+    reconcile_interval=RECONCILE_INTERVAL,
+):
+    """
+    Bring the local snapshot for a license and endpoint up to date.
+
+    If there is a watermark from an earlier sync, only records modified since
+    shortly before it (see ``overlap_start``) are fetched and merged into the
+    snapshot. Otherwise, or when ``full`` is set, every record is fetched and
+    the snapshot is rebuilt.
+
+    A delta sync never sees records that have dropped out of an ``active``
+    endpoint, so once every ``reconcile_interval`` it also lists the keys of
+    every record and removes the snapshot records that are no longer listed.
+    The listing is loaded before the changes, and records fetched in between
+    are kept, so a record that becomes active during the sync isn't dropped.
+
+    The snapshot and the new watermark are committed together, so an
+    interrupted sync leaves the previous snapshot untouched.
+
+    :param store: The SyncStore to update.
+    :param endpoint: The API path to sync, such as ``/v2/packages/active``.
+    :param access_token: The access token for authentication.
+    :param license_number: The license number to sync.
+    :param key_field: The field that uniquely identifies a record.
+    :param modified_field: The field holding each record's last-modified timestamp.
+    :param full: Whether to ignore the watermark and rebuild the snapshot.
+    :param page_size: Number of records per page.
+    :param max_workers: Maximum number of pages to load at the same time.
+    :param reconcile_interval: How often a delta sync removes records that are no longer listed, or None for every sync.
+    :return: The number of records fetched from the API.
+    """
+    watermark = None if full else store.get_watermark(license_number, endpoint)
+    params = {"licenseNumber": license_number}
+    query = Query().sort(modified_field)
+    if watermark:
+        # Records fetched again are harmless, because they are upserted by key
+        query.between(modified_field, start=overlap_start(watermark))
+
+    listed_keys = None
+    if watermark is not None:
+        reconciled_at = store.get_reconciled_at(license_number, endpoint)
+        if (
+            reconcile_interval is None
+            or reconciled_at is None
+            or datetime.now(timezone.utc) - reconciled_at >= reconcile_interval
+        ):
+            pages = iter_pages(endpoint, access_token, params, page_size, max_workers, fields=[key_field])
+            listed_keys = {str(record[key_field]) for records in pages for record in records}
+
+    fetched = 0
+    newest = watermark
+    with store.connection:
+        if watermark is None:
+            store.clear(license_number, endpoint)
+
+        for records in iter_pages(endpoint, access_token, params, page_size, max_workers, query=query):
+            store.upsert(license_number, endpoint, records, key_field, modified_field)
+            fetched += len(records)
+            for record in records:
+                if listed_keys is not None:
+                    listed_keys.add(str(record[key_field]))
+                modified = record.get(modified_field)
+                if modified and (newest is None or modified > newest):
+                    newest = modified
+
+        if listed_keys is not None:
+            store.remove_missing(license_number, endpoint, listed_keys)
+        if watermark is None or listed_keys is not None:
+            store.set_reconciled_at(license_number, endpoint)
+        store.set_watermark(license_number, endpoint, newest)
+
+    return fetched
@@ -0,0 +1,372 @@
+# A single non-interactive entry point for the export and download scripts
+#
+# Credentials come from T3_USERNAME, T3_PASSWORD and T3_HOSTNAME, or from a
+# secrets file (see t3/credentials.py), so no prompts are needed. For example:
+# python t3_cli.py licenses
+# python t3_cli.py packages --license LIC-00001 --format parquet
+# python t3_cli.py transfers --license LIC-00001 --hostname mi.metrc.com
+# python t3_cli.py manifests --license LIC-00001 --license LIC-00002 --resume
+# python t3_cli.py coas --license LIC-00001 --manifest 0001234567
+#
+# To export every license of several states into one partitioned dataset, use:
+# python t3_cli.py snapshot packages --hostname ca.metrc.com --hostname mi.metrc.com --format parquet
+#
+# To run many jobs in one process, sharing connections and access tokens, put
+# one command per line in a job file and use:
+# python t3_cli.py run jobs.txt --max-jobs 4
+
+import argparse
+import os
+import shlex
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+import download_all_outgoing_manifests as manifests
+import download_all_transfer_coa_pdfs as coas
+import license_data_csv
+import load_all_active_packages as packages
+import write_one_license_outgoing_transfer_data_to_csv as transfers
+from t3.checkpoint import CheckpointJournal
+from t3.credentials import credentials_token_manager, load_secrets, resolve_credentials
+from t3.document_cache import get_document_cache
+from t3.query import Query
+from t3.records import Package, Transfer
+from t3.sessions import SessionRegistry
+from t3.sinks import SINK_EXTENSIONS, open_sink, write_pages
+from t3.snapshot import DATASETS, MAX_WORKERS as SNAPSHOT_MAX_WORKERS, export_snapshot
+
+OUTPUT_DIR = "output"  # Directory for output files
+OUTPUT_TEMPLATE = os.path.join(OUTPUT_DIR, "{name}_{date}.csv")  # Default output file, before the format's extension
+MAX_JOBS = 4  # Maximum number of jobs from a job file to run at the same time
+
+
+def default_output(name, output_format):
+    date_stamp = datetime.now().strftime("%Y%m%d")
+    output_file = OUTPUT_TEMPLATE.format(name=name, date=date_stamp)
+    return os.path.splitext(output_file)[0] + SINK_EXTENSIONS[output_format]
+
+
+def access_token_for(args):
+    """
+    Create the token manager for a command's hostname and username.
+
+    Token managers are shared per hostname and username, so every job in a
+    process that uses the same account authenticates once.
+    """
+    secrets = load_secrets(args.secrets_file) if args.secrets_file else None
+    credentials = resolve_credentials(args.hostname, args.username, secrets)
+    return credentials_token_manager(credentials, interactive=args.interactive)
+
+
+def query_for(args):
+    return Query().between("lastModified", args.modified_since, args.modified_until)
+
+
+def run_licenses(args):
+    access_token = access_token_for(args)
+    licenses = license_data_csv.get_licenses(access_token)  # Every field, not just the compact License record's
+    output_file = args.output or default_output(f"licenses_{access_token.hostname}", args.format)
+    written = write_pages([licenses], open_sink(args.format, output_file, table="licenses"))
+    return f"Wrote {written} licenses to {output_file}"
+
+
+def run_packages(args):
+    if args.processes is not None and (args.processes < 1 or args.format != "csv" or args.compact):
+        raise ValueError("--processes takes a positive number and only applies to CSV exports without --compact")
+
+    access_token = access_token_for(args)
+    output_file = args.output or default_output(f"packages_{args.license}", args.format)
+    if args.processes:
+        written = packages.export_packages_in_parallel(
+            access_token, args.license, output_file, args.processes, query=query_for(args), fields=args.fields
+        )
+    else:
+        pages = packages.iter_package_pages(
+            access_token,
+            args.license,
+            query=query_for(args),
+            fields=args.fields,
+            record_type=Package if args.compact else None,
+        )
+        written = write_pages(pages, open_sink(args.format, output_file, table="packages"))
+    return f"Wrote {written} packages for {args.license} to {output_file}"
+
+
+def run_transfers(args):
+    access_token = access_token_for(args)
+    output_file = args.output or default_output(f"transfers_{args.license}", args.format)
+    totals = []
+    pages = transfers.iter_outgoing_transfer_pages(
+        access_token,
+        args.license,
+        query=query_for(args),
+        fields=args.fields,
+        record_type=Transfer if args.compact else None,
+        on_total=totals.append,
+    )
+    written = write_pages(pages, open_sink(args.format, output_file, table="transfers"))
+    total = totals[0] if totals else None
+    if total is not None and written != total:
+        print(f"Warning: the API reported {total} transfers for {args.license}, but {written} were written")
+    return f"Wrote {written} transfers for {args.license} to {output_file}"
+
+
+def run_manifests(args):
+    access_token = access_token_for(args)
+    license_numbers = args.license or [license["licenseNumber"] for license in manifests.get_licenses(access_token)]
+    name = "_".join(args.license) if args.license else access_token.hostname
+    journal = CheckpointJournal(os.path.join(manifests.CHECKPOINT_DIR, f"manifests_{name}.jsonl"), resume=args.resume)
+    manifests.download_all_manifests(access_token, license_numbers, journal=journal)
+    journal.close(completed=True)
+    return f"Downloaded manifests for {len(license_numbers)} licenses"
+
+
+def run_coas(args):
+    if not args.manifest.isdigit():
+        raise ValueError("Manifest number must be a string of digits.")
+
+    access_token = access_token_for(args)
+    os.makedirs(coas.OUTPUT_DIR, exist_ok=True)
+    coas.get_outgoing_transfer(access_token, args.license, args.manifest)  # Fails early for unknown manifests
+    destinations = coas.get_transfer_destinations(access_token, args.license, args.manifest)
+    journal = CheckpointJournal(
+        os.path.join(coas.CHECKPOINT_DIR, f"coas_{args.license}_{args.manifest}.jsonl"), resume=args.resume
+    )
+    coas.download_destination_coa_pdfs(
+        access_token,
+        args.license,
+        destinations,
+        document_cache=get_document_cache(coas.COA_CACHE_DIR, coas.COA_CACHE_MAX_BYTES),
+        journal=journal,
+    )
+    journal.close(completed=True)
+    return f"Downloaded COAs for manifest {args.manifest}"
+
+
+def run_snapshot(args):
+    secrets = load_secrets(args.secrets_file)
+    # Without --hostname, every hostname in the secrets file is exported, as
+    # the user named in a "hostname/username" key if there is one
+    usernames = {}
+    for key in secrets:
+        hostname, _, username = key.partition("/")
+        if usernames.get(hostname) is None:
+            usernames[hostname] = username or None
+    hostnames = args.hostname or list(usernames)
+    if args.username:
+        usernames = {hostname: args.username for hostname in hostnames}
+    if not hostnames:
+        raise ValueError("No hostnames to export. Pass --hostname or add hostnames to the secrets file.")
+
+    registry = SessionRegistry(secrets, interactive=args.interactive)
+    date_stamp = datetime.now().strftime("%Y%m%d")
+    output_dir = args.output_dir or os.path.join(OUTPUT_DIR, f"{args.dataset}_{date_stamp}")
+    manifest = export_snapshot(
+        registry,
+        hostnames,
+        args.dataset,
+        output_dir,
+        args.format,
+        max_workers=args.max_workers,
+        query=query_for(args),
+        fields=args.fields,
+        usernames=usernames,
+    )
+
+    failed = [entry for entry in manifest if "error" in entry]
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(manifest)} partitions failed. See {output_dir}")
+    rows = sum(entry["rows"] for entry in manifest)
+    return f"Wrote {rows} {args.dataset} from {len(manifest)} licenses in {len(hostnames)} hostnames to {output_dir}"
+
+
+def read_job_file(path):
+    """
+    Read a job file: one command line per line, with blank lines and ``#`` comments ignored.
+
+    :return: A list of argument lists.
+    """
+    jobs = []
+    with open(path) as file:
+        for line in file:
+            job = shlex.split(line, comments=True)
+            if job:
+                jobs.append(job)
+    return jobs
+
+
+def run_jobs(args):
+    """
+    Run every job in a job file, several at a time, in this process.
+
+    Jobs share the API client's connection pool and the token managers, so
+    each account authenticates once for the whole file. Every job line is
+    parsed up front, so a typo fails the run before any job starts. A failed
+    job doesn't stop the others.
+    """
+    parser = build_parser()
+    jobs = []
+    for job in read_job_file(args.job_file):
+        if job[0] == "run":
+            raise ValueError("Job files can't contain run commands")
+        job_args = parser.parse_args(job)
+        job_args.interactive = False  # Jobs run in parallel, so they can't share the terminal
+        if job_args.secrets_file is None:
+            job_args.secrets_file = args.secrets_file
+        jobs.append((shlex.join(job), job_args))
+
+    def run(job):
+        line, job_args = job
+        try:
+            return line, job_args.handler(job_args), None
+        except Exception as e:
+            return line, None, e
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.max_jobs) as executor:
+        for line, result, error in executor.map(run, jobs):
+            if error is None:
+                print(f"[done] {line}: {result}")
+            else:
+                failed += 1
+                print(f"[failed] {line}: {error}")
+
+    if failed:
+        raise RuntimeError(f"{failed} of {len(jobs)} jobs failed")
+    return f"Ran {len(jobs)} jobs"
+
+
+def add_export_arguments(parser, name):
+    parser.add_argument("--license", required=True, help="the license number to export")
+    parser.add_argument("--format", choices=sorted(SINK_EXTENSIONS), default="csv", help="output format (default: csv)")
+    parser.add_argument("--output", help="output file (default: output/<name>_<license>_<date> with the format's extension)")
+    parser.add_argument(
+        "--fields",
+        type=lambda value: value.split(","),
+        help=f"comma-separated {name} fields to export (default: all)",
+    )
+    parser.add_argument(
+        "--modified-since", type=datetime.fromisoformat, help=f"only export {name}s modified at or after this ISO date or time"
+    )
+    parser.add_argument(
+        "--modified-until", type=datetime.fromisoformat, help=f"only export {name}s modified at or before this ISO date or time"
+    )
+    parser.add_argument(
+        "--compact", action="store_true", help=f"decode {name}s into compact records with only the most used fields"
+    )
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--hostname", help="Metrc hostname (default: T3_HOSTNAME, or ca.metrc.com)")
+    common.add_argument("--username", help="Metrc username (default: T3_USERNAME, or the secrets file)")
+    common.add_argument(
+        "--secrets-file",
+        help="JSON file of credentials by hostname (default: T3_SECRETS_FILE, or ~/.t3/secrets.json)",
+    )
+    common.add_argument(
+        "--interactive",
+        action="store_true",
+        help="prompt for a password or OTP that isn't in the environment or secrets file",
+    )
+
+    parser = argparse.ArgumentParser(description="Run T3 API exports and downloads without prompts.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    licenses_parser = subparsers.add_parser("licenses", parents=[common], help="export the account's licenses")
+    licenses_parser.add_argument("--format", choices=sorted(SINK_EXTENSIONS), default="csv", help="output format (default: csv)")
+    licenses_parser.add_argument("--output", help="output file (default: output/licenses_<hostname>_<date>)")
+    licenses_parser.set_defaults(handler=run_licenses)
+
+    packages_parser = subparsers.add_parser("packages", parents=[common], help="export a license's active packages")
+    add_export_arguments(packages_parser, "package")
+    packages_parser.add_argument(
+        "--processes", type=int, help="decode, flatten and write the CSV on this many worker processes"
+    )
+    packages_parser.set_defaults(handler=run_packages)
+
+    transfers_parser = subparsers.add_parser("transfers", parents=[common], help="export a license's outgoing transfers")
+    add_export_arguments(transfers_parser, "transfer")
+    transfers_parser.set_defaults(handler=run_transfers)
+
+    manifests_parser = subparsers.add_parser("manifests", parents=[common], help="download outgoing manifest PDFs")
+    manifests_parser.add_argument(
+        "--license", action="append", help="a license number to download manifests for; repeatable (default: every license)"
+    )
+    manifests_parser.add_argument("--resume", action="store_true", help="skip manifests an interrupted run already downloaded")
+    manifests_parser.set_defaults(handler=run_manifests)
+
+    coas_parser = subparsers.add_parser("coas", parents=[common], help="download the COA PDFs of one outgoing transfer")
+    coas_parser.add_argument("--license", required=True, help="the license number that shipped the transfer")
+    coas_parser.add_argument("--manifest", required=True, help="the manifest number of the transfer")
+    coas_parser.add_argument("--resume", action="store_true", help="skip COAs an interrupted run already downloaded")
+    coas_parser.set_defaults(handler=run_coas)
+
+    snapshot_parser = subparsers.add_parser(
+        "snapshot", help="export every license of several hostnames into one partitioned dataset"
+    )
+    snapshot_parser.add_argument("dataset", choices=sorted(DATASETS), help="the records to export")
+    snapshot_parser.add_argument(
+        "--hostname", action="append", help="a Metrc hostname to export; repeatable (default: every hostname in the secrets file)"
+    )
+    snapshot_parser.add_argument(
+        "--username", help="Metrc username for every hostname (default: T3_USERNAME, or the secrets file)"
+    )
+    snapshot_parser.add_argument("--secrets-file", help="JSON file of credentials by hostname (default: T3_SECRETS_FILE, or ~/.t3/secrets.json)")
+    snapshot_parser.add_argument(
+        "--interactive", action="store_true", help="prompt for a password or OTP that isn't in the environment or secrets file"
+    )
+    snapshot_parser.add_argument("--format", choices=sorted(SINK_EXTENSIONS), default="csv", help="output format (default: csv)")
+    snapshot_parser.add_argument("--output-dir", help="directory for the dataset (default: output/<dataset>_<date>)")
+    snapshot_parser.add_argument(
+        "--fields", type=lambda value: value.split(","), help="comma-separated fields to export (default: all)"
+    )
+    snapshot_parser.add_argument(
+        "--modified-since", type=datetime.fromisoformat, help="only export records modified at or after this ISO date or time"
+    )
+    snapshot_parser.add_argument(
+        "--modified-until", type=datetime.fromisoformat, help="only export records modified at or before this ISO date or time"
+    )
+    snapshot_parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=SNAPSHOT_MAX_WORKERS,
+        help=f"maximum number of licenses to export at once (default: {SNAPSHOT_MAX_WORKERS})",
+    )
+    snapshot_parser.set_defaults(handler=run_snapshot)
+
+    run_parser = subparsers.add_parser("run", help="run every command in a job file, several at a time")
+    run_parser.add_argument("job_file", help="file with one command per line, such as: packages --license LIC-00001")
+    run_parser.add_argument(
+        "--max-jobs", type=int, default=MAX_JOBS, help=f"maximum number of jobs to run at once (default: {MAX_JOBS})"
+    )
+    run_parser.add_argument(
+        "--secrets-file",
+        help="secrets file for jobs that don't name their own",
+    )
+    run_parser.set_defaults(handler=run_jobs)
+    return parser
+
+
+def main(argv=None):
+    """
+    Parse the command line, run the command and exit with a non-zero status if it fails.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    try:
+        print(args.handler(args))
+    except requests.exceptions.HTTPError as e:
+        print(f"HTTP error occurred: {e}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
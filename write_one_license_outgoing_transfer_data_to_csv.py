@@ -1,74 +1,116 @@
-import csv
+import argparse
 import getpass
 import requests
 import os
 from datetime import datetime
 
+from t3.auth import get_token_manager
+from t3.client import get_client
+from t3.pagination import iter_pages
+from t3.query import Query, project_pages
+from t3.records import License, Transfer
+from t3.sinks import SINK_EXTENSIONS, open_sink, write_pages
+from t3.sync import SyncStore, sync_records
+
 # Constants
-BASE_URL = "https://api.trackandtrace.tools"
 USERNAME = "YOUR_USERNAME"  # Replace with your actual username
 HOSTNAME = "ca.metrc.com"  # Update this to your specific Metrc hostname
 OUTPUT_DIR = "output"
 OUTPUT_CSV_TEMPLATE = os.path.join(OUTPUT_DIR, "transfers_{}.csv")
+SYNC_DATABASE = os.path.join(OUTPUT_DIR, "sync.sqlite3")  # Local snapshot used by --sync
+TRANSFERS_ENDPOINT = "/v2/transfers/outgoing/active"
+
 
+def get_access_token(hostname, username):
+    def prompt_password():
+        return getpass.getpass(prompt=f"Password for {hostname}/{username}: ")
 
-def get_access_token(hostname, username, password, otp=None):
-    url = f"{BASE_URL}/v2/auth/credentials"
-    data = {"hostname": hostname, "username": username, "password": password}
-    if otp:
-        data["otp"] = otp
+    def prompt_otp():
+        return getpass.getpass(prompt="OTP: ")
 
-    response = requests.post(url, json=data)
-    response.raise_for_status()
-    return response.json()["accessToken"]
+    otp_provider = prompt_otp if hostname == "mi.metrc.com" else None  # Check if OTP is required
+    return get_token_manager(hostname, username, prompt_password, otp_provider)
 
 
 def get_licenses(access_token):
-    url = f"{BASE_URL}/v2/licenses"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return get_client().get_json("/v2/licenses", access_token, record_type=License)
 
 
-def get_outgoing_transfers(access_token, license_number):
-    url = f"{BASE_URL}/v2/transfers/outgoing/active?licenseNumber={license_number}&pageSize=500"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()["data"]
+def iter_outgoing_transfer_pages(access_token, license_number, query=None, fields=None, record_type=None, on_total=None):
+    # Every page is loaded, several at a time, the same way as packages
+    params = {"licenseNumber": license_number}
+    return iter_pages(
+        TRANSFERS_ENDPOINT, access_token, params, query=query, fields=fields, record_type=record_type, on_total=on_total
+    )
 
 
-def write_transfers_to_csv(transfers, output_file):
-    if not transfers:
-        print("No transfers found.")
-        return
+def get_outgoing_transfers(access_token, license_number, query=None, fields=None, record_type=None):
+    transfers = []
+    for page in iter_outgoing_transfer_pages(access_token, license_number, query, fields, record_type):
+        transfers.extend(page)
+    return transfers
 
-    keys = transfers[0].keys()  # Use the first transfer's keys for the CSV headers
 
-    with open(output_file, "w", newline="") as output:
-        dict_writer = csv.DictWriter(output, fieldnames=keys)
-        dict_writer.writeheader()
-        dict_writer.writerows(transfers)
+def sync_outgoing_transfers(access_token, license_number, store, full=False):
+    # Only fetches transfers modified shortly before the last sync or later and
+    # merges them into the local snapshot. Transfers that are no longer active
+    # are dropped on a full sync, and by a delta sync once every RECONCILE_INTERVAL
+    # (see t3.sync.sync_records).
+    return sync_records(store, TRANSFERS_ENDPOINT, access_token, license_number, full=full)
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Write one license's outgoing transfers to a CSV file or another output format.")
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="only fetch transfers changed since the last --sync run and export the merged local snapshot",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="with --sync, refetch every transfer and rebuild the local snapshot",
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(SINK_EXTENSIONS),
+        default="csv",
+        help="output format (default: csv)",
+    )
+    parser.add_argument(
+        "--fields",
+        type=lambda value: value.split(","),
+        help="comma-separated transfer fields to export, such as manifestNumber,shipperFacilityName (default: all)",
+    )
+    parser.add_argument(
+        "--modified-since",
+        type=datetime.fromisoformat,
+        help="only export transfers modified at or after this ISO date or time",
+    )
+    parser.add_argument(
+        "--modified-until",
+        type=datetime.fromisoformat,
+        help="only export transfers modified at or before this ISO date or time",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="decode transfers into compact records with only the most used fields, to save memory and CPU",
+    )
+    args = parser.parse_args()
+    if args.sync and (args.modified_since or args.modified_until):
+        parser.error("--modified-since and --modified-until don't apply to --sync")
+    if args.sync and args.compact:
+        parser.error("--compact doesn't apply to --sync")
+    query = Query().between("lastModified", args.modified_since, args.modified_until)
+
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     date_stamp = datetime.now().strftime("%Y%m%d")
     output_file = OUTPUT_CSV_TEMPLATE.format(date_stamp)
+    sink = open_sink(args.format, output_file, table="transfers")
 
-    password = getpass.getpass(prompt=f"Password for {HOSTNAME}/{USERNAME}: ")
-    otp = None
-    if HOSTNAME == "mi.metrc.com":
-        otp = getpass.getpass(prompt="OTP: ")
     try:
-        access_token = get_access_token(HOSTNAME, USERNAME, password, otp)
+        access_token = get_access_token(HOSTNAME, USERNAME)
         licenses = get_licenses(access_token)
 
         # Display licenses and ask the user to select one
@@ -80,11 +122,34 @@ def main():
         selected_license = licenses[selected_idx]
         selected_license_number = selected_license["licenseNumber"]
 
-        transfers = get_outgoing_transfers(access_token, selected_license_number)
-
-        print(transfers)
-        write_transfers_to_csv(transfers, output_file)
-        print(f"Transfers have been written to {output_file}")
+        if args.sync:
+            with SyncStore(SYNC_DATABASE) as store:
+                fetched = sync_outgoing_transfers(access_token, selected_license_number, store, full=args.full)
+                print(f"Synced {fetched} changed transfers")
+                pages = store.iter_record_pages(selected_license_number, TRANSFERS_ENDPOINT)
+                written = write_pages(project_pages(pages, args.fields), sink)
+        else:
+            totals = []
+            pages = iter_outgoing_transfer_pages(
+                access_token,
+                selected_license_number,
+                query=query,
+                fields=args.fields,
+                record_type=Transfer if args.compact else None,
+                on_total=totals.append,
+            )
+            written = write_pages(pages, sink)
+
+            total = totals[0] if totals else None
+            if total is not None:
+                print(f"Wrote {written} of the {total} transfers the API reported")
+                if written != total:
+                    print("Warning: some transfers were missed, or added while paging. Run the export again to catch them.")
+
+        if written:
+            print(f"Transfers have been written to {sink.path}")
+        else:
+            print("No transfers found.")
 
     except requests.exceptions.HTTPError as e:
         print(f"HTTP error occurred: {e}")
@@ -0,0 +1,230 @@
+# Writes one row per outgoing transfer, delivery, package and lab result for a license
+#
+# To run this script from the command line, use:
+# python write_one_license_transfer_lab_results_to_csv.py
+#
+# To write a SQLite database or Parquet dataset instead of a CSV, use:
+# python write_one_license_transfer_lab_results_to_csv.py --format sqlite
+
+import argparse
+import getpass
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from t3.auth import get_token_manager
+from t3.client import get_client
+from t3.pagination import iter_pages
+from t3.query import Query
+from t3.records import License
+from t3.sinks import SINK_EXTENSIONS, flatten_record, open_sink, write_pages
+
+# Constants
+USERNAME = "YOUR_USERNAME"  # Replace with your actual username
+HOSTNAME = "ca.metrc.com"  # Update this to your specific Metrc hostname
+OUTPUT_DIR = "output"
+OUTPUT_CSV_TEMPLATE = os.path.join(OUTPUT_DIR, "transfer_lab_results_{}.csv")
+TRANSFERS_ENDPOINT = "/v2/transfers/outgoing/active"
+BATCH_SIZE = 50  # Number of transfers whose lookups are loaded together
+MAX_WORKERS = 8  # Maximum number of concurrent delivery, package and lab result lookups
+
+
+def get_access_token(hostname, username):
+    def prompt_password():
+        return getpass.getpass(prompt=f"Password for {hostname}/{username}: ")
+
+    def prompt_otp():
+        return getpass.getpass(prompt="OTP: ")
+
+    otp_provider = prompt_otp if hostname == "mi.metrc.com" else None  # Check if OTP is required
+    return get_token_manager(hostname, username, prompt_password, otp_provider)
+
+
+def get_licenses(access_token):
+    return get_client().get_json("/v2/licenses", access_token, record_type=License)
+
+
+def get_transfer_destinations(access_token, license_number, manifest_number):
+    params = {"licenseNumber": license_number, "manifestNumber": manifest_number}
+    return get_client().get_json("/v2/transfers/deliveries", access_token, params=params)["data"]
+
+
+def get_destination_packages(access_token, license_number, delivery_id):
+    params = {"licenseNumber": license_number, "deliveryId": delivery_id}
+    return get_client().get_json("/v2/transfers/packages", access_token, params=params)["data"]
+
+
+def get_package_lab_results(access_token, license_number, package_id):
+    params = {"licenseNumber": license_number, "packageId": package_id}
+    return get_client().get_json("/v2/packages/labresults", access_token, params=params)["data"]
+
+
+def iter_batches(pages, batch_size):
+    # Regroup pages of records into lists of batch_size records
+    batch = []
+    for records in pages:
+        for record in records:
+            batch.append(record)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def iter_transfer_lab_result_pages(
+    access_token, license_number, query=None, batch_size=BATCH_SIZE, max_workers=MAX_WORKERS, lab_results_by_package=None
+):
+    """
+    Yield the joined transfer, delivery, package and lab result rows for every outgoing transfer of a license.
+
+    Transfers are handled a batch at a time. Each level of lookups runs
+    concurrently across the whole batch: first the deliveries of every
+    transfer, then the packages of every delivery, then the lab results of
+    every package. Lab results are remembered by package ID for the whole
+    run, so a package that appears on several transfers is only looked up
+    once. Rows are yielded one page per transfer, in transfer order.
+
+    Each row is flattened into ``transfer.*``, ``delivery.*``, ``package.*``
+    and ``labResult.*`` columns. Like a left join, a transfer without
+    deliveries, a delivery without packages and a package without lab
+    results each still get a row, with the columns they lack left empty.
+
+    :param access_token: The access token for authentication.
+    :param license_number: The license number whose outgoing transfers to export.
+    :param query: A Query to filter and sort the transfers with on the server.
+    :param batch_size: Number of transfers whose lookups are loaded together.
+    :param max_workers: Maximum number of lookups to run at the same time.
+    :param lab_results_by_package: A dict to memoize lab results in, keyed by package ID, or None for a new one.
+    :return: A generator of lists of row dicts, one list per transfer.
+    """
+    if lab_results_by_package is None:
+        lab_results_by_package = {}
+
+    def load_deliveries(transfer):
+        return get_transfer_destinations(access_token, license_number, transfer["manifestNumber"])
+
+    def load_packages(delivery):
+        return get_destination_packages(access_token, license_number, delivery["id"])
+
+    def load_lab_results(package_id):
+        return get_package_lab_results(access_token, license_number, package_id)
+
+    params = {"licenseNumber": license_number}
+    transfer_pages = iter_pages(TRANSFERS_ENDPOINT, access_token, params, query=query)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for transfers in iter_batches(transfer_pages, batch_size):
+            deliveries_by_transfer = list(executor.map(load_deliveries, transfers))
+            deliveries = [delivery for transfer_deliveries in deliveries_by_transfer for delivery in transfer_deliveries]
+            packages_by_delivery = list(executor.map(load_packages, deliveries))
+
+            # Only look up packages this run hasn't seen yet, each one once
+            new_package_ids = list(
+                dict.fromkeys(
+                    package["packageId"]
+                    for packages in packages_by_delivery
+                    for package in packages
+                    if package["packageId"] not in lab_results_by_package
+                )
+            )
+            lab_results_by_package.update(zip(new_package_ids, executor.map(load_lab_results, new_package_ids)))
+
+            packages_by_delivery = iter(packages_by_delivery)
+            for transfer, transfer_deliveries in zip(transfers, deliveries_by_transfer):
+                rows = []
+                for delivery in transfer_deliveries or [{}]:
+                    packages = next(packages_by_delivery) if delivery else []
+                    for package in packages or [{}]:
+                        lab_results = lab_results_by_package[package["packageId"]] if package else []
+                        for lab_result in lab_results or [{}]:
+                            joined = {"transfer": transfer, "delivery": delivery, "package": package, "labResult": lab_result}
+                            rows.append(flatten_record(joined))
+                yield rows
+
+
+def export_transfer_lab_results(access_token, license_number, sink, query=None, batch_size=BATCH_SIZE):
+    """
+    Write the joined transfer, delivery, package and lab result rows for a license to a sink.
+
+    :param access_token: The access token for authentication.
+    :param license_number: The license number whose outgoing transfers to export.
+    :param sink: The sink to write to, from ``t3.sinks.open_sink``.
+    :param query: A Query to filter and sort the transfers with on the server.
+    :param batch_size: Number of transfers whose lookups are loaded together.
+    :return: The number of rows written, and the number of distinct packages whose lab results were looked up.
+    """
+    lab_results_by_package = {}
+    pages = iter_transfer_lab_result_pages(
+        access_token, license_number, query, batch_size, lab_results_by_package=lab_results_by_package
+    )
+    written = write_pages(pages, sink)
+    return written, len(lab_results_by_package)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write every outgoing transfer of one license, joined with its deliveries, packages and lab results."
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(SINK_EXTENSIONS),
+        default="csv",
+        help="output format (default: csv)",
+    )
+    parser.add_argument(
+        "--modified-since",
+        type=datetime.fromisoformat,
+        help="only export transfers modified at or after this ISO date or time",
+    )
+    parser.add_argument(
+        "--modified-until",
+        type=datetime.fromisoformat,
+        help="only export transfers modified at or before this ISO date or time",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help=f"number of transfers whose lookups are loaded together (default: {BATCH_SIZE})",
+    )
+    args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    query = Query().between("lastModified", args.modified_since, args.modified_until)
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    date_stamp = datetime.now().strftime("%Y%m%d")
+    output_file = OUTPUT_CSV_TEMPLATE.format(date_stamp)
+    sink = open_sink(args.format, output_file, table="transfer_lab_results")
+
+    try:
+        access_token = get_access_token(HOSTNAME, USERNAME)
+        licenses = get_licenses(access_token)
+
+        # Display licenses and ask the user to select one
+        print("Select a license:")
+        for idx, license in enumerate(licenses, 1):
+            print(f"{idx}. {license['licenseNumber']} - {license['licenseName']}")
+
+        selected_idx = int(input("Enter the number of the license to select: ")) - 1
+        selected_license_number = licenses[selected_idx]["licenseNumber"]
+
+        written, package_count = export_transfer_lab_results(
+            access_token, selected_license_number, sink, query=query, batch_size=args.batch_size
+        )
+        print(f"Looked up lab results for {package_count} distinct packages")
+        if written:
+            print(f"Transfer lab results have been written to {sink.path}")
+        else:
+            print("No transfers found.")
+
+    except requests.exceptions.HTTPError as e:
+        print(f"HTTP error occurred: {e}")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+
+if __name__ == "__main__":
+    main()